@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la navigation à facettes (browse_sylius_products)
+
+Génère une base SQLite locale de N produits (catégories sur trois niveaux,
+prix, stock, dates de création), puis mesure la latence p50/p99 d'un
+mélange de requêtes (catégorie, fourchette de prix, stock, dates, tris) sur
+les deux chemins : l'index en mémoire alimenté par le snapshot, et les
+requêtes SQL appuyées sur les index composites. Objectif : p99 < 50 ms à
+100 000 produits, tenu par le chemin en mémoire ; le chemin SQL parcourt
+l'ensemble filtré à chaque appel pour compter les facettes.
+
+Usage : python bench_browse.py [--products 100000] [--database bench_browse.sqlite]
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from browse import BROWSE_SORTS, BrowseFilters, FacetIndex, browse_database
+from catalog import CatalogSnapshot
+from models import (Base, ChannelPricing, Product, ProductTaxon, ProductTranslation, ProductVariant, Taxon,
+                    TaxonTranslation)
+from pricing import SYLIUS_CHANNEL, price_cache
+
+TARGET_P99_MS = 50.0
+# Sous-catégories par niveau sous la racine (3 x 6 x 5 = 90 feuilles)
+BRANCHING = (3, 6, 5)
+INSERT_BATCH = 10000
+
+
+def build_taxons():
+    """Arbre en ensembles imbriqués : [(id, code, parent, gauche, droite, niveau, position)]"""
+    taxons, counter = [], [0]
+
+    def visit(code, parent_id, level, position):
+        counter[0] += 1
+        taxon_id, left = len(taxons) + 1, counter[0]
+        taxons.append([taxon_id, code, parent_id, left, None, level, position])
+        if level < len(BRANCHING):
+            for child in range(BRANCHING[level]):
+                visit(f"{code}_{child}" if parent_id else f"CAT_{child}", taxon_id, level + 1, child)
+        counter[0] += 1
+        taxons[taxon_id - 1][4] = counter[0]
+
+    visit("MENU_CATEGORY", None, 0, 0)
+    return taxons
+
+
+def generate(engine, count, seed=0):
+    """Remplit la base de `count` produits aléatoires mais reproductibles"""
+    rng = random.Random(seed)
+    Base.metadata.create_all(bind=engine)
+    taxons = build_taxons()
+    leaves = [taxon[0] for taxon in taxons if taxon[5] == len(BRANCHING)]
+    start = datetime(2023, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(Taxon), [
+            {"id": t, "code": code, "parent_id": parent, "tree_root": 1, "tree_left": left, "tree_right": right,
+             "tree_level": level, "position": position} for t, code, parent, left, right, level, position in taxons])
+        conn.execute(insert(TaxonTranslation), [
+            {"translatable_id": t, "locale": "en_US", "name": code.replace("_", " ").title(), "slug": code.lower()}
+            for t, code, *_ in taxons])
+        for first in range(1, count + 1, INSERT_BATCH):
+            ids = range(first, min(first + INSERT_BATCH, count + 1))
+            conn.execute(insert(Product), [
+                {"id": pid, "code": f"P{pid}", "enabled": rng.random() > 0.02,
+                 "created_at": start + timedelta(minutes=rng.randrange(700 * 24 * 60))} for pid in ids])
+            conn.execute(insert(ProductTranslation), [
+                {"product_id": pid, "locale": "en_US", "name": f"Product {pid}", "description": "Benchmark product"}
+                for pid in ids])
+            conn.execute(insert(ProductVariant), [
+                {"id": pid, "product_id": pid, "code": f"P{pid}_V", "enabled": True, "tracked": rng.random() > 0.1,
+                 "on_hand": rng.randrange(0, 20), "on_hold": rng.randrange(0, 3)} for pid in ids])
+            conn.execute(insert(ChannelPricing), [
+                {"product_variant_id": pid, "channel_code": SYLIUS_CHANNEL, "price": rng.randrange(500, 30000)}
+                for pid in ids])
+            conn.execute(insert(ProductTaxon), [
+                {"product_id": pid, "taxon_id": taxon_id}
+                for pid in ids for taxon_id in rng.sample(leaves, rng.choice((1, 1, 2)))])
+
+
+def query_mix(rng, taxon_codes, runs):
+    """Requêtes représentatives d'un agent : catégorie, prix, stock, dates et tri"""
+    queries = []
+    for _ in range(runs):
+        low = rng.choice((None, 2000, 5000))
+        queries.append((BrowseFilters(
+            taxon=rng.choice([None] + taxon_codes),
+            price_min=low,
+            price_max=rng.choice((None, 8000, 15000)),
+            min_available=rng.choice((None, 1)),
+            created_after=rng.choice((None, datetime(2024, 1, 1))),
+        ), rng.choice([sort for sort in BROWSE_SORTS if sort != "relevance"])))
+    return queries
+
+
+def measure(browse, queries):
+    latencies = []
+    for filters, sort in queries:
+        start = time.perf_counter()
+        browse(filters, sort)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "max": latencies[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--database", default="bench_browse.sqlite")
+    parser.add_argument("--runs", type=int, default=300)
+    parser.add_argument("--sql-runs", type=int, default=30, help="Requêtes mesurées sur le chemin SQL (plus lent)")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine(f"sqlite:///{args.database}")
+    if not os.path.exists(args.database):
+        start = time.perf_counter()
+        generate(engine, args.products)
+        print(f"📦 {args.products} produits générés dans {args.database} ({time.perf_counter() - start:.1f}s)")
+    db = sessionmaker(bind=engine)()
+    price_cache.load(db)
+
+    start = time.perf_counter()
+    snapshot = CatalogSnapshot(max_staleness=3600)
+    facets = FacetIndex()
+    facets.attach(snapshot)
+    facets.load_taxons(db)
+    snapshot.load_full(db)
+    print(f"🧠 Snapshot et colonnes de facettes : {time.perf_counter() - start:.1f}s "
+          f"(colonnes {facets.last_build_seconds * 1000:.0f} ms)")
+
+    taxon_codes = [code for code in facets.taxon_ids_by_code if code != "MENU_CATEGORY"]
+    queries = query_mix(random.Random(1), taxon_codes, args.runs)
+    results = {
+        "mémoire": measure(lambda f, s: facets.browse(f, sort=s, limit=args.limit), queries),
+        "SQL": measure(lambda f, s: browse_database(db, f, sort=s, limit=args.limit), queries[:args.sql_runs]),
+    }
+
+    print(f"\n{'Chemin':<10} {'p50 (ms)':>10} {'p99 (ms)':>10} {'max (ms)':>10}")
+    for name, stats in results.items():
+        status = "✅" if stats["p99"] < TARGET_P99_MS else "❌"
+        print(f"{name:<10} {stats['p50']:>10.2f} {stats['p99']:>10.2f} {stats['max']:>10.2f}  {status}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark de concurrence du serveur MCP
+
+Mesure le débit et la latence d'un outil Sylius avec 1, 10 puis 100 clients
+simultanés. Pour comparer avant/après, lancer le serveur une fois avec
+DB_OFFLOAD=0 (requêtes exécutées dans la boucle asyncio) puis avec
+DB_OFFLOAD=1 (pool de threads) et comparer les deux rapports.
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BASE_URL = "http://localhost:8001"
+
+
+def call_tool(session, url, payload):
+    """Appelle un outil et retourne la latence en secondes"""
+    start = time.perf_counter()
+    response = session.post(url, json=payload, timeout=60)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def run_level(url, payload, clients, total):
+    """Exécute `total` appels répartis sur `clients` clients concurrents"""
+    sessions = [requests.Session() for _ in range(clients)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = list(pool.map(
+            lambda i: call_tool(sessions[i % clients], url, payload), range(total)
+        ))
+    elapsed = time.perf_counter() - start
+    for session in sessions:
+        session.close()
+    latencies.sort()
+    return {
+        "clients": clients,
+        "requests": total,
+        "throughput": total / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=BASE_URL)
+    parser.add_argument("--tool", default="get_sylius_products")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200, help="Appels par niveau de concurrence")
+    parser.add_argument("--levels", default="1,10,100")
+    args = parser.parse_args()
+
+    url = f"{args.url}/tools/{args.tool}"
+    payload = {"arguments": {"limit": args.limit}}
+
+    # Échauffement (connexions du pool, caches MySQL)
+    requests.post(url, json=payload, timeout=60)
+
+    print(f"🏁 Benchmark {args.tool} sur {args.url}")
+    print(f"{'clients':>8} {'req/s':>10} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+    for clients in (int(level) for level in args.levels.split(",")):
+        stats = run_level(url, payload, clients, max(args.requests, clients))
+        print(f"{stats['clients']:>8} {stats['throughput']:>10.1f} {stats['p50_ms']:>10.1f} {stats['p99_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
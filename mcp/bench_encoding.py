@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark de l'encodage des réponses
+
+Compare, pour 1 000 puis 10 000 produits, l'ancien encodage d'une réponse MCP
+(texte ``json.dumps(indent=2)`` puis passage par ``jsonable_encoder`` et
+``json.dumps`` de FastAPI) avec l'encodage unique et compact d'encoding.py,
+avec le module json standard et avec orjson s'il est installé.
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+
+import encoding
+
+
+def make_products(count):
+    """Produits de la forme renvoyée par serialize_product"""
+    created_at = datetime(2024, 1, 1).isoformat()
+    return [{
+        "id": i,
+        "code": f"PRODUCT_{i}",
+        "name": f"T-Shirt Coton Bio Nº{i}",
+        "description": "T-shirt en coton biologique, coupe droite, lavable à 30°C",
+        "enabled": True,
+        "created_at": created_at,
+        "variants": [{"id": i * 10 + k, "code": f"PRODUCT_{i}_{k}", "price": 29.99,
+                      "on_hand": 100, "tracked": True} for k in range(2)],
+    } for i in range(count)]
+
+
+def legacy(products):
+    text = json.dumps(products, indent=2, ensure_ascii=False)
+    result = {"content": [{"type": "text", "text": text}]}
+    response = {"jsonrpc": "2.0", "id": 1, "result": result}
+    return json.dumps(jsonable_encoder(response), ensure_ascii=False).encode("utf-8")
+
+
+def single_pass(products):
+    text = encoding.dumps_text(products)
+    return b'{"jsonrpc":"2.0","id":1,"result":%s}' % encoding.dumps({"content": [{"type": "text", "text": text}]})
+
+
+def single_pass_stdlib(products):
+    orjson, encoding.orjson = encoding.orjson, None
+    try:
+        return single_pass(products)
+    finally:
+        encoding.orjson = orjson
+
+
+def measure(func, products, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = func(products)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    variants = [("indent + jsonable_encoder", legacy), ("compact (json)", single_pass_stdlib)]
+    if encoding.orjson is not None:
+        variants.append(("compact (orjson)", single_pass))
+
+    print(f"{'produits':>9} {'encodage':<28} {'ms':>9} {'octets':>11}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        products = make_products(size)
+        for label, func in variants:
+            ms, size_bytes = measure(func, products, args.repeat)
+            print(f"{size:>9} {label:<28} {ms:>9.2f} {size_bytes:>11}")
+
+
+if __name__ == "__main__":
+    main()
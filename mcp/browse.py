@@ -0,0 +1,444 @@
+"""
+Navigation à facettes du catalogue : filtres, tris et comptes par facette
+
+Filtres : texte, catégorie (taxon Sylius et tous ses descendants), fourchette
+de prix du canal, disponibilité et date de création. Tris : pertinence,
+nouveautés, prix croissant ou décroissant. Chaque page donne aussi le nombre
+total de produits filtrés et les comptes des facettes sur cet ensemble :
+sous-catégories de la catégorie choisie, tranches de prix, disponibilité.
+
+Avec le snapshot catalogue, ``FacetIndex`` garde une colonne NumPy par
+critère (prix minimal, date de création, meilleure disponibilité) et les
+appartenances produit → catégorie (ancêtres compris) à plat : le masque des
+filtres, les comptes des facettes et le tri partiel de la page sont calculés
+dans le même passage vectorisé. Sans snapshot, ``browse_database`` applique
+les mêmes filtres en SQL, appuyés sur les index composites déclarés dans
+``models.py`` (créés sur une base Sylius existante par ``migrate.py``).
+"""
+import os
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.orm import Session, aliased
+
+from models import ChannelPricing, Product, ProductTaxon, ProductTranslation, ProductVariant, Taxon, TaxonTranslation
+from pricing import SYLIUS_CHANNEL
+from products import pick_translation, variant_available
+
+# Bornes des tranches de la facette prix, en unités de la devise
+PRICE_FACET_EDGES = tuple(
+    float(edge) for edge in os.getenv("PRICE_FACET_EDGES", "20,50,100,200").split(",") if edge.strip()
+)
+BROWSE_SORTS = ("relevance", "newest", "price_asc", "price_desc")
+SCAN_BATCH_SIZE = 10000
+
+# Noms d'une catégorie par locale
+TaxonNames = Dict[str, str]
+
+
+@dataclass(frozen=True)
+class BrowseFilters:
+    """Critères de navigation ; prix en centimes, comme dans Sylius"""
+    query: Optional[str] = None
+    taxon: Optional[str] = None
+    price_min: Optional[int] = None
+    price_max: Optional[int] = None
+    min_available: Optional[int] = None
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+
+
+@dataclass
+class BrowsePage:
+    """Ids de la page, total filtré et comptes bruts des facettes"""
+    ids: List[int]
+    total: int
+    # (code, noms, produits) des sous-catégories non vides
+    taxons: List[Tuple[str, TaxonNames, int]]
+    # Produits par tranche de prix (len(PRICE_FACET_EDGES) + 1 tranches)
+    prices: List[int]
+    in_stock: int
+
+    def facets(self, locales: Sequence[str]) -> Dict[str, Any]:
+        """Facettes présentées à l'utilisateur, noms de catégories dans la chaîne de locales"""
+        bounds = (0.0,) + PRICE_FACET_EDGES + (None,)
+        return {
+            "taxons": [
+                {"code": code, "name": names.get(pick_translation(names, locales), code), "count": count}
+                for code, names, count in self.taxons
+            ],
+            "price": [
+                {"min": bounds[i], "max": bounds[i + 1], "count": count}
+                for i, count in enumerate(self.prices) if count
+            ],
+            "availability": {"in_stock": self.in_stock, "out_of_stock": self.total - self.in_stock},
+        }
+
+
+def _facet_root(roots: List[Any]) -> Optional[Any]:
+    """Catégorie dont les enfants forment la facette sans filtre
+
+    Une racine unique (MENU_CATEGORY dans Sylius) est sautée ; sinon les racines elles-mêmes.
+    """
+    return roots[0] if len(roots) == 1 else None
+
+
+def _price_edges() -> np.ndarray:
+    return np.array([round(edge * 100) for edge in PRICE_FACET_EDGES], dtype=np.float64)
+
+
+# Index en mémoire ---------------------------------------------------------
+
+class FacetIndex:
+    """Colonnes des critères de navigation, suivies depuis le snapshot catalogue"""
+
+    def __init__(self):
+        # Arbre des catégories : id -> (code, parent, position), dans l'ordre de l'arbre
+        self.taxons: Dict[int, Tuple[str, Optional[int], int]] = {}
+        self.taxon_names: Dict[int, TaxonNames] = {}
+        self.taxon_ids_by_code: Dict[str, int] = {}
+        self.children: Dict[Optional[int], List[int]] = {}
+        self.product_taxons: Dict[int, Tuple[int, ...]] = {}
+        # Position de chaque catégorie dans les comptes des facettes
+        self.taxon_index: Dict[int, int] = {}
+        self.signature: Optional[Tuple] = None
+        # Colonnes remplacées en bloc ; les lectures ne prennent pas de verrou
+        self.columns: Optional[Dict[str, np.ndarray]] = None
+        self.built_at: Optional[float] = None
+        self.last_build_seconds = 0.0
+        self._build_lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.columns is not None
+
+    # Catégories ----------------------------------------------------------
+
+    def _signature(self, db: Session) -> Tuple:
+        memberships = db.query(
+            func.count(ProductTaxon.id), func.max(ProductTaxon.id),
+            func.sum(ProductTaxon.product_id * ProductTaxon.taxon_id),
+        ).one()
+        tree = db.query(func.count(Taxon.id), func.max(Taxon.updated_at), func.sum(Taxon.tree_left * Taxon.id)).one()
+        names = db.query(func.count(TaxonTranslation.id), func.max(TaxonTranslation.id)).one()
+        return tuple(str(value) for value in (*memberships, *tree, *names))
+
+    def load_taxons(self, db: Session) -> None:
+        """Lit l'arbre des catégories et les appartenances des produits"""
+        signature = self._signature(db)
+        taxons, children = {}, {}
+        for taxon_id, code, parent_id, position, enabled in db.query(
+                Taxon.id, Taxon.code, Taxon.parent_id, Taxon.position, Taxon.enabled
+        ).order_by(Taxon.tree_root, Taxon.tree_left):
+            taxons[taxon_id] = (code, parent_id, position or 0)
+            if enabled:
+                children.setdefault(parent_id, []).append(taxon_id)
+        for siblings in children.values():
+            siblings.sort(key=lambda taxon_id: (taxons[taxon_id][2], taxon_id))
+        names: Dict[int, TaxonNames] = {}
+        for taxon_id, locale, name in db.query(
+                TaxonTranslation.translatable_id, TaxonTranslation.locale, TaxonTranslation.name):
+            names.setdefault(taxon_id, {})[locale] = name
+        memberships: Dict[int, List[int]] = {}
+        query = db.query(ProductTaxon.product_id, ProductTaxon.taxon_id).yield_per(SCAN_BATCH_SIZE)
+        for product_id, taxon_id in query:
+            memberships.setdefault(product_id, []).append(taxon_id)
+
+        self.taxons, self.taxon_names, self.children = taxons, names, children
+        self.taxon_ids_by_code = {code: taxon_id for taxon_id, (code, _, _) in taxons.items()}
+        self.product_taxons = {pid: tuple(ids) for pid, ids in memberships.items()}
+        self.signature = signature
+
+    def refresh_taxons(self, db: Session, products: Dict[int, Dict[str, Any]]) -> bool:
+        """Relit les catégories si elles ont changé, puis reconstruit les colonnes"""
+        if self.signature is not None and self._signature(db) == self.signature:
+            return False
+        self.load_taxons(db)
+        self.rebuild(products)
+        return True
+
+    def _lineage(self, taxon_id: int) -> List[int]:
+        """La catégorie et ses ancêtres"""
+        lineage, seen = [], set()
+        while taxon_id is not None and taxon_id in self.taxons and taxon_id not in seen:
+            seen.add(taxon_id)
+            lineage.append(taxon_id)
+            taxon_id = self.taxons[taxon_id][1]
+        return lineage
+
+    # Construction --------------------------------------------------------
+
+    def rebuild(self, products: Dict[int, Dict[str, Any]]) -> None:
+        """Colonnes des produits sérialisés du snapshot"""
+        with self._build_lock:
+            start = time.perf_counter()
+            ids = np.array(sorted(products), dtype=np.int64)
+            count = len(ids)
+            price = np.full(count, np.nan)
+            available = np.full(count, -np.inf)
+            created = np.array([products[pid]["created_at"] or "NaT" for pid in ids.tolist()], dtype="datetime64[us]")
+            taxon_index = {taxon_id: i for i, taxon_id in enumerate(self.taxons)}
+            lineages = {taxon_id: [taxon_index[t] for t in self._lineage(taxon_id)] for taxon_id in self.taxons}
+            owner, flat = array("i"), array("i")
+
+            for row, pid in enumerate(ids.tolist()):
+                variants = products[pid]["variants"]
+                prices = [variant["price"] for variant in variants if variant["price"] is not None]
+                if prices:
+                    price[row] = round(min(prices) * 100)
+                for variant in variants:
+                    # Un variant non suivi est toujours disponible
+                    quantity = np.inf if variant["available"] is None else variant["available"]
+                    if quantity > available[row]:
+                        available[row] = quantity
+                members: Set[int] = set()
+                for taxon_id in self.product_taxons.get(pid, ()):
+                    members.update(lineages.get(taxon_id, ()))
+                owner.extend([row] * len(members))
+                flat.extend(sorted(members))
+
+            stamps = created.view(np.int64)
+            no_date = np.isnat(created)
+            self.columns = {
+                "ids": ids,
+                "created": created,
+                "price": price,
+                "available": available,
+                "owner": np.frombuffer(owner, dtype=np.int32).copy(),
+                "taxons": np.frombuffer(flat, dtype=np.int32).copy(),
+                # Clés de tri croissantes, produits sans valeur en dernier
+                "newest": np.where(no_date, np.iinfo(np.int64).max, -np.where(no_date, 0, stamps)),
+                "price_asc": np.where(np.isnan(price), np.inf, price),
+                "price_desc": np.where(np.isnan(price), np.inf, -price),
+            }
+            self.taxon_index = taxon_index
+            self.built_at = time.time()
+            self.last_build_seconds = time.perf_counter() - start
+
+    def attach(self, snapshot) -> None:
+        """Reconstruit les colonnes à chaque changement du snapshot catalogue"""
+        def on_change(changed: Set[int], removed: Set[int]) -> None:
+            if self.signature is not None:
+                self.rebuild(snapshot.products)
+
+        snapshot.add_listener(on_change)
+
+    # Lecture -------------------------------------------------------------
+
+    def browse(self, filters: BrowseFilters, sort: str = "newest", limit: int = 10, offset: int = 0,
+               scores: Optional[Dict[int, float]] = None) -> BrowsePage:
+        """Page triée, total et facettes, en un passage sur les colonnes
+
+        `scores` (id -> pertinence) restreint aux produits trouvés par la recherche texte.
+        ValueError si la catégorie est inconnue.
+        """
+        columns = self.columns
+        ids, owner, flat = columns["ids"], columns["owner"], columns["taxons"]
+        mask = np.ones(len(ids), dtype=bool)
+        if filters.taxon is not None:
+            parent = self.taxon_ids_by_code.get(filters.taxon)
+            if parent is None:
+                raise ValueError(f"Unknown taxon '{filters.taxon}'")
+            member = np.zeros(len(ids), dtype=bool)
+            member[owner[flat == self.taxon_index[parent]]] = True
+            mask &= member
+        else:
+            parent = _facet_root(self.children.get(None, []))
+        price = columns["price"]
+        if filters.price_min is not None:
+            mask &= price >= filters.price_min
+        if filters.price_max is not None:
+            mask &= price <= filters.price_max
+        if filters.min_available is not None:
+            mask &= columns["available"] >= filters.min_available
+        if filters.created_after is not None:
+            mask &= columns["created"] >= np.datetime64(filters.created_after, "us")
+        if filters.created_before is not None:
+            mask &= columns["created"] <= np.datetime64(filters.created_before, "us")
+        relevance = None
+        if scores is not None:
+            relevance = np.full(len(ids), np.inf)
+            if len(ids) and scores:
+                found = np.fromiter(scores, dtype=np.int64, count=len(scores))
+                rows = np.minimum(np.searchsorted(ids, found), len(ids) - 1)
+                known = ids[rows] == found
+                relevance[rows[known]] = -np.fromiter(scores.values(), dtype=np.float64, count=len(scores))[known]
+            mask &= np.isfinite(relevance)
+
+        selected = np.flatnonzero(mask)
+        # Facettes sur l'ensemble filtré
+        counts = np.bincount(flat[mask[owner]], minlength=len(self.taxon_index))
+        taxons = [
+            (self.taxons[child][0], self.taxon_names.get(child, {}), int(counts[self.taxon_index[child]]))
+            for child in self.children.get(parent, ())
+            if counts[self.taxon_index[child]]
+        ]
+        priced = price[selected]
+        priced = priced[~np.isnan(priced)]
+        prices = np.bincount(np.searchsorted(_price_edges(), priced, side="right"),
+                             minlength=len(PRICE_FACET_EDGES) + 1)
+        in_stock = int(np.count_nonzero(columns["available"][selected] >= 1))
+
+        # Tri partiel : seuls les offset + limit premiers sont ordonnés (égalités départagées par id)
+        if sort == "relevance":
+            keys = relevance if relevance is not None else columns["newest"]
+        else:
+            keys = columns[sort]
+        wanted = offset + limit
+        rows, row_keys = selected, keys[selected]
+        if 0 < wanted < len(rows):
+            threshold = np.partition(row_keys, wanted - 1)[wanted - 1]
+            keep = row_keys <= threshold
+            rows, row_keys = rows[keep], row_keys[keep]
+        order = rows[np.lexsort((ids[rows], row_keys))][offset:wanted] if wanted > 0 else rows[:0]
+        return BrowsePage(
+            ids=ids[order].tolist(),
+            total=len(selected),
+            taxons=taxons,
+            prices=prices.tolist(),
+            in_stock=in_stock,
+        )
+
+    def stats(self) -> Dict[str, object]:
+        columns = self.columns
+        return {
+            "loaded": self.loaded,
+            "products": len(columns["ids"]) if columns is not None else 0,
+            "taxons": len(self.taxons),
+            "memberships": len(columns["taxons"]) if columns is not None else 0,
+            "built_at": self.built_at,
+            "last_build_seconds": round(self.last_build_seconds, 6),
+        }
+
+
+facet_index = FacetIndex()
+
+
+# Requêtes SQL -------------------------------------------------------------
+
+def browse_database(db: Session, filters: BrowseFilters, sort: str = "newest", limit: int = 10, offset: int = 0,
+                    scores: Optional[Dict[int, float]] = None, channel: str = SYLIUS_CHANNEL) -> BrowsePage:
+    """Même navigation que FacetIndex.browse, évaluée par MySQL
+
+    `scores` (id -> pertinence) restreint aux produits trouvés par la recherche
+    texte et sert le tri par pertinence ; sans lui, la requête est un `LIKE`
+    et ce tri est refusé. ValueError si la catégorie est inconnue ou si le tri
+    par pertinence n'a pas de scores.
+    """
+    if sort == "relevance" and scores is None:
+        raise ValueError("Sorting by relevance needs the search index, which is not loaded")
+    where = [Product.enabled == True]
+    parent = None
+    if filters.taxon is not None:
+        parent = db.query(Taxon.id, Taxon.tree_root, Taxon.tree_left, Taxon.tree_right).filter(
+            Taxon.code == filters.taxon).first()
+        if parent is None:
+            raise ValueError(f"Unknown taxon '{filters.taxon}'")
+        # Descendants par ensembles imbriqués (idx_mcp_taxon_tree), puis produits (idx_mcp_product_taxon_taxon)
+        descendants = select(Taxon.id).where(
+            Taxon.tree_root == parent.tree_root, Taxon.tree_left.between(parent.tree_left, parent.tree_right))
+        where.append(Product.id.in_(select(ProductTaxon.product_id).where(ProductTaxon.taxon_id.in_(descendants))))
+    if filters.min_available is not None:
+        where.append(Product.variants.any(variant_available(filters.min_available)))
+    if filters.created_after is not None:
+        where.append(Product.created_at >= filters.created_after)
+    if filters.created_before is not None:
+        where.append(Product.created_at <= filters.created_before)
+    if scores is not None:
+        # Mêmes produits que la recherche BM25 du chemin en mémoire
+        where.append(Product.id.in_(list(scores)))
+    elif filters.query:
+        query = filters.query
+        where.append(Product.translations.any(
+            ProductTranslation.name.contains(query) | ProductTranslation.description.contains(query)))
+
+    # Prix minimal des variants actifs dans le canal (idx_mcp_channel_pricing_price), joint une
+    # fois : une sous-requête corrélée serait réévaluée à chaque usage du prix
+    prices = (
+        select(ProductVariant.product_id.label("product_id"), func.min(ChannelPricing.price).label("price"))
+        .join(ChannelPricing, ChannelPricing.product_variant_id == ProductVariant.id)
+        .where(ProductVariant.enabled == True, ChannelPricing.channel_code == channel)
+        .group_by(ProductVariant.product_id)
+        .subquery("prices")
+    )
+    columns = [
+        Product.id.label("id"),
+        Product.created_at.label("created_at"),
+        prices.c.price.label("price"),
+        Product.variants.any(variant_available(1)).label("in_stock"),
+    ]
+    rows = select(*columns).outerjoin(prices, prices.c.product_id == Product.id).where(*where).subquery("rows")
+    conditions = []
+    if filters.price_min is not None:
+        conditions.append(rows.c.price >= filters.price_min)
+    if filters.price_max is not None:
+        conditions.append(rows.c.price <= filters.price_max)
+    matching = select(rows).where(*conditions).cte("matching")
+
+    if sort == "relevance":
+        # Scores hors de MySQL : les produits retenus (au plus ceux de la recherche) sont triés ici
+        found = [pid for (pid,) in db.execute(select(matching.c.id))]
+        found.sort(key=lambda pid: (-scores[pid], pid))
+        page_ids = found[offset:offset + limit]
+    else:
+        if sort in ("price_asc", "price_desc"):
+            direction = matching.c.price.asc() if sort == "price_asc" else matching.c.price.desc()
+            order_by = [matching.c.price.is_(None), direction, matching.c.id]
+        else:
+            order_by = [matching.c.created_at.is_(None), matching.c.created_at.desc(), matching.c.id]
+        page_ids = [pid for (pid,) in db.execute(
+            select(matching.c.id).order_by(*order_by).limit(limit).offset(offset))]
+
+    edges = [round(edge * 100) for edge in PRICE_FACET_EDGES]
+    buckets = []
+    for i in range(len(edges) + 1):
+        bucket = [matching.c.price.isnot(None)]
+        if i > 0:
+            bucket.append(matching.c.price >= edges[i - 1])
+        if i < len(edges):
+            bucket.append(matching.c.price < edges[i])
+        buckets.append(func.sum(case((and_(*bucket), 1), else_=0)))
+    summary = db.execute(select(
+        func.count(matching.c.id), func.sum(case((matching.c.in_stock == True, 1), else_=0)), *buckets)).one()
+    total, in_stock = summary[0], summary[1] or 0
+
+    # Sous-catégories de la catégorie choisie (ou racines) comptées sur l'ensemble filtré
+    if parent is None:
+        parent = _facet_root(db.query(Taxon.id).filter(Taxon.parent_id.is_(None), Taxon.enabled == True).all())
+    children = db.query(Taxon.id, Taxon.code).filter(
+        Taxon.parent_id == parent.id if parent is not None else Taxon.parent_id.is_(None),
+        Taxon.enabled == True,
+    ).order_by(Taxon.position, Taxon.id).all()
+    taxons = []
+    if children and total:
+        child, member = aliased(Taxon), aliased(Taxon)
+        counts = dict(db.execute(
+            select(child.id, func.count(func.distinct(matching.c.id)))
+            .select_from(matching)
+            .join(ProductTaxon, ProductTaxon.product_id == matching.c.id)
+            .join(member, member.id == ProductTaxon.taxon_id)
+            .join(child, and_(child.tree_root == member.tree_root,
+                              member.tree_left.between(child.tree_left, child.tree_right)))
+            .where(child.id.in_([taxon_id for taxon_id, _ in children]))
+            .group_by(child.id)
+        ).all())
+        names: Dict[int, TaxonNames] = {}
+        for taxon_id, locale, name in db.query(
+                TaxonTranslation.translatable_id, TaxonTranslation.locale, TaxonTranslation.name
+        ).filter(TaxonTranslation.translatable_id.in_(list(counts))):
+            names.setdefault(taxon_id, {})[locale] = name
+        taxons = [(code, names.get(taxon_id, {}), counts[taxon_id]) for taxon_id, code in children if counts.get(taxon_id)]
+
+    return BrowsePage(
+        ids=page_ids,
+        total=total,
+        taxons=taxons,
+        prices=[int(count or 0) for count in summary[2:]],
+        in_stock=int(in_stock),
+    )
@@ -0,0 +1,383 @@
+"""
+Snapshot en mémoire du catalogue Sylius
+
+Le snapshot est construit au démarrage à partir de sylius_product,
+sylius_product_translation et sylius_product_variant, puis rafraîchi de façon
+incrémentale : seuls les produits dont ``updated_at`` (produit ou variant)
+dépasse le dernier watermark sont rechargés. Une réconciliation complète
+périodique rattrape les suppressions. Tant que le dernier rafraîchissement
+réussi date de moins de ``max_staleness`` secondes, les outils produits
+sont servis depuis la mémoire sans toucher MySQL.
+
+Sans snapshot, ``CatalogDocuments`` suit de la même façon les seules
+traductions des produits actifs (watermark ``updated_at`` des produits,
+réconciliation périodique) : les index de recherche s'y abonnent et restent
+à jour, les produits étant ensuite lus dans MySQL.
+"""
+import bisect
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import Product, ProductTranslation, ProductVariant
+from products import DEFAULT_LOCALES, localize, product_query, restrict_to_available, serialize_product
+
+CATALOG_SNAPSHOT = os.getenv("CATALOG_SNAPSHOT", "0") == "1"
+# Sans snapshot : suivi des traductions pour les index de recherche
+CATALOG_DOCUMENTS = os.getenv("CATALOG_DOCUMENTS", "1") != "0"
+CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL", "30"))
+CATALOG_RECONCILE_INTERVAL = float(os.getenv("CATALOG_RECONCILE_INTERVAL", "900"))
+CATALOG_MAX_STALENESS = float(os.getenv("CATALOG_MAX_STALENESS", "120"))
+
+# Taille des lots de rechargement (limite la taille des clauses IN)
+LOAD_BATCH_SIZE = 500
+
+Listener = Callable[[Set[int], Set[int]], None]
+Translations = Dict[str, Tuple[Optional[str], Optional[str]]]
+
+
+def _translations(product: Product) -> Translations:
+    """Nom et description du produit pour chaque locale"""
+    return {t.locale: (t.name, t.description) for t in product.translations}
+
+
+class CatalogSource:
+    """Copie en mémoire rafraîchie par watermark, avec abonnements et borne de fraîcheur"""
+
+    def __init__(self, max_staleness: float = CATALOG_MAX_STALENESS):
+        self.max_staleness = max_staleness
+        self.translations: Dict[int, Translations] = {}
+        self.product_watermark: Optional[datetime] = None
+        self.loaded = False
+        self.built_at: Optional[float] = None
+        self.refreshed_at: Optional[float] = None
+        self.reconciled_at: Optional[float] = None
+        self.last_refresh_seconds = 0.0
+        self.last_changes = {"changed": 0, "removed": 0}
+        self.last_error: Optional[str] = None
+        self._listeners: List[Listener] = []
+        # Un seul rafraîchissement à la fois ; les lectures ne prennent pas de verrou
+        self._refresh_lock = threading.Lock()
+
+    # Abonnements ---------------------------------------------------------
+
+    def add_listener(self, listener: Listener) -> None:
+        """Enregistre un callback appelé avec (ids modifiés, ids supprimés)"""
+        self._listeners.append(listener)
+
+    def _notify(self, changed: Set[int], removed: Set[int]) -> None:
+        self.last_changes = {"changed": len(changed), "removed": len(removed)}
+        if not changed and not removed:
+            return
+        for listener in self._listeners:
+            try:
+                listener(changed, removed)
+            except Exception as e:
+                print(f"Error in catalog listener {listener}: {e}")
+
+    def _loaded_at(self, start: float, reconciled: bool) -> None:
+        now = time.monotonic()
+        if not self.loaded:
+            self.built_at = now
+            self.loaded = True
+        self.refreshed_at = now
+        if reconciled:
+            self.reconciled_at = now
+        self.last_refresh_seconds = time.perf_counter() - start
+        self.last_error = None
+
+    # Lecture -------------------------------------------------------------
+
+    def staleness(self) -> Optional[float]:
+        """Secondes écoulées depuis le dernier rafraîchissement réussi"""
+        if self.refreshed_at is None:
+            return None
+        return time.monotonic() - self.refreshed_at
+
+    def is_fresh(self) -> bool:
+        """Vrai si la copie peut servir les outils"""
+        staleness = self.staleness()
+        return self.loaded and staleness is not None and staleness <= self.max_staleness
+
+    def status(self) -> Dict[str, Any]:
+        staleness = self.staleness()
+        return {
+            "loaded": self.loaded,
+            "fresh": self.is_fresh(),
+            "products": len(self.translations),
+            "staleness_seconds": round(staleness, 3) if staleness is not None else None,
+            "max_staleness_seconds": self.max_staleness,
+            "refresh_interval_seconds": CATALOG_REFRESH_INTERVAL,
+            "reconcile_interval_seconds": CATALOG_RECONCILE_INTERVAL,
+            "last_refresh_seconds": round(self.last_refresh_seconds, 6),
+            "last_changes": self.last_changes,
+            "product_watermark": self.product_watermark.isoformat() if self.product_watermark else None,
+            "last_error": self.last_error,
+        }
+
+
+class CatalogSnapshot(CatalogSource):
+    """Copie en mémoire des produits actifs, indexée par id et par code"""
+
+    def __init__(self, max_staleness: float = CATALOG_MAX_STALENESS):
+        super().__init__(max_staleness)
+        self.products: Dict[int, Dict[str, Any]] = {}
+        self.ids_by_code: Dict[str, int] = {}
+        self.sorted_ids: List[int] = []
+        self.variant_watermark: Optional[datetime] = None
+        # Produits à recharger au prochain rafraîchissement (ex. prix modifiés)
+        self._stale: Set[int] = set()
+
+    def mark_stale(self, ids: Iterable[int]) -> None:
+        """Force le rechargement de ces produits au prochain rafraîchissement"""
+        self._stale = self._stale | set(ids)
+
+    # Chargement ----------------------------------------------------------
+
+    def _watermarks(self, db: Session) -> Tuple[Optional[datetime], Optional[datetime]]:
+        product_wm = db.query(func.max(Product.updated_at)).scalar()
+        variant_wm = db.query(func.max(ProductVariant.updated_at)).scalar()
+        return product_wm, variant_wm
+
+    def _load(self, db: Session, ids: Optional[Iterable[int]] = None) -> Dict[int, Tuple[Dict[str, Any], Dict, str]]:
+        """Charge les produits actifs (tous, ou seulement `ids`)"""
+        loaded = {}
+        if ids is None:
+            query = product_query(db).filter(Product.enabled == True).order_by(Product.id).yield_per(LOAD_BATCH_SIZE)
+            batches = [query]
+        else:
+            ids = sorted(ids)
+            batches = [
+                product_query(db).filter(Product.enabled == True, Product.id.in_(ids[i:i + LOAD_BATCH_SIZE]))
+                for i in range(0, len(ids), LOAD_BATCH_SIZE)
+            ]
+        for batch in batches:
+            for product in batch:
+                loaded[product.id] = (serialize_product(product), _translations(product), product.code)
+            db.expunge_all()
+        return loaded
+
+    def load_full(self, db: Session) -> None:
+        """Construit (ou reconstruit) le snapshot complet"""
+        with self._refresh_lock:
+            start = time.perf_counter()
+            product_wm, variant_wm = self._watermarks(db)
+            loaded = self._load(db)
+
+            products = {pid: entry[0] for pid, entry in loaded.items()}
+            translations = {pid: entry[1] for pid, entry in loaded.items()}
+            ids_by_code = {entry[2]: pid for pid, entry in loaded.items()}
+
+            removed = set(self.products) - set(products)
+            changed = {
+                pid for pid, data in products.items()
+                if self.products.get(pid) != data or self.translations.get(pid) != translations[pid]
+            }
+
+            # Remplacement atomique des structures lues par les outils
+            self.products = products
+            self.translations = translations
+            self.ids_by_code = ids_by_code
+            self.sorted_ids = sorted(products)
+            self.product_watermark = product_wm
+            self.variant_watermark = variant_wm
+            self._loaded_at(start, reconciled=True)
+        self._notify(changed, removed)
+
+    def refresh(self, db: Session) -> Tuple[Set[int], Set[int]]:
+        """Recharge les produits modifiés depuis le dernier watermark"""
+        if not self.loaded:
+            self.load_full(db)
+            return set(), set()
+
+        with self._refresh_lock:
+            start = time.perf_counter()
+            product_wm, variant_wm = self._watermarks(db)
+
+            # >= : MySQL stocke updated_at à la seconde, on relit le dernier instant
+            candidates = set()
+            if self.product_watermark is not None:
+                candidates.update(pid for (pid,) in db.query(Product.id).filter(
+                    Product.updated_at >= self.product_watermark))
+            elif product_wm is not None:
+                candidates.update(pid for (pid,) in db.query(Product.id))
+            if self.variant_watermark is not None:
+                candidates.update(pid for (pid,) in db.query(ProductVariant.product_id).filter(
+                    ProductVariant.updated_at >= self.variant_watermark))
+            elif variant_wm is not None:
+                candidates.update(pid for (pid,) in db.query(ProductVariant.product_id))
+            stale = self._stale
+            candidates.update(stale)
+            candidates.discard(None)
+
+            loaded = self._load(db, candidates) if candidates else {}
+            changed, removed = set(), set()
+            products = dict(self.products)
+            translations = dict(self.translations)
+            ids_by_code = dict(self.ids_by_code)
+            for pid in candidates:
+                entry = loaded.get(pid)
+                if entry is None:
+                    # Produit désactivé (ou supprimé depuis la requête des watermarks)
+                    if pid in products:
+                        data = products.pop(pid)
+                        translations.pop(pid, None)
+                        if ids_by_code.get(data["code"]) == pid:
+                            del ids_by_code[data["code"]]
+                        removed.add(pid)
+                    continue
+                data, product_translations, code = entry
+                previous = products.get(pid)
+                if previous != data or translations.get(pid) != product_translations:
+                    if previous is not None and previous["code"] != code:
+                        ids_by_code.pop(previous["code"], None)
+                    products[pid] = data
+                    translations[pid] = product_translations
+                    ids_by_code[code] = pid
+                    changed.add(pid)
+
+            self._stale = self._stale - stale
+            if changed or removed:
+                self.products = products
+                self.translations = translations
+                self.ids_by_code = ids_by_code
+                self.sorted_ids = sorted(products)
+            if product_wm is not None:
+                self.product_watermark = product_wm
+            if variant_wm is not None:
+                self.variant_watermark = variant_wm
+            self._loaded_at(start, reconciled=False)
+        self._notify(changed, removed)
+        return changed, removed
+
+    # Lecture -------------------------------------------------------------
+
+    def get_many(self, ids: Iterable[int], locales: Sequence[str] = DEFAULT_LOCALES,
+                 min_available: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Produits actifs parmi `ids`, dans cet ordre, traduits dans la chaîne de locales
+
+        Avec `min_available`, seuls les produits (et variants) disponibles sont retournés.
+        """
+        products, translations = self.products, self.translations
+        found = [products[pid] for pid in ids if pid in products]
+        if min_available is not None:
+            found = [p for p in (restrict_to_available(p, min_available) for p in found) if p is not None]
+        if tuple(locales) == DEFAULT_LOCALES:
+            # Les produits sont stockés sérialisés dans la chaîne par défaut
+            return found
+        return [localize(p, translations.get(p["id"], {}), locales) for p in found]
+
+    def list_products(self, limit: int = 10, offset: int = 0, after: Optional[int] = None,
+                      locales: Sequence[str] = DEFAULT_LOCALES,
+                      min_available: Optional[int] = None) -> List[Dict[str, Any]]:
+        sorted_ids = self.sorted_ids
+        start = bisect.bisect_right(sorted_ids, after) if after is not None else offset
+        if min_available is None:
+            return self.get_many(sorted_ids[start:start + limit], locales)
+        # Avec un filtre de stock, l'offset compte les produits disponibles : parcours par blocs
+        if after is not None:
+            offset = 0
+        else:
+            start = 0
+        found: List[Dict[str, Any]] = []
+        while start < len(sorted_ids) and len(found) < offset + limit:
+            block = sorted_ids[start:start + max(offset + limit, 64)]
+            found.extend(self.get_many(block, locales, min_available))
+            start += len(block)
+        return found[offset:offset + limit]
+
+    def get_by_code(self, code: str, locales: Sequence[str] = DEFAULT_LOCALES) -> Optional[Dict[str, Any]]:
+        pid = self.ids_by_code.get(code)
+        found = self.get_many([pid], locales) if pid is not None else []
+        return found[0] if found else None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": CATALOG_SNAPSHOT,
+            **super().status(),
+            "variant_watermark": self.variant_watermark.isoformat() if self.variant_watermark else None,
+        }
+
+
+class CatalogDocuments(CatalogSource):
+    """Traductions des produits actifs, pour les index de recherche sans snapshot"""
+
+    def _load(self, db: Session, ids: Optional[Iterable[int]] = None) -> Dict[int, Translations]:
+        """Traductions des produits actifs (tous, ou seulement `ids`), une requête par lot"""
+        query = db.query(
+            Product.id, ProductTranslation.locale, ProductTranslation.name, ProductTranslation.description,
+        ).outerjoin(ProductTranslation, ProductTranslation.product_id == Product.id).filter(Product.enabled == True)
+        if ids is None:
+            batches = [query]
+        else:
+            ids = sorted(ids)
+            batches = [query.filter(Product.id.in_(ids[i:i + LOAD_BATCH_SIZE])) for i in range(0, len(ids), LOAD_BATCH_SIZE)]
+        loaded: Dict[int, Translations] = {}
+        for batch in batches:
+            for pid, locale, name, description in batch:
+                translations = loaded.setdefault(pid, {})
+                if locale is not None:
+                    translations[locale] = (name, description)
+        return loaded
+
+    def load_full(self, db: Session) -> None:
+        """Charge (ou recharge) toutes les traductions"""
+        with self._refresh_lock:
+            start = time.perf_counter()
+            product_wm = db.query(func.max(Product.updated_at)).scalar()
+            translations = self._load(db)
+            removed = set(self.translations) - set(translations)
+            changed = {pid for pid, entry in translations.items() if self.translations.get(pid) != entry}
+            self.translations = translations
+            self.product_watermark = product_wm
+            self._loaded_at(start, reconciled=True)
+        self._notify(changed, removed)
+
+    def refresh(self, db: Session) -> Tuple[Set[int], Set[int]]:
+        """Recharge les produits modifiés depuis le dernier watermark"""
+        if not self.loaded:
+            self.load_full(db)
+            return set(), set()
+
+        with self._refresh_lock:
+            start = time.perf_counter()
+            product_wm = db.query(func.max(Product.updated_at)).scalar()
+            # >= : MySQL stocke updated_at à la seconde, on relit le dernier instant
+            candidates = set()
+            if self.product_watermark is not None:
+                candidates.update(pid for (pid,) in db.query(Product.id).filter(
+                    Product.updated_at >= self.product_watermark))
+            elif product_wm is not None:
+                candidates.update(pid for (pid,) in db.query(Product.id))
+
+            loaded = self._load(db, candidates) if candidates else {}
+            translations = dict(self.translations)
+            changed, removed = set(), set()
+            for pid in candidates:
+                entry = loaded.get(pid)
+                if entry is None:
+                    # Produit désactivé (ou supprimé depuis la requête du watermark)
+                    if translations.pop(pid, None) is not None:
+                        removed.add(pid)
+                elif translations.get(pid) != entry:
+                    translations[pid] = entry
+                    changed.add(pid)
+            if changed or removed:
+                self.translations = translations
+            if product_wm is not None:
+                self.product_watermark = product_wm
+            self._loaded_at(start, reconciled=False)
+        self._notify(changed, removed)
+        return changed, removed
+
+    def status(self) -> Dict[str, Any]:
+        return {"enabled": CATALOG_DOCUMENTS and not CATALOG_SNAPSHOT, **super().status()}
+
+
+catalog = CatalogSnapshot()
+catalog_documents = CatalogDocuments()
@@ -0,0 +1,292 @@
+"""
+Recommandations « fréquemment achetés ensemble »
+
+Chaque commande validée est un panier (ensemble des produits de ses lignes).
+La matrice creuse produit x produit des co-occurrences s'obtient par blocs :
+pour un bloc de paniers, ``B.T @ B`` où ``B`` est la matrice d'incidence
+panier x produit ; les blocs sont additionnés, la diagonale donne le nombre
+de paniers de chaque produit. Les lignes de commande sont lues en flux
+(curseur côté serveur), triées par date de validation : la position atteinte
+sert de watermark et les rafraîchissements n'ajoutent que les commandes
+validées depuis.
+
+Une commande déjà comptée peut ensuite être annulée ou remboursée : chaque
+rafraîchissement relit les commandes modifiées depuis le dernier
+``updated_at`` vu et retire de la matrice les paniers de celles passées dans
+l'un de ces états. Les commandes validées mais non comptées sont gardées en
+mémoire (ids) pour ne jamais être retirées deux fois ni à tort. Une commande
+rétablie après annulation n'est comptée de nouveau qu'à la reconstruction
+suivante (redémarrage).
+
+Les scores sont calculés à la demande sur la ligne creuse du produit :
+cosinus ``c_ij / sqrt(n_i * n_j)`` ou lift ``c_ij * N / (n_i * n_j)``.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session
+
+from models import Order, OrderItem, ProductVariant
+
+COPURCHASE_REFRESH_INTERVAL = float(os.getenv("COPURCHASE_REFRESH_INTERVAL", "300"))
+# Nombre minimal de paniers communs pour recommander un produit
+COPURCHASE_MIN_SUPPORT = int(os.getenv("COPURCHASE_MIN_SUPPORT", "2"))
+# Les paniers plus gros (commandes de gros) produisent n² paires peu informatives
+MAX_BASKET_SIZE = 50
+# Paniers accumulés avant chaque produit matriciel
+CHUNK_BASKETS = 50000
+# Lignes lues par lot par le curseur serveur
+SCAN_BATCH_SIZE = 10000
+
+METRICS = ("cosine", "lift")
+
+Watermark = Tuple[datetime, int]
+
+
+def order_dropped():
+    """Commande annulée ou remboursée : absente des co-achats"""
+    return or_(Order.state == 'cancelled', Order.payment_state == 'refunded')
+
+
+def order_lines_statement(after: Optional[Watermark] = None, until: Optional[Watermark] = None):
+    """Lignes (commande, date de validation, annulée, produit) des commandes validées après `after`, jusqu'à `until`"""
+    statement = (
+        select(Order.id, Order.checkout_completed_at, order_dropped().label("dropped"), ProductVariant.product_id)
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .join(ProductVariant, ProductVariant.id == OrderItem.variant_id)
+        .where(Order.checkout_completed_at.isnot(None))
+        .order_by(Order.checkout_completed_at, Order.id)
+    )
+    if after is not None:
+        completed_at, order_id = after
+        statement = statement.where(or_(
+            Order.checkout_completed_at > completed_at,
+            and_(Order.checkout_completed_at == completed_at, Order.id > order_id),
+        ))
+    if until is not None:
+        completed_at, order_id = until
+        statement = statement.where(or_(
+            Order.checkout_completed_at < completed_at,
+            and_(Order.checkout_completed_at == completed_at, Order.id <= order_id),
+        ))
+    return statement
+
+
+def scan_baskets(db: Session, statement) -> Iterator[Tuple[Watermark, Set[int], bool]]:
+    """Paniers (watermark, produits, annulée) des lignes de `statement`, dans l'ordre de validation"""
+    result = db.execute(statement.execution_options(yield_per=SCAN_BATCH_SIZE))
+    current: Optional[Watermark] = None
+    basket: Set[int] = set()
+    dropped = False
+    try:
+        for order_id, completed_at, is_dropped, product_id in result:
+            if current is None or order_id != current[1]:
+                if basket:
+                    yield current, basket, dropped
+                current, basket, dropped = (completed_at, order_id), set(), bool(is_dropped)
+            basket.add(product_id)
+        if basket:
+            yield current, basket, dropped
+    finally:
+        result.close()
+
+
+def _resized(matrix: sparse.csr_matrix, size: int) -> sparse.csr_matrix:
+    if matrix.shape[0] < size:
+        matrix = matrix.copy()
+        matrix.resize((size, size))
+    return matrix
+
+
+def co_occurrences(baskets: List[Set[int]], size: int) -> sparse.csr_matrix:
+    """Matrice des co-occurrences d'un bloc de paniers (colonnes = ids produit)"""
+    lengths = [len(basket) for basket in baskets]
+    rows = np.repeat(np.arange(len(baskets)), lengths)
+    cols = np.fromiter((pid for basket in baskets for pid in basket), dtype=np.int32, count=sum(lengths))
+    incidence = sparse.csr_matrix(
+        (np.ones(len(cols), dtype=np.int32), (rows, cols)), shape=(len(baskets), size)
+    )
+    return (incidence.T @ incidence).tocsr()
+
+
+class CoPurchaseIndex:
+    """Matrice creuse des co-achats, mise à jour depuis un watermark de commandes"""
+
+    def __init__(self, min_support: int = COPURCHASE_MIN_SUPPORT):
+        self.min_support = min_support
+        # (co-occurrences, paniers par produit, nombre de commandes), remplacés ensemble
+        self._state = (sparse.csr_matrix((0, 0), dtype=np.int32), np.zeros(0, dtype=np.int32), 0)
+        self.watermark: Optional[Watermark] = None
+        # Dernier updated_at vu : les commandes modifiées depuis sont relues pour les annulations
+        self.updated_watermark: Optional[datetime] = None
+        # Commandes validées jusqu'au watermark mais non comptées (annulées ou remboursées)
+        self.dropped_orders: Set[int] = set()
+        self.built_at: Optional[float] = None
+        self.refreshed_at: Optional[float] = None
+        self.build_seconds = 0.0
+        self.last_refresh_seconds = 0.0
+        self.last_new_orders = 0
+        self.last_dropped_orders = 0
+        self.skipped_baskets = 0
+        # Une seule construction ou mise à jour à la fois ; les lectures ne prennent pas de verrou
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.built_at is not None
+
+    @property
+    def matrix(self) -> sparse.csr_matrix:
+        return self._state[0]
+
+    @property
+    def orders(self) -> int:
+        return self._state[2]
+
+    def _accumulate(self, db: Session, after: Optional[Watermark]) -> Tuple[sparse.csr_matrix, int, int, Optional[Watermark]]:
+        """Co-occurrences des commandes validées après `after` ; les annulées rejoignent `dropped_orders`"""
+        total = sparse.csr_matrix((0, 0), dtype=np.int32)
+        orders, skipped, watermark = 0, 0, after
+        chunk: List[Set[int]] = []
+
+        def flush():
+            nonlocal total
+            size = max(total.shape[0], max(max(basket) for basket in chunk) + 1)
+            total = _resized(total, size) + co_occurrences(chunk, size)
+            chunk.clear()
+
+        for watermark, basket, dropped in scan_baskets(db, order_lines_statement(after)):
+            if dropped:
+                self.dropped_orders.add(watermark[1])
+                continue
+            orders += 1
+            if len(basket) > MAX_BASKET_SIZE:
+                skipped += 1
+                continue
+            chunk.append(basket)
+            if len(chunk) >= CHUNK_BASKETS:
+                flush()
+        if chunk:
+            flush()
+        return total, orders, skipped, watermark
+
+    def _withdraw(self, db: Session, until: Optional[Watermark]) -> Tuple[sparse.csr_matrix, int, int]:
+        """Co-occurrences des commandes comptées jusqu'à `until`, annulées ou remboursées depuis `updated_watermark`"""
+        if until is None:
+            return sparse.csr_matrix((0, 0), dtype=np.int32), 0, 0
+        statement = order_lines_statement(until=until).where(order_dropped())
+        if self.updated_watermark is not None:
+            # >= : updated_at est à la seconde, les commandes déjà retirées sont dans dropped_orders
+            statement = statement.where(Order.updated_at >= self.updated_watermark)
+        orders, skipped = 0, 0
+        baskets: List[Set[int]] = []
+        for (_, order_id), basket, _ in scan_baskets(db, statement):
+            if order_id in self.dropped_orders:
+                continue
+            self.dropped_orders.add(order_id)
+            orders += 1
+            if len(basket) > MAX_BASKET_SIZE:
+                skipped += 1
+            else:
+                baskets.append(basket)
+        if not baskets:
+            return sparse.csr_matrix((0, 0), dtype=np.int32), orders, skipped
+        size = max(self.matrix.shape[0], max(max(basket) for basket in baskets) + 1)
+        return co_occurrences(baskets, size), orders, skipped
+
+    def _swap(self, matrix: sparse.csr_matrix, orders: int, watermark: Optional[Watermark]) -> None:
+        self._state = (matrix, matrix.diagonal().astype(np.int32), orders)
+        self.watermark = watermark
+
+    def build(self, db: Session) -> None:
+        """Construit la matrice à partir de toutes les commandes validées"""
+        with self._refresh_lock:
+            start = time.perf_counter()
+            updated = db.scalar(select(func.max(Order.updated_at)))
+            self.dropped_orders = set()
+            matrix, orders, skipped, watermark = self._accumulate(db, None)
+            self._swap(matrix, orders, watermark)
+            self.updated_watermark = updated
+            self.skipped_baskets = skipped
+            self.last_new_orders = orders
+            self.last_dropped_orders = 0
+            self.built_at = self.refreshed_at = time.time()
+            self.build_seconds = time.perf_counter() - start
+
+    def refresh(self, db: Session) -> int:
+        """Ajoute les commandes validées depuis le watermark et retire celles annulées ou remboursées depuis ;
+        retourne le nombre de commandes ajoutées"""
+        if not self.loaded:
+            self.build(db)
+            return self.last_new_orders
+        with self._refresh_lock:
+            start = time.perf_counter()
+            # Lu avant les parcours : une modification pendant la mise à jour sera relue la fois suivante
+            updated = db.scalar(select(func.max(Order.updated_at)))
+            delta, orders, skipped, watermark = self._accumulate(db, self.watermark)
+            removed, dropped, dropped_skipped = self._withdraw(db, watermark)
+            if orders or dropped:
+                size = max(self.matrix.shape[0], delta.shape[0], removed.shape[0])
+                matrix = _resized(self.matrix, size) + _resized(delta, size) - _resized(removed, size)
+                # Lignes de commande modifiées après comptage : jamais de co-occurrence négative
+                matrix.data[matrix.data < 0] = 0
+                matrix.eliminate_zeros()
+                self._swap(matrix, self.orders + orders - dropped, watermark)
+                self.skipped_baskets += skipped - dropped_skipped
+            if updated is not None:
+                self.updated_watermark = updated
+            self.last_new_orders = orders
+            self.last_dropped_orders = dropped
+            self.refreshed_at = time.time()
+            self.last_refresh_seconds = time.perf_counter() - start
+            return orders
+
+    def related(self, product_id: int, k: int = 10, metric: str = "cosine") -> List[Tuple[int, float, int]]:
+        """(id, score, paniers communs) des produits achetés avec `product_id`"""
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}' (expected one of: {', '.join(METRICS)})")
+        matrix, counts, orders = self._state
+        if product_id < 0 or product_id >= matrix.shape[0] or k <= 0:
+            return []
+        begin, end = matrix.indptr[product_id], matrix.indptr[product_id + 1]
+        cols = matrix.indices[begin:end]
+        together = matrix.data[begin:end]
+        keep = (cols != product_id) & (together >= self.min_support)
+        cols, together = cols[keep], together[keep].astype(np.float64)
+        if not len(cols):
+            return []
+        if metric == "cosine":
+            scores = together / np.sqrt(float(counts[product_id]) * counts[cols])
+        else:
+            scores = together * orders / (float(counts[product_id]) * counts[cols])
+        top = np.lexsort((cols, -scores))[:k]
+        return [(int(cols[i]), float(scores[i]), int(together[i])) for i in top]
+
+    def stats(self) -> Dict[str, object]:
+        matrix = self.matrix
+        return {
+            "loaded": self.loaded,
+            "orders": self.orders,
+            "products": int(np.count_nonzero(self._state[1])),
+            "pairs": int(matrix.nnz),
+            "skipped_baskets": self.skipped_baskets,
+            "watermark": {"completed_at": self.watermark[0].isoformat(), "order_id": self.watermark[1]}
+            if self.watermark else None,
+            "built_at": self.built_at,
+            "refreshed_at": self.refreshed_at,
+            "build_seconds": round(self.build_seconds, 3),
+            "last_refresh_seconds": round(self.last_refresh_seconds, 3),
+            "last_new_orders": self.last_new_orders,
+            "dropped_orders": len(self.dropped_orders),
+            "last_dropped_orders": self.last_dropped_orders,
+            "matrix_bytes": int(matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes),
+        }
+
+
+co_purchase = CoPurchaseIndex()
@@ -0,0 +1,52 @@
+"""
+Fixtures partagées : base SQLite en mémoire peuplée de produits Sylius
+"""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models import Base, Product, ProductTranslation, ProductVariant
+
+# test_server.py est un script de test manuel contre un serveur lancé
+collect_ignore = ["test_server.py"]
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(bind=engine)()
+    for i in range(30):
+        product = Product(id=i + 1, code=f"PRODUCT_{i}", enabled=True)
+        session.add(product)
+        session.add(ProductTranslation(product_id=i + 1, locale="fr_FR", name=f"Chemise {i}", description="Coton"))
+        session.add(ProductTranslation(product_id=i + 1, locale="en_US", name=f"Shirt {i}", description="Cotton"))
+        session.add(ProductVariant(product_id=i + 1, code=f"PRODUCT_{i}_S", enabled=True, on_hand=5))
+        session.add(ProductVariant(product_id=i + 1, code=f"PRODUCT_{i}_OFF", enabled=False))
+    session.commit()
+    yield session
+    session.close()
+
+
+@contextmanager
+def count_queries(engine):
+    """Compte les requêtes SQL exécutées dans le bloc"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
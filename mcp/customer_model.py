@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Recommandations personnalisées par factorisation de matrice (ALS implicite)
+
+Entraînement hors ligne : les lignes des commandes validées forment une
+matrice creuse client x produit (quantités achetées, amorties par log1p),
+factorisée par moindres carrés alternés pour retour implicite (Hu, Koren et
+Volinsky). Chaque demi-itération résout en lot les systèmes f x f d'un bloc
+de clients (ou de produits) par quelques pas de gradient conjugué, sans former
+les matrices f x f ; les blocs sont répartis sur un pool de threads, NumPy
+relâchant le GIL pendant les calculs.
+
+Le modèle est écrit dans un répertoire de fichiers ``.npy`` que le serveur
+ouvre en ``mmap`` : plusieurs workers uvicorn partagent la même copie via le
+cache de pages. Servir une recommandation = un produit matrice-vecteur, le
+masquage des produits déjà achetés et une sélection top-k.
+
+Usage : python customer_model.py [--output models/customer_als] [--factors 32]
+"""
+import argparse
+import os
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from co_purchase import order_dropped
+from model_store import MappedModel, save_arrays
+from models import Order, OrderItem, ProductVariant
+
+# Relatif au module : le serveur et l'entraînement lancés depuis des répertoires différents partagent le modèle
+CUSTOMER_MODEL_PATH = os.getenv("CUSTOMER_MODEL_PATH",
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "customer_als"))
+
+# Hyperparamètres par défaut
+FACTORS = 32
+ITERATIONS = 15
+ALPHA = 40.0
+REGULARIZATION = 0.1
+# Pas de gradient conjugué par demi-itération (départ depuis les facteurs précédents)
+CG_STEPS = 3
+# Interactions traitées par bloc (borne la mémoire des tableaux m x f)
+CHUNK_NNZ = 65536
+SCAN_BATCH_SIZE = 10000
+
+
+# Données ------------------------------------------------------------------
+
+def load_interactions(db: Session) -> Tuple[sparse.csr_matrix, np.ndarray, np.ndarray]:
+    """Matrice client x produit des quantités achetées, avec les ids des lignes et colonnes"""
+    statement = (
+        select(Order.customer_id, ProductVariant.product_id, OrderItem.quantity)
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .join(ProductVariant, ProductVariant.id == OrderItem.variant_id)
+        # Annulées ou remboursées : exclues comme pour les co-achats
+        .where(Order.checkout_completed_at.isnot(None), ~order_dropped(), Order.customer_id.isnot(None))
+        .execution_options(yield_per=SCAN_BATCH_SIZE)
+    )
+    customers, products, quantities = array("q"), array("q"), array("f")
+    for customer_id, product_id, quantity in db.execute(statement):
+        customers.append(customer_id)
+        products.append(product_id)
+        quantities.append(quantity or 1)
+    user_ids, rows = np.unique(np.frombuffer(customers, dtype=np.int64), return_inverse=True)
+    item_ids, cols = np.unique(np.frombuffer(products, dtype=np.int64), return_inverse=True)
+    # Les doublons (même produit dans plusieurs commandes) sont additionnés
+    matrix = sparse.csr_matrix(
+        (np.frombuffer(quantities, dtype=np.float32), (rows, cols)), shape=(len(user_ids), len(item_ids))
+    )
+    matrix.sum_duplicates()
+    return matrix, user_ids, item_ids
+
+
+# Entraînement -------------------------------------------------------------
+
+def _row_chunks(indptr: np.ndarray) -> List[Tuple[int, int]]:
+    """Découpe les lignes en blocs d'environ CHUNK_NNZ interactions"""
+    chunks, start, rows = [], 0, len(indptr) - 1
+    while start < rows:
+        end = int(np.searchsorted(indptr, indptr[start] + CHUNK_NNZ, side="right")) - 1
+        end = min(max(end, start + 1), rows)
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+
+def solve_factors(confidence: sparse.csr_matrix, fixed: np.ndarray, current: np.ndarray,
+                  regularization: float, pool: ThreadPoolExecutor) -> np.ndarray:
+    """Facteurs des lignes de `confidence` à facteurs des colonnes `fixed` constants
+
+    Pour chaque ligne u : (YᵀY + Yᵤᵀ(Cᵤ - I)Yᵤ + λI) xᵤ = YᵤᵀCᵤpᵤ, avec
+    ``confidence.data`` = Cᵤ - I sur les interactions observées. Le système est
+    résolu par gradient conjugué en partant de `current`, toutes les lignes d'un
+    bloc à la fois : le produit matrice-vecteur coûte O(interactions x f).
+    """
+    factors = fixed.shape[1]
+    gram = fixed.T @ fixed + regularization * np.eye(factors, dtype=fixed.dtype)
+    solved = np.array(current, dtype=fixed.dtype)
+    indptr, indices, data = confidence.indptr, confidence.indices, confidence.data
+
+    def solve_chunk(bounds: Tuple[int, int]) -> None:
+        start, end = bounds
+        lo, hi = indptr[start], indptr[end]
+        observed = fixed[indices[lo:hi]]
+        extra = data[lo:hi]
+        offsets = indptr[start:end] - lo
+        owner = np.repeat(np.arange(end - start), np.diff(indptr[start:end + 1]))
+
+        def matvec(v: np.ndarray) -> np.ndarray:
+            projected = np.einsum("mf,mf->m", observed, v[owner]) * extra
+            return v @ gram + np.add.reduceat(observed * projected[:, None], offsets, axis=0)
+
+        x = solved[start:end]
+        residual = np.add.reduceat(observed * (1 + extra)[:, None], offsets, axis=0) - matvec(x)
+        direction = residual.copy()
+        norm = np.einsum("nf,nf->n", residual, residual)
+        for _ in range(CG_STEPS):
+            product = matvec(direction)
+            curvature = np.einsum("nf,nf->n", direction, product)
+            step = np.divide(norm, curvature, out=np.zeros_like(norm), where=curvature > 0)
+            x += step[:, None] * direction
+            residual -= step[:, None] * product
+            new_norm = np.einsum("nf,nf->n", residual, residual)
+            ratio = np.divide(new_norm, norm, out=np.zeros_like(norm), where=norm > 0)
+            direction = residual + ratio[:, None] * direction
+            norm = new_norm
+        solved[start:end] = x
+
+    list(pool.map(solve_chunk, _row_chunks(indptr)))
+    return solved
+
+
+def train(interactions: sparse.csr_matrix, factors: int = FACTORS, iterations: int = ITERATIONS,
+          alpha: float = ALPHA, regularization: float = REGULARIZATION, workers: Optional[int] = None,
+          seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """ALS implicite : facteurs clients et produits"""
+    confidence = interactions.astype(np.float32)
+    confidence.data = alpha * np.log1p(confidence.data)
+    confidence_t = confidence.T.tocsr()
+    rng = np.random.default_rng(seed)
+    item_factors = rng.normal(scale=0.01, size=(interactions.shape[1], factors)).astype(np.float32)
+    user_factors = rng.normal(scale=0.01, size=(interactions.shape[0], factors)).astype(np.float32)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for _ in range(iterations):
+            user_factors = solve_factors(confidence, item_factors, user_factors, regularization, pool)
+            item_factors = solve_factors(confidence_t, user_factors, item_factors, regularization, pool)
+    return user_factors, item_factors
+
+
+def save_model(path: str, interactions: sparse.csr_matrix, user_ids: np.ndarray, item_ids: np.ndarray,
+               user_factors: np.ndarray, item_factors: np.ndarray, meta: Dict) -> None:
+    """Écrit le modèle à côté puis remplace l'ancien répertoire"""
+    binary = interactions.tocsr()
+    arrays = {
+        "user_ids": user_ids.astype(np.int64),
+        "item_ids": item_ids.astype(np.int64),
+        "user_factors": np.ascontiguousarray(user_factors, dtype=np.float32),
+        "item_factors": np.ascontiguousarray(item_factors, dtype=np.float32),
+        "purchased_indptr": binary.indptr.astype(np.int64),
+        "purchased_indices": binary.indices.astype(np.int32),
+        "popularity": np.diff(binary.tocsc().indptr).astype(np.float32),
+    }
+    save_arrays(path, arrays, meta)
+
+
+# Service ------------------------------------------------------------------
+
+class CustomerModel(MappedModel):
+    """Facteurs ALS ouverts en mmap, rechargés quand le modèle est réentraîné"""
+
+    ARRAYS = ("user_ids", "item_ids", "user_factors", "item_factors",
+              "purchased_indptr", "purchased_indices", "popularity")
+
+    def __init__(self, path: str = CUSTOMER_MODEL_PATH):
+        super().__init__(path)
+
+    def recommend(self, customer_id: int, k: int = 10) -> Tuple[List[Tuple[int, float]], bool]:
+        """(id produit, score) des k meilleurs produits non achetés, et si le client est connu
+
+        Un client absent de l'entraînement reçoit les produits les plus achetés.
+        """
+        arrays = self.arrays
+        if arrays is None or k <= 0:
+            return [], False
+        user_ids = arrays["user_ids"]
+        row = int(np.searchsorted(user_ids, customer_id))
+        personalized = bool(row < len(user_ids) and user_ids[row] == customer_id)
+        if personalized:
+            scores = arrays["item_factors"] @ arrays["user_factors"][row]
+            indptr = arrays["purchased_indptr"]
+            scores[arrays["purchased_indices"][indptr[row]:indptr[row + 1]]] = -np.inf
+        else:
+            scores = np.array(arrays["popularity"])
+        k = min(k, len(scores))
+        if not k:
+            return [], personalized
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        item_ids = arrays["item_ids"]
+        return [(int(item_ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])], personalized
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "loaded": self.loaded,
+            "path": self.path,
+            "mapped_bytes": self.mapped_bytes(),
+            **self.meta,
+        }
+
+
+customer_model = CustomerModel()
+
+
+def main():
+    from models import session_scope
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=CUSTOMER_MODEL_PATH)
+    parser.add_argument("--factors", type=int, default=FACTORS)
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--alpha", type=float, default=ALPHA)
+    parser.add_argument("--regularization", type=float, default=REGULARIZATION)
+    parser.add_argument("--workers", type=int, default=None, help="Threads de calcul (défaut : nombre de cœurs)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with session_scope() as db:
+        interactions, user_ids, item_ids = load_interactions(db)
+    loaded = time.perf_counter()
+    print(f"📦 {interactions.nnz} interactions, {len(user_ids)} clients, {len(item_ids)} produits "
+          f"({loaded - start:.1f}s)")
+
+    user_factors, item_factors = train(interactions, args.factors, args.iterations, args.alpha,
+                                       args.regularization, args.workers)
+    trained = time.perf_counter()
+    print(f"🧮 ALS : {args.iterations} itérations, {args.factors} facteurs ({trained - loaded:.1f}s)")
+
+    save_model(args.output, interactions, user_ids, item_ids, user_factors, item_factors, {
+        "factors": args.factors,
+        "iterations": args.iterations,
+        "alpha": args.alpha,
+        "regularization": args.regularization,
+        "customers": len(user_ids),
+        "products": len(item_ids),
+        "interactions": int(interactions.nnz),
+        "trained_at": time.time(),
+        "train_seconds": round(trained - loaded, 3),
+    })
+    print(f"✅ Modèle écrit dans {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Encodage JSON des réponses
+
+Les réponses sont sérialisées une seule fois, directement en octets, puis
+renvoyées telles quelles (sans repasser par ``jsonable_encoder``). Le format
+est compact par défaut ; l'indentation n'est activée que sur demande
+(``MCP_PRETTY_JSON=1`` ou ``?pretty=true``). orjson est utilisé s'il est
+installé, sinon le module ``json`` standard.
+"""
+import json
+import os
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dépend de l'environnement
+    orjson = None
+
+MCP_PRETTY_JSON = os.getenv("MCP_PRETTY_JSON", "0") == "1"
+
+ENCODER = "orjson" if orjson is not None else "json"
+
+
+def _default(value: Any) -> Any:
+    # Valeurs non natives (Decimal, datetime côté json standard...)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(value: Any, pretty: bool = False) -> bytes:
+    """Sérialise `value` en JSON UTF-8"""
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if pretty else 0
+        return orjson.dumps(value, default=_default, option=option)
+    if pretty:
+        return json.dumps(value, indent=2, ensure_ascii=False, default=_default).encode("utf-8")
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=_default).encode("utf-8")
+
+
+def dumps_text(value: Any, pretty: bool = False) -> str:
+    """Sérialise `value` en texte JSON (contenu texte des réponses MCP)"""
+    return dumps(value, pretty).decode("utf-8")
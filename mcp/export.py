@@ -0,0 +1,113 @@
+"""
+Export NDJSON du catalogue en flux
+
+Le catalogue complet est parcouru par une seule requête (produit joint à ses
+traductions et à ses variants actifs, triée par id produit) lue avec un
+curseur côté serveur (``yield_per`` / ``stream_results``). Les lignes d'un
+même produit étant consécutives, chaque produit est émis dès que la ligne
+suivante change d'id : la mémoire utilisée ne dépend que de la taille des
+lots, pas de la taille du catalogue. Seules les traductions de la chaîne de
+locales demandée sont jointes.
+"""
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+from sqlalchemy import and_, exists, or_, select
+from sqlalchemy.orm import Session, aliased
+
+from encoding import dumps
+from models import Product, ProductTranslation, ProductVariant
+from products import DEFAULT_LOCALES, _as_chain, pick_translation, serialize_variant, translation_filter
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+
+def export_statement(enabled_only: bool = True, updated_since: Optional[datetime] = None,
+                     locales: Optional[Sequence[str]] = None):
+    """Requête produit x traductions (de `locales`, ou toutes à défaut) x variants actifs, triée par produit"""
+    translation_join = ProductTranslation.product_id == Product.id
+    if locales is not None:
+        translation_join = and_(translation_join, translation_filter(locales))
+    statement = (
+        select(
+            Product.id, Product.code, Product.enabled, Product.created_at, Product.updated_at,
+            ProductTranslation.id.label("translation_id"), ProductTranslation.locale,
+            ProductTranslation.name, ProductTranslation.description,
+            ProductVariant,
+        )
+        .select_from(Product)
+        .outerjoin(ProductTranslation, translation_join)
+        .outerjoin(ProductVariant, and_(ProductVariant.product_id == Product.id, ProductVariant.enabled == True))
+        .order_by(Product.id, ProductTranslation.id, ProductVariant.id)
+    )
+    if enabled_only:
+        statement = statement.where(Product.enabled == True)
+    if updated_since is not None:
+        # Même règle que le rafraîchissement du snapshot : produit ou variant modifié
+        variant = aliased(ProductVariant)
+        variant_updated = exists().where(variant.product_id == Product.id, variant.updated_at >= updated_since)
+        statement = statement.where(or_(Product.updated_at >= updated_since, variant_updated))
+    return statement
+
+
+class _ProductRows:
+    """Accumule les lignes d'un produit puis le sérialise"""
+
+    def __init__(self, row):
+        self.row = row
+        self.translations: Dict[str, Any] = {}
+        self.variants: Dict[int, Dict[str, Any]] = {}
+
+    def add(self, row) -> None:
+        if row.locale is not None and row.locale not in self.translations:
+            self.translations[row.locale] = row
+        variant = row.ProductVariant
+        if variant is not None and variant.id not in self.variants:
+            self.variants[variant.id] = serialize_variant(variant)
+
+    def serialize(self, locales: Sequence[str]) -> Dict[str, Any]:
+        # Même repli que serialize_product : première locale de la chaîne disponible, sinon une quelconque
+        locale = pick_translation(self.translations, locales)
+        translation = self.translations[locale] if locale is not None else None
+        row = self.row
+        return {
+            "id": row.id,
+            "code": row.code,
+            "name": translation.name if translation else row.code,
+            "description": translation.description if translation else "",
+            "locale": locale,
+            "enabled": row.enabled,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+            "variants": list(self.variants.values()),
+        }
+
+
+def iter_export_chunks(
+    db: Session,
+    enabled_only: bool = True,
+    updated_since: Optional[datetime] = None,
+    locale: Union[str, Sequence[str]] = DEFAULT_LOCALES,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[bytes]:
+    """Produits en NDJSON, un bloc d'octets par lot de lignes lues"""
+    locales = _as_chain(locale)
+    statement = export_statement(enabled_only, updated_since, locales).execution_options(yield_per=batch_size)
+    result = db.execute(statement)
+    current: Optional[_ProductRows] = None
+    try:
+        for partition in result.partitions():
+            lines: List[bytes] = []
+            for row in partition:
+                if current is None or row.id != current.row.id:
+                    if current is not None:
+                        lines.append(dumps(current.serialize(locales)))
+                    current = _ProductRows(row)
+                current.add(row)
+            if lines:
+                yield b"\n".join(lines) + b"\n"
+        if current is not None:
+            yield dumps(current.serialize(locales)) + b"\n"
+    finally:
+        result.close()
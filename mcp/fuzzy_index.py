@@ -0,0 +1,248 @@
+"""
+Index des noms de produits pour l'autocomplétion et la recherche tolérante
+
+Deux structures sont construites à partir de ProductTranslation.name :
+
+- un index de préfixes : toutes les clés (nom complet normalisé et chacun de
+  ses suffixes de mots, pour que "rouge" complète "T-Shirt Rouge") sont
+  gardées dans un tableau trié, parcouru par recherche dichotomique. C'est un
+  trie aplati : même sémantique de préfixe, mais une seule liste Python au
+  lieu de millions de nœuds ;
+- un index de trigrammes sur le vocabulaire des noms, qui propose pour un
+  terme mal orthographié les termes proches, filtrés par distance d'édition.
+
+Comme l'index BM25, il suit le snapshot catalogue, ou sans lui les
+traductions suivies par ``CatalogDocuments``.
+"""
+import bisect
+import heapq
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from search_index import fold, tokenize, REBUILD_THRESHOLD
+
+# Nombre maximal de clés examinées par autocomplétion
+MAX_PREFIX_SCAN = 200
+# Nombre maximal de termes proposés par terme mal orthographié
+MAX_CORRECTIONS = 3
+# Nombre maximal de candidats vérifiés par distance d'édition
+MAX_CANDIDATES = 50
+
+_SEPARATOR_RE = re.compile(r"[^a-z0-9]+")
+
+Translations = Dict[str, Tuple[Optional[str], Optional[str]]]
+
+
+def normalize_name(text: str) -> str:
+    """Nom normalisé pour les préfixes ("T-Shirt Rouge" -> "t shirt rouge")"""
+    return _SEPARATOR_RE.sub(" ", fold(text)).strip()
+
+
+def trigrams(term: str) -> Set[str]:
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_distance(term: str) -> int:
+    """Distance d'édition tolérée selon la longueur du terme"""
+    if len(term) <= 3:
+        return 0
+    return 1 if len(term) <= 6 else 2
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Distance de Levenshtein, abandonnée dès qu'elle dépasse `limit`"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _name_keys(names: Iterable[str]) -> Set[str]:
+    keys = set()
+    for name in names:
+        normalized = normalize_name(name)
+        words = normalized.split(" ")
+        for i in range(len(words)):
+            if words[i]:
+                keys.add(" ".join(words[i:]))
+    return keys
+
+
+class ProductNameIndex:
+    """Index de préfixes et de trigrammes sur les noms de produits"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.keys: List[Tuple[str, int]] = []
+        self.doc_keys: Dict[int, Set[str]] = {}
+        self.doc_terms: Dict[int, Set[str]] = {}
+        self.term_counts: Dict[str, int] = {}
+        # (trigramme, longueur du terme) -> termes ; la longueur filtre d'emblée
+        # les candidats trop courts ou trop longs pour la distance tolérée
+        self.trigram_terms: Dict[Tuple[str, int], Set[str]] = {}
+
+    def __len__(self):
+        return len(self.doc_keys)
+
+    # Construction --------------------------------------------------------
+
+    def _add_term(self, term: str) -> None:
+        count = self.term_counts.get(term, 0)
+        self.term_counts[term] = count + 1
+        if count == 0:
+            for gram in trigrams(term):
+                self.trigram_terms.setdefault((gram, len(term)), set()).add(term)
+
+    def _remove_term(self, term: str) -> None:
+        count = self.term_counts.get(term, 0) - 1
+        if count > 0:
+            self.term_counts[term] = count
+            return
+        self.term_counts.pop(term, None)
+        for gram in trigrams(term):
+            key = (gram, len(term))
+            bucket = self.trigram_terms.get(key)
+            if bucket is not None:
+                bucket.discard(term)
+                if not bucket:
+                    del self.trigram_terms[key]
+
+    def _index(self, pid: int, translations: Translations) -> Tuple[Set[str], Set[str]]:
+        names = [name for name, _ in translations.values() if name]
+        terms = set()
+        for name in names:
+            terms.update(tokenize(name))
+        return _name_keys(names), terms
+
+    def rebuild(self, documents: Iterable[Tuple[int, Translations]]) -> None:
+        """Reconstruit l'index à côté puis remplace l'index courant"""
+        fresh = ProductNameIndex()
+        keys = []
+        for pid, translations in documents:
+            doc_keys, terms = fresh._index(pid, translations)
+            fresh.doc_keys[pid] = doc_keys
+            fresh.doc_terms[pid] = terms
+            keys.extend((key, pid) for key in doc_keys)
+            for term in terms:
+                fresh._add_term(term)
+        keys.sort()
+        with self._lock:
+            self.keys = keys
+            self.doc_keys = fresh.doc_keys
+            self.doc_terms = fresh.doc_terms
+            self.term_counts = fresh.term_counts
+            self.trigram_terms = fresh.trigram_terms
+
+    def _remove(self, pid: int) -> None:
+        for key in self.doc_keys.pop(pid, ()):
+            position = bisect.bisect_left(self.keys, (key, pid))
+            if position < len(self.keys) and self.keys[position] == (key, pid):
+                del self.keys[position]
+        for term in self.doc_terms.pop(pid, ()):
+            self._remove_term(term)
+
+    def update(self, documents: Iterable[Tuple[int, Translations]], removed: Iterable[int] = ()) -> None:
+        """Met à jour quelques produits en place"""
+        prepared = [(pid,) + self._index(pid, translations) for pid, translations in documents]
+        with self._lock:
+            for pid in removed:
+                self._remove(pid)
+            for pid, doc_keys, terms in prepared:
+                self._remove(pid)
+                self.doc_keys[pid] = doc_keys
+                self.doc_terms[pid] = terms
+                for key in doc_keys:
+                    bisect.insort(self.keys, (key, pid))
+                for term in terms:
+                    self._add_term(term)
+
+    def attach(self, snapshot) -> None:
+        """Abonne l'index aux changements du catalogue (snapshot ou traductions suivies)"""
+        def on_change(changed: Set[int], removed: Set[int]) -> None:
+            translations = snapshot.translations
+            if len(changed) > REBUILD_THRESHOLD or not self.doc_keys:
+                self.rebuild(translations.items())
+            else:
+                self.update(((pid, translations[pid]) for pid in changed if pid in translations), removed)
+
+        snapshot.add_listener(on_change)
+
+    # Recherche -----------------------------------------------------------
+
+    def complete(self, prefix: str, limit: int = 10) -> List[int]:
+        """Ids des produits dont un nom (ou une fin de nom) commence par `prefix`"""
+        needle = normalize_name(prefix)
+        if not needle or limit <= 0:
+            return []
+        # Un préfixe qui se termine par un séparateur doit rester un mot complet
+        if prefix[-1:].isspace() or prefix[-1:] in "-_'":
+            needle += " "
+        with self._lock:
+            keys = self.keys
+            start = bisect.bisect_left(keys, (needle, -1))
+            matches: Dict[int, Tuple[int, int, str]] = {}
+            for key, pid in keys[start:start + MAX_PREFIX_SCAN]:
+                if not key.startswith(needle):
+                    break
+                # Priorité au nom complet, puis aux noms les plus courts
+                rank = (0 if self._is_full_name(pid, key) else 1, len(key), key)
+                if pid not in matches or rank < matches[pid]:
+                    matches[pid] = rank
+        return sorted(matches, key=lambda pid: (matches[pid], pid))[:limit]
+
+    def _is_full_name(self, pid: int, key: str) -> bool:
+        doc_keys = self.doc_keys.get(pid, ())
+        # La clé la plus longue d'un nom est le nom complet
+        return not any(other != key and other.endswith(" " + key) for other in doc_keys)
+
+    def corrections(self, term: str) -> List[str]:
+        """Termes du vocabulaire proches de `term` (lui compris s'il existe)"""
+        if term in self.term_counts:
+            return [term]
+        limit = max_distance(term)
+        if limit == 0:
+            return []
+        grams = trigrams(term)
+        lengths = range(max(1, len(term) - limit), len(term) + limit + 1)
+        with self._lock:
+            trigram_terms = self.trigram_terms
+            generated: Dict[str, int] = {}
+            for length in lengths:
+                # Une édition modifie au plus 3 trigrammes : tout terme à distance
+                # <= limit partage au moins un des 3 * limit + 1 trigrammes les
+                # plus rares, ce qui borne la génération de candidats.
+                rarest = sorted(grams, key=lambda g: len(trigram_terms.get((g, length), ())))[:3 * limit + 1]
+                for gram in rarest:
+                    for candidate in trigram_terms.get((gram, length), ()):
+                        generated[candidate] = generated.get(candidate, 0) + 1
+            term_counts = self.term_counts
+        # Les candidats partageant le plus de trigrammes rares sont vérifiés en premier
+        candidates = heapq.nlargest(
+            MAX_CANDIDATES, generated, key=lambda c: (generated[c], term_counts.get(c, 0), c)
+        )
+        scored = []
+        for candidate in candidates:
+            distance = edit_distance(term, candidate, limit)
+            if distance <= limit:
+                scored.append((distance, -term_counts.get(candidate, 0), candidate))
+        return [candidate for _, _, candidate in sorted(scored)[:MAX_CORRECTIONS]]
+
+    def expand_query(self, query: str) -> str:
+        """Ajoute à chaque terme de la requête ses corrections probables"""
+        expanded = []
+        for term in tokenize(query):
+            expanded.append(term)
+            expanded.extend(c for c in self.corrections(term) if c != term)
+        return " ".join(expanded)
+
+
+name_index = ProductNameIndex()
@@ -6,7 +6,8 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from models import engine, Base, Product, ProductVariant, ProductTranslation, ProductVariantTranslation
+from models import engine, Base, Product, ProductVariant, ProductTranslation, ProductVariantTranslation, ChannelPricing
+from pricing import SYLIUS_CHANNEL
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 
@@ -107,6 +108,14 @@ def init_database():
             )
             db.add(variant_translation)
 
+            # Prix du variant dans le canal (en centimes)
+            db.add(ChannelPricing(
+                product_variant_id=variant.id,
+                channel_code=SYLIUS_CHANNEL,
+                price=round(product_data["price"] * 100),
+                original_price=None
+            ))
+
         # Commit des changements
         db.commit()
 
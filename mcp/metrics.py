@@ -0,0 +1,170 @@
+"""
+Métriques des appels d'outils au format texte Prometheus (``GET /metrics``)
+
+Par outil et par transport (``mcp`` pour ``/mcp``, ``tools`` pour
+``/tools/{tool_name}``) : histogrammes de latence et de taille des réponses,
+compteurs d'appels, d'erreurs (par code JSON-RPC) et de réponses servies par
+le cache, appels en cours. Les jauges du cache, du pool de connexions et du
+snapshot sont lues au moment de la collecte.
+
+Les appels sont enregistrés depuis la boucle asyncio uniquement : de simples
+dictionnaires suffisent, sans verrou sur le chemin chaud (un ``perf_counter``
+et quelques incréments par appel). Chaque worker uvicorn tient ses propres
+compteurs ; avec plusieurs workers, chacun est une cible Prometheus distincte.
+"""
+import math
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bornes des histogrammes : secondes et octets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Étiquette des appels à un outil inexistant (le nom demandé n'est pas repris : cardinalité bornée)
+UNKNOWN_TOOL = "unknown"
+
+METRICS = os.getenv("METRICS", "1") != "0"
+
+Labels = Tuple[str, str]
+
+
+class Histogram:
+    """Histogramme à bornes fixes (comptes par tranche, cumulés à l'export)"""
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class ToolCall:
+    """Appel en cours : complété par run_tool, enregistré par ToolMetrics.finish"""
+    __slots__ = ("labels", "started", "size", "error", "cached")
+
+    def __init__(self, labels: Labels):
+        self.labels = labels
+        self.started = time.perf_counter()
+        self.size: Optional[int] = None
+        self.error: Optional[str] = None
+        self.cached = False
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class ToolMetrics:
+    def __init__(self, enabled: bool = METRICS, latency_buckets: Sequence[float] = LATENCY_BUCKETS,
+                 size_buckets: Sequence[float] = SIZE_BUCKETS):
+        self.enabled = enabled
+        self.latency_buckets = latency_buckets
+        self.size_buckets = size_buckets
+        self.latency: Dict[Labels, Histogram] = {}
+        self.sizes: Dict[Labels, Histogram] = {}
+        self.requests: Dict[Labels, int] = {}
+        self.errors: Dict[Tuple[str, str, str], int] = {}
+        self.cache_hits: Dict[Labels, int] = {}
+        self.in_flight: Dict[Labels, int] = {}
+        # (nom, aide, type, lecture) : valeurs lues à chaque collecte, None pour omettre
+        self.gauges: List[Tuple[str, str, str, Callable[[], Optional[float]]]] = []
+
+    def start(self, tool: str, transport: str) -> ToolCall:
+        call = ToolCall((tool, transport))
+        if self.enabled:
+            self.in_flight[call.labels] = self.in_flight.get(call.labels, 0) + 1
+        return call
+
+    def finish(self, call: ToolCall) -> None:
+        if not self.enabled:
+            return
+        labels = call.labels
+        self.in_flight[labels] = self.in_flight.get(labels, 1) - 1
+        self.requests[labels] = self.requests.get(labels, 0) + 1
+        latency = self.latency.get(labels)
+        if latency is None:
+            latency = self.latency[labels] = Histogram(self.latency_buckets)
+        latency.observe(time.perf_counter() - call.started)
+        if call.size is not None:
+            sizes = self.sizes.get(labels)
+            if sizes is None:
+                sizes = self.sizes[labels] = Histogram(self.size_buckets)
+            sizes.observe(call.size)
+        if call.error is not None:
+            key = labels + (call.error,)
+            self.errors[key] = self.errors.get(key, 0) + 1
+        if call.cached:
+            self.cache_hits[labels] = self.cache_hits.get(labels, 0) + 1
+
+    def add_gauge(self, name: str, help: str, collect: Callable[[], Optional[float]], kind: str = "gauge") -> None:
+        """Valeur lue à chaque collecte (`kind` : gauge ou counter)"""
+        self.gauges.append((name, help, kind, collect))
+
+    def render(self) -> str:
+        """Exposition au format texte Prometheus 0.0.4"""
+        lines: List[str] = []
+        tool_labels = ("tool", "transport")
+
+        def header(name: str, help: str, kind: str) -> None:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def series(name: str, help: str, kind: str, values: Dict[tuple, float], names=tool_labels) -> None:
+            header(name, help, kind)
+            for labels, value in sorted(values.items()):
+                lines.append(f"{name}{_labels(names, labels)} {_number(value)}")
+
+        def histograms(name: str, help: str, values: Dict[Labels, Histogram]) -> None:
+            header(name, help, "histogram")
+            for labels, histogram in sorted(values.items()):
+                cumulative = 0
+                for bound, count in zip(list(histogram.bounds) + [math.inf], histogram.counts):
+                    cumulative += count
+                    le = 'le="%s"' % _number(float(bound))
+                    lines.append(f"{name}_bucket{_labels(tool_labels, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(tool_labels, labels)} {_number(histogram.sum)}")
+                lines.append(f"{name}_count{_labels(tool_labels, labels)} {cumulative}")
+
+        series("mcp_tool_requests_total", "Tool calls, by tool and transport", "counter", self.requests)
+        series("mcp_tool_errors_total", "Failed tool calls, by JSON-RPC error code", "counter", self.errors,
+               names=("tool", "transport", "code"))
+        series("mcp_tool_cache_hits_total", "Tool calls answered from the result cache", "counter", self.cache_hits)
+        series("mcp_tool_in_flight", "Tool calls in progress", "gauge", self.in_flight)
+        histograms("mcp_tool_latency_seconds", "Tool call latency, encoding included", self.latency)
+        histograms("mcp_tool_response_bytes", "Encoded tool result size", self.sizes)
+
+        for name, help, kind, collect in self.gauges:
+            try:
+                value = collect()
+            except Exception:
+                value = None
+            if value is not None:
+                header(name, help, kind)
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+tool_metrics = ToolMetrics()
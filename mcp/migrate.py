@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Ajoute au schéma Sylius les index dont dépendent les requêtes du serveur MCP
+
+Les tables Sylius appartiennent à Sylius (Doctrine) : ``create_all`` ne crée
+pas d'index sur une table existante. Ce script compare les index déclarés
+dans ``models.py`` à ceux de la base et crée ceux qui manquent, sans toucher
+au reste du schéma. Il peut être relancé sans effet.
+
+Usage : python migrate.py [--dry-run]
+"""
+import argparse
+from typing import List
+
+from sqlalchemy import Index, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex
+
+from models import ChannelPricing, Order, Product, ProductTaxon, ProductVariant, Taxon
+
+# Index ajoutés par le serveur MCP aux tables Sylius
+MCP_INDEXES: List[Index] = [
+    index for model in (Product, ProductVariant, ChannelPricing, Taxon, ProductTaxon, Order)
+    for index in sorted(model.__table__.indexes, key=lambda index: index.name) if index.name.startswith("idx_mcp_")
+]
+
+
+def missing_indexes(engine: Engine) -> List[Index]:
+    """Index de MCP_INDEXES absents de la base"""
+    inspector = inspect(engine)
+    missing = []
+    for index in MCP_INDEXES:
+        existing = {found["name"] for found in inspector.get_indexes(index.table.name)}
+        if index.name not in existing:
+            missing.append(index)
+    return missing
+
+
+def migrate(engine: Engine, dry_run: bool = False) -> List[str]:
+    """Crée les index manquants ; retourne leurs instructions DDL"""
+    statements = []
+    for index in missing_indexes(engine):
+        statements.append(str(CreateIndex(index).compile(bind=engine)).strip())
+        if not dry_run:
+            index.create(bind=engine)
+    return statements
+
+
+def main():
+    from models import engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Affiche les instructions sans les exécuter")
+    args = parser.parse_args()
+
+    statements = migrate(engine, args.dry_run)
+    for statement in statements:
+        print(f"{'📝' if args.dry_run else '✅'} {statement}")
+    if not statements:
+        print("✅ Tous les index sont déjà présents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Stockage des modèles précalculés en fichiers ``.npy`` ouverts en mmap
+
+Un modèle est un répertoire : un fichier ``.npy`` par tableau plus un
+``meta.json``. Il est écrit dans un répertoire temporaire propre à chaque
+écriture puis échangé avec l'ancien sous un verrou de fichier
+(``{path}.lock``, exclusif pour l'échange, partagé pour la lecture) :
+plusieurs workers uvicorn peuvent écrire le même modèle sans se gêner et
+aucun lecteur ne voit un échange à moitié fait. Les processus qui ouvrent
+les tableaux en ``mmap_mode="r"`` partagent une seule copie via le cache de
+pages, et ceux qui ont encore l'ancien modèle ouvert gardent des fichiers
+valides jusqu'à leur rechargement.
+"""
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+
+@contextmanager
+def file_lock(path: str, exclusive: bool = True, blocking: bool = True) -> Iterator[bool]:
+    """Verrou `flock` sur `path` entre processus ; donne False si `blocking` est faux et le verrou déjà pris"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        flags = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def save_arrays(path: str, arrays: Dict[str, np.ndarray], meta: Dict) -> None:
+    """Écrit le modèle dans un répertoire temporaire unique puis remplace l'ancien sous verrou"""
+    parent, name = os.path.split(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=parent, prefix=f"{name}.tmp-")
+    previous = f"{staging}.old"
+    try:
+        for array, values in arrays.items():
+            np.save(os.path.join(staging, f"{array}.npy"), values)
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        with file_lock(f"{path}.lock"):
+            if os.path.exists(path):
+                os.rename(path, previous)
+            os.rename(staging, path)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+class MappedModel:
+    """Tableaux d'un modèle ouverts en mmap, rechargés quand le modèle est réécrit"""
+
+    # Noms des tableaux du modèle
+    ARRAYS: Tuple[str, ...] = ()
+
+    def __init__(self, path: str):
+        self.path = path
+        self.arrays: Optional[Dict[str, np.ndarray]] = None
+        self.meta: Dict = {}
+        self._mtime: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.arrays is not None
+
+    def _meta_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(os.path.join(self.path, "meta.json")).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def load(self) -> bool:
+        """Ouvre le modèle s'il existe ; retourne False sinon"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            # Partagé : jamais pendant un échange de répertoires
+            with file_lock(f"{self.path}.lock", exclusive=False):
+                mtime = os.stat(os.path.join(self.path, "meta.json")).st_mtime
+                arrays = {name: np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r") for name in self.ARRAYS}
+                with open(os.path.join(self.path, "meta.json")) as f:
+                    meta = json.load(f)
+        except FileNotFoundError:
+            return False
+        self.arrays, self.meta, self._mtime = arrays, meta, mtime
+        return True
+
+    def reload_if_changed(self) -> None:
+        mtime = self._meta_mtime()
+        if mtime is not None and mtime != self._mtime:
+            self.load()
+
+    def mapped_bytes(self) -> int:
+        arrays = self.arrays
+        return int(sum(values.nbytes for values in arrays.values())) if arrays else 0
@@ -1,15 +1,25 @@
 """
 Modèles de base de données pour Sylius
 """
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, Float, ForeignKey
+import os
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, Float, ForeignKey, Index, UniqueConstraint
+from sqlalchemy import exc
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import QueuePool
 from datetime import datetime
 
+from sql_stats import sql_instrumentation
+
 Base = declarative_base()
 
 class Product(Base):
     __tablename__ = 'sylius_product'
+    # Tri « nouveautés » de browse_sylius_products ; voir migrate.py
+    __table_args__ = (Index('idx_mcp_product_enabled_created', 'enabled', 'created_at'),)
 
     id = Column(Integer, primary_key=True)
     code = Column(String(255), unique=True, nullable=False)
@@ -20,21 +30,25 @@ class Product(Base):
     # Relations
     translations = relationship("ProductTranslation", back_populates="product")
     variants = relationship("ProductVariant", back_populates="product")
+    product_taxons = relationship("ProductTaxon", back_populates="product")
+
+    def get_translation(self, *locales):
+        """Première traduction disponible parmi `locales`, sinon la première disponible"""
+        by_locale = {translation.locale: translation for translation in self.translations}
+        for locale in locales:
+            if locale in by_locale:
+                return by_locale[locale]
+        return by_locale[min(by_locale)] if by_locale else None
 
-    def get_name(self, locale='en_US'):
-        """Retourne le nom du produit dans la locale spécifiée"""
-        for translation in self.translations:
-            if translation.locale == locale:
-                return translation.name
-        # Retourne le premier nom disponible si la locale n'est pas trouvée
-        return self.translations[0].name if self.translations else self.code
-
-    def get_description(self, locale='en_US'):
-        """Retourne la description du produit dans la locale spécifiée"""
-        for translation in self.translations:
-            if translation.locale == locale:
-                return translation.description
-        return self.translations[0].description if self.translations else ""
+    def get_name(self, *locales):
+        """Retourne le nom du produit dans la première locale disponible, sinon son code"""
+        translation = self.get_translation(*locales)
+        return translation.name if translation else self.code
+
+    def get_description(self, *locales):
+        """Retourne la description du produit dans la première locale disponible"""
+        translation = self.get_translation(*locales)
+        return translation.description if translation else ""
 
 class ProductTranslation(Base):
     __tablename__ = 'sylius_product_translation'
@@ -49,6 +63,8 @@ class ProductTranslation(Base):
 
 class ProductVariant(Base):
     __tablename__ = 'sylius_product_variant'
+    # Index couvrant du filtre de stock (EXISTS par produit) ; absent du schéma Sylius, voir migrate.py
+    __table_args__ = (Index('idx_mcp_variant_stock', 'product_id', 'enabled', 'tracked', 'on_hand', 'on_hold'),)
 
     id = Column(Integer, primary_key=True)
     code = Column(String(255), unique=True, nullable=False)
@@ -68,11 +84,15 @@ class ProductVariant(Base):
     # Relations
     product = relationship("Product", back_populates="variants")
     translations = relationship("ProductVariantTranslation", back_populates="variant")
+    channel_pricings = relationship("ChannelPricing", back_populates="variant")
 
-    def get_price(self):
-        """Retourne le prix du variant (simplifié)"""
-        # Dans Sylius, les prix sont plus complexes, mais pour cet exemple on retourne une valeur fixe
-        return 29.99
+    def get_price(self, channel_code):
+        """Retourne le prix du variant dans le canal (en unités), None s'il n'en a pas"""
+        # Charge la relation si besoin : pour une liste de variants, passer par pricing.price_cache
+        for pricing in self.channel_pricings:
+            if pricing.channel_code == channel_code:
+                return pricing.price / 100 if pricing.price is not None else None
+        return None
 
 class ProductVariantTranslation(Base):
     __tablename__ = 'sylius_product_variant_translation'
@@ -84,16 +104,230 @@ class ProductVariantTranslation(Base):
 
     variant = relationship("ProductVariant", back_populates="translations")
 
+class ChannelPricing(Base):
+    __tablename__ = 'sylius_channel_pricing'
+    __table_args__ = (
+        UniqueConstraint('product_variant_id', 'channel_code'),
+        # Filtre et tri par prix d'un canal ; voir migrate.py
+        Index('idx_mcp_channel_pricing_price', 'channel_code', 'product_variant_id', 'price'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    product_variant_id = Column(Integer, ForeignKey('sylius_product_variant.id'), nullable=False)
+    channel_code = Column(String(255), nullable=False)
+    # Montants en centimes, comme dans Sylius
+    price = Column(Integer)
+    original_price = Column(Integer)
+    minimum_price = Column(Integer, default=0)
+
+    variant = relationship("ProductVariant", back_populates="channel_pricings")
+
+class Taxon(Base):
+    """Catégorie Sylius, arbre stocké en ensembles imbriqués (tree_left/tree_right)"""
+    __tablename__ = 'sylius_taxon'
+    # Descendants d'une catégorie : même racine, tree_left entre ses bornes ; voir migrate.py
+    __table_args__ = (Index('idx_mcp_taxon_tree', 'tree_root', 'tree_left', 'tree_right'),)
+
+    id = Column(Integer, primary_key=True)
+    code = Column(String(255), unique=True, nullable=False)
+    parent_id = Column(Integer, ForeignKey('sylius_taxon.id'))
+    tree_root = Column(Integer, ForeignKey('sylius_taxon.id'))
+    tree_left = Column(Integer, nullable=False)
+    tree_right = Column(Integer, nullable=False)
+    tree_level = Column(Integer, nullable=False, default=0)
+    position = Column(Integer, default=0)
+    enabled = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    translations = relationship("TaxonTranslation", back_populates="taxon")
+
+class TaxonTranslation(Base):
+    __tablename__ = 'sylius_taxon_translation'
+
+    id = Column(Integer, primary_key=True)
+    translatable_id = Column(Integer, ForeignKey('sylius_taxon.id'), nullable=False)
+    name = Column(String(255), nullable=False)
+    slug = Column(String(255), nullable=False)
+    description = Column(Text)
+    locale = Column(String(255), nullable=False)
+
+    taxon = relationship("Taxon", back_populates="translations")
+
+class ProductTaxon(Base):
+    __tablename__ = 'sylius_product_taxon'
+    __table_args__ = (
+        UniqueConstraint('product_id', 'taxon_id'),
+        # Produits d'une catégorie sans passer par la table produit ; voir migrate.py
+        Index('idx_mcp_product_taxon_taxon', 'taxon_id', 'product_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey('sylius_product.id'), nullable=False)
+    taxon_id = Column(Integer, ForeignKey('sylius_taxon.id'), nullable=False)
+    position = Column(Integer)
+
+    product = relationship("Product", back_populates="product_taxons")
+    taxon = relationship("Taxon")
+
+class Order(Base):
+    __tablename__ = 'sylius_order'
+    # Commandes modifiées depuis le dernier rafraîchissement des co-achats (annulations, remboursements)
+    __table_args__ = (Index('idx_mcp_order_updated', 'updated_at'),)
+
+    id = Column(Integer, primary_key=True)
+    number = Column(String(255), unique=True)
+    state = Column(String(255), nullable=False, default='cart')
+    checkout_state = Column(String(255), nullable=False, default='cart')
+    payment_state = Column(String(255), nullable=False, default='cart')
+    customer_id = Column(Integer, index=True)
+    checkout_completed_at = Column(DateTime, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    items = relationship("OrderItem", back_populates="order")
+
+class OrderItem(Base):
+    __tablename__ = 'sylius_order_item'
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey('sylius_order.id'), nullable=False)
+    variant_id = Column(Integer, ForeignKey('sylius_product_variant.id'), nullable=False)
+    quantity = Column(Integer, default=1)
+    unit_price = Column(Integer, default=0)
+    total = Column(Integer, default=0)
+
+    order = relationship("Order", back_populates="items")
+    variant = relationship("ProductVariant")
+
+# Tables du serveur MCP (hors schéma Sylius), écrites par precompute.py
+
+class PrecomputedRecommendation(Base):
+    __tablename__ = 'mcp_precomputed_recommendation'
+
+    # Clé primaire = l'index de la lecture (type, produit ou client)
+    kind = Column(String(32), primary_key=True)
+    subject_id = Column(Integer, primary_key=True, autoincrement=False)
+    # JSON compact : [[id produit, score], ...] trié par score décroissant
+    items = Column(Text, nullable=False)
+    computed_at = Column(DateTime, nullable=False)
+
+class PrecomputeRun(Base):
+    __tablename__ = 'mcp_precompute_run'
+
+    kind = Column(String(32), primary_key=True)
+    # Données prises en compte par l'exécution en cours ou la dernière terminée
+    watermark = Column(DateTime)
+    # Watermark de l'exécution précédente (None : exécution complète)
+    since = Column(DateTime)
+    # Dernier sujet écrit : une exécution interrompue reprend après lui
+    last_subject_id = Column(Integer)
+    started_at = Column(DateTime)
+    completed_at = Column(DateTime)
+    subjects = Column(Integer, default=0)
+
 # Configuration de la base de données
-DATABASE_URL = "mysql+pymysql://root:@mysql:3306/sylius"
+DATABASE_URL = os.getenv("DATABASE_URL") or "mysql+pymysql://{user}:{password}@{host}:{port}/{name}".format(
+    user=os.getenv("SYLIUS_DB_USER", "root"),
+    password=os.getenv("SYLIUS_DB_PASSWORD", ""),
+    host=os.getenv("SYLIUS_DB_HOST", "mysql"),
+    port=os.getenv("SYLIUS_DB_PORT", "3306"),
+    name=os.getenv("SYLIUS_DB_NAME", "sylius"),
+)
+
+# Configuration du pool de connexions
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") != "0"
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool qui mesure les attentes de connexion quand le pool est saturé"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
 
-engine = create_engine(DATABASE_URL, echo=False)
+    def _do_get(self):
+        exhausted = self.checkedin() == 0 and self.overflow() >= self._max_overflow
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            # Une attente terminée par un timeout reste une attente
+            waited = time.perf_counter() - start
+            if exhausted:
+                with self._stats_lock:
+                    self.waits += 1
+                    self.wait_time += waited
+                    self.max_wait_time = max(self.max_wait_time, waited)
+        # Seuls les checkouts réussis sont comptés
+        with self._stats_lock:
+            self.checkouts += 1
+        return connection
+
+def _engine_options(url):
+    """Options de create_engine selon le dialecte"""
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+engine = create_engine(DATABASE_URL, echo=False, **_engine_options(DATABASE_URL))
+# Requêtes et temps SQL par appel d'outil (SQL_DEBUG), requêtes lentes (SLOW_QUERY_MS) ; réglable à chaud
+sql_instrumentation.attach(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def get_db():
-    """Retourne une session de base de données"""
+@contextmanager
+def session_scope():
+    """Ouvre une session pour la durée du bloc et la ferme toujours"""
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_db():
+    """Retourne une session de base de données"""
+    with session_scope() as db:
+        yield db
+
+def get_pool_stats():
+    """Statistiques instantanées du pool de connexions"""
+    pool = engine.pool
+    stats = {"pool_class": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout(),
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        with pool._stats_lock:
+            stats.update({
+                "checkouts": pool.checkouts,
+                "waits": pool.waits,
+                "wait_time_seconds": round(pool.wait_time, 6),
+                "max_wait_time_seconds": round(pool.max_wait_time, 6),
+                "timeouts": pool.timeouts,
+            })
+    return stats
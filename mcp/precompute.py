@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Précalcul par lots des recommandations (pool de processus)
+
+Calcule les N meilleures recommandations de chaque produit actif (voisins
+TF-IDF, comme ``recommend_similar_products``) et, en option, de chaque client
+du modèle ALS, puis les écrit dans la table ``mcp_precomputed_recommendation``
+(une ligne JSON compacte par produit ou client) : l'outil
+``get_precomputed_recommendations`` n'est plus qu'une lecture par clé primaire.
+
+Les sujets sont découpés en blocs répartis sur un pool de processus ; la
+matrice TF-IDF (ou le chemin du modèle ALS, ouvert en mmap) est transmise une
+fois à chaque processus. Chaque bloc calculé est écrit et validé avec la
+progression de l'exécution (``mcp_precompute_run``) : une exécution
+interrompue reprend après le dernier sujet écrit.
+
+Les exécutions suivantes sont incrémentales : seuls les produits modifiés
+depuis le watermark de la précédente, les produits dont la liste contenait un
+produit modifié et ceux dont il peut désormais faire partie sont recalculés.
+Côté clients, seuls ceux qui ont passé commande depuis sont recalculés (leurs
+nouveaux achats sont exclus), sauf si le modèle a été réentraîné entre-temps.
+
+Usage : python precompute.py [--kinds similar,customer] [--top-n 20] [--workers 4] [--full]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from co_purchase import order_dropped
+from customer_model import CUSTOMER_MODEL_PATH, CustomerModel
+from encoding import dumps_text
+from models import Order, OrderItem, PrecomputedRecommendation, PrecomputeRun, Product, ProductVariant
+from recommendations import build_vectors, load_documents, top_k_neighbors
+
+KINDS = ("similar", "customer")
+TOP_N = 20
+# Sujets par tâche envoyée au pool (et par transaction d'écriture)
+CHUNK_SIZE = 500
+
+# Liste précalculée : (id produit, score), triée par score décroissant
+Items = List[Tuple[int, float]]
+
+
+# Processus de calcul ------------------------------------------------------
+
+_worker: Dict[str, object] = {}
+
+
+def _init_similar_worker(matrix: sparse.csr_matrix, ids: np.ndarray, top_n: int) -> None:
+    _worker.update(matrix=matrix, ids=ids, top_n=top_n)
+
+
+def _similar_chunk(subjects: List[int]) -> List[Tuple[int, Items]]:
+    ids = _worker["ids"]
+    rows = np.searchsorted(ids, subjects)
+    neighbors = top_k_neighbors(_worker["matrix"], ids, rows, _worker["top_n"])
+    return [
+        (pid, [(int(n), round(float(s), 6)) for n, s in zip(*neighbors[pid])])
+        for pid in subjects
+    ]
+
+
+def _init_customer_worker(path: str, top_n: int) -> None:
+    # Chaque processus ouvre le modèle en mmap : une seule copie en mémoire
+    model = CustomerModel(path)
+    model.load()
+    _worker.update(model=model, top_n=top_n)
+
+
+def _customer_chunk(subjects: List[Tuple[int, List[int]]]) -> List[Tuple[int, Items]]:
+    model, top_n = _worker["model"], _worker["top_n"]
+    result = []
+    for customer_id, excluded in subjects:
+        recommended, _ = model.recommend(customer_id, k=top_n + len(excluded))
+        excluded = set(excluded)
+        result.append((customer_id, [
+            (pid, round(score, 6)) for pid, score in recommended if pid not in excluded
+        ][:top_n]))
+    return result
+
+
+# Exécutions ---------------------------------------------------------------
+
+def _start_run(db: Session, kind: str, watermark: Optional[datetime], full: bool) -> PrecomputeRun:
+    """Reprend l'exécution interrompue de `kind`, ou en démarre une nouvelle"""
+    run = db.get(PrecomputeRun, kind)
+    if run is not None and run.completed_at is None and run.started_at is not None and not full:
+        return run
+    if run is None:
+        run = PrecomputeRun(kind=kind)
+        db.add(run)
+    # Sans exécution terminée, tout est recalculé ; sans donnée au watermark, on repart de son début
+    run.since = None if full or run.completed_at is None else run.watermark or run.started_at
+    run.watermark = watermark
+    run.last_subject_id = None
+    run.started_at = datetime.utcnow()
+    run.completed_at = None
+    run.subjects = 0
+    db.commit()
+    return run
+
+
+def _write(db: Session, run: PrecomputeRun, results: List[Tuple[int, Items]]) -> None:
+    """Remplace les listes d'un bloc et enregistre la progression"""
+    if not results:
+        return
+    subject_ids = [subject_id for subject_id, _ in results]
+    db.query(PrecomputedRecommendation).filter(
+        PrecomputedRecommendation.kind == run.kind,
+        PrecomputedRecommendation.subject_id.in_(subject_ids),
+    ).delete(synchronize_session=False)
+    now = datetime.utcnow()
+    db.execute(insert(PrecomputedRecommendation), [
+        {"kind": run.kind, "subject_id": subject_id, "items": dumps_text(items), "computed_at": now}
+        for subject_id, items in results
+    ])
+    run.last_subject_id = subject_ids[-1]
+    run.subjects = (run.subjects or 0) + len(results)
+    db.commit()
+
+
+def _delete(db: Session, kind: str, subject_ids: Iterable[int]) -> None:
+    subject_ids = list(subject_ids)
+    if subject_ids:
+        db.query(PrecomputedRecommendation).filter(
+            PrecomputedRecommendation.kind == kind,
+            PrecomputedRecommendation.subject_id.in_(subject_ids),
+        ).delete(synchronize_session=False)
+        db.commit()
+
+
+def _finish_run(db: Session, run: PrecomputeRun) -> None:
+    if run.since is None:
+        # Exécution complète : les sujets qui n'ont pas été réécrits ont disparu
+        db.query(PrecomputedRecommendation).filter(
+            PrecomputedRecommendation.kind == run.kind,
+            PrecomputedRecommendation.computed_at < run.started_at,
+        ).delete(synchronize_session=False)
+    run.completed_at = datetime.utcnow()
+    db.commit()
+
+
+def _dispatch(db: Session, run: PrecomputeRun, subjects: list, key: Callable, task: Callable,
+              initializer: Callable, initargs: tuple, workers: Optional[int], chunk_size: int) -> None:
+    """Calcule les blocs en parallèle et les écrit dans l'ordre des sujets"""
+    if run.last_subject_id is not None:
+        subjects = [subject for subject in subjects if key(subject) > run.last_subject_id]
+    if not subjects:
+        return
+    chunks = [subjects[start:start + chunk_size] for start in range(0, len(subjects), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=initializer,
+                             initargs=initargs) as pool:
+        for results in pool.map(task, chunks):
+            _write(db, run, results)
+
+
+def _stored_lists(db: Session, kind: str) -> Iterable[Tuple[int, Items]]:
+    for subject_id, items in db.query(PrecomputedRecommendation.subject_id, PrecomputedRecommendation.items).filter(
+            PrecomputedRecommendation.kind == kind).yield_per(10000):
+        yield subject_id, json.loads(items)
+
+
+def _affected_products(db: Session, changed: Set[int], matrix: sparse.csr_matrix, ids: np.ndarray,
+                       top_n: int) -> Set[int]:
+    """Produits dont la liste peut changer quand `changed` est modifié ou retiré"""
+    affected = set(changed)
+    # Score du N-ième voisin stocké (-1 si la liste n'est pas pleine : tout produit proche y entre)
+    thresholds = np.full(len(ids), -1.0, dtype=np.float32)
+    for subject_id, items in _stored_lists(db, "similar"):
+        if any(pid in changed for pid, _ in items):
+            affected.add(subject_id)
+        row = int(np.searchsorted(ids, subject_id))
+        if len(items) >= top_n and row < len(ids) and ids[row] == subject_id:
+            thresholds[row] = items[-1][1]
+    changed_ids = sorted(changed)
+    rows = np.searchsorted(ids, changed_ids)
+    present = [row for row, pid in zip(rows, changed_ids) if row < len(ids) and ids[row] == pid]
+    if present:
+        similarities = (matrix[present] @ matrix.T).tocsr()
+        cols = similarities.indices[similarities.data > thresholds[similarities.indices]]
+        affected.update(ids[cols].tolist())
+    return affected
+
+
+def precompute_similar(db: Session, top_n: int = TOP_N, workers: Optional[int] = None, full: bool = False,
+                       chunk_size: int = CHUNK_SIZE) -> Dict[str, object]:
+    """Voisins TF-IDF des produits actifs modifiés (ou de tous)"""
+    watermark = db.query(func.max(Product.updated_at)).scalar()
+    run = _start_run(db, "similar", watermark, full)
+    product_ids, _, _, matrix = build_vectors(load_documents(db))
+    ids = np.asarray(product_ids, dtype=np.int64)
+    enabled = set(product_ids)
+
+    if run.since is None:
+        subjects = product_ids
+    else:
+        # >= : MySQL stocke updated_at à la seconde, on relit le dernier instant
+        changed = {pid for (pid,) in db.query(Product.id).filter(Product.updated_at >= run.since)}
+        _delete(db, "similar", changed - enabled)
+        subjects = sorted(_affected_products(db, changed, matrix, ids, top_n) & enabled)
+
+    _dispatch(db, run, subjects, lambda pid: pid, _similar_chunk, _init_similar_worker,
+              (matrix, ids, top_n), workers, chunk_size)
+    _finish_run(db, run)
+    return {"kind": "similar", "incremental": run.since is not None, "subjects": run.subjects}
+
+
+def _purchases_since(db: Session, customer_ids: Set[int], after: datetime) -> Dict[int, Set[int]]:
+    """Produits achetés par ces clients depuis `after`"""
+    purchases: Dict[int, Set[int]] = {}
+    if not customer_ids:
+        return purchases
+    rows = (
+        db.query(Order.customer_id, ProductVariant.product_id)
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .join(ProductVariant, ProductVariant.id == OrderItem.variant_id)
+        .filter(Order.checkout_completed_at >= after, ~order_dropped(), Order.customer_id.in_(customer_ids))
+    )
+    for customer_id, product_id in rows:
+        purchases.setdefault(customer_id, set()).add(product_id)
+    return purchases
+
+
+def precompute_customers(db: Session, top_n: int = TOP_N, workers: Optional[int] = None, full: bool = False,
+                         chunk_size: int = CHUNK_SIZE, model_path: str = CUSTOMER_MODEL_PATH) -> Dict[str, object]:
+    """Recommandations ALS des clients ayant commandé depuis la dernière exécution (ou de tous)"""
+    model = CustomerModel(model_path)
+    if not model.load():
+        raise FileNotFoundError(f"No customer recommendation model at {model_path} (run customer_model.py)")
+    trained_at = datetime.utcfromtimestamp(model.meta.get("trained_at", 0))
+    previous = db.get(PrecomputeRun, "customer")
+    # Un modèle réentraîné depuis la dernière exécution change les facteurs de tous les clients
+    retrained = previous is None or previous.started_at is None or trained_at > previous.started_at
+    watermark = db.query(func.max(Order.checkout_completed_at)).scalar()
+    run = _start_run(db, "customer", watermark, full or retrained)
+
+    known = set(model.arrays["user_ids"].tolist())
+    if run.since is None:
+        customers = known
+    else:
+        customers = known & {cid for (cid,) in db.query(Order.customer_id).filter(
+            Order.checkout_completed_at >= run.since, Order.customer_id.isnot(None)).distinct()}
+    # Les achats postérieurs à l'entraînement ne sont pas masqués par le modèle
+    recent = _purchases_since(db, customers, trained_at)
+    subjects = [(cid, sorted(recent.get(cid, ()))) for cid in sorted(customers)]
+
+    _dispatch(db, run, subjects, lambda subject: subject[0], _customer_chunk, _init_customer_worker,
+              (model_path, top_n), workers, chunk_size)
+    _finish_run(db, run)
+    return {"kind": "customer", "incremental": run.since is not None, "subjects": run.subjects}
+
+
+# Lecture ------------------------------------------------------------------
+
+def get_precomputed(db: Session, kind: str, subject_id: Optional[int] = None,
+                    code: Optional[str] = None) -> Optional[Tuple[Items, datetime]]:
+    """Liste précalculée d'un produit (par id ou code) ou d'un client, None si absente"""
+    query = db.query(PrecomputedRecommendation.items, PrecomputedRecommendation.computed_at).filter(
+        PrecomputedRecommendation.kind == kind)
+    if code is not None:
+        query = query.filter(PrecomputedRecommendation.subject_id == db.query(Product.id).filter(
+            Product.code == code).scalar_subquery())
+    else:
+        query = query.filter(PrecomputedRecommendation.subject_id == subject_id)
+    row = query.first()
+    if row is None:
+        return None
+    return [(pid, score) for pid, score in json.loads(row.items)], row.computed_at
+
+
+def main():
+    from models import Base, engine, session_scope
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kinds", default="similar", help=f"Types à calculer, parmi : {', '.join(KINDS)}")
+    parser.add_argument("--top-n", type=int, default=TOP_N)
+    parser.add_argument("--workers", type=int, default=None, help="Processus de calcul (défaut : nombre de cœurs)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--full", action="store_true", help="Recalcule tout au lieu des seuls changements")
+    parser.add_argument("--model", default=CUSTOMER_MODEL_PATH, help="Modèle ALS pour le type customer")
+    args = parser.parse_args()
+
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        parser.error(f"Unknown kinds: {', '.join(sorted(unknown))}")
+
+    # Seules les tables du serveur MCP sont créées ; le schéma Sylius n'est pas touché
+    Base.metadata.create_all(bind=engine, tables=[PrecomputedRecommendation.__table__, PrecomputeRun.__table__])
+    with session_scope() as db:
+        for kind in kinds:
+            start = time.perf_counter()
+            if kind == "similar":
+                stats = precompute_similar(db, args.top_n, args.workers, args.full, args.chunk_size)
+            else:
+                try:
+                    stats = precompute_customers(db, args.top_n, args.workers, args.full, args.chunk_size, args.model)
+                except FileNotFoundError as e:
+                    print(f"❌ {e}")
+                    continue
+            mode = "incrémental" if stats["incremental"] else "complet"
+            print(f"✅ {kind} ({mode}) : {stats['subjects']} listes écrites ({time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Prix des variants par canal (sylius_channel_pricing) en mémoire
+
+Sylius stocke les prix en centimes, un enregistrement par variant et par
+canal, avec un prix barré optionnel (``original_price``). Toute la table est
+lue en une seule requête (curseur côté serveur) dans une table canal → variant
+→ (prix, prix barré) : la sérialisation d'un produit n'ajoute aucun aller-retour
+MySQL, quel que soit le nombre de variants.
+
+La table ne porte pas de date de modification : le rafraîchissement compare
+une signature agrégée (nombre de lignes, plus grand id, sommes des prix) et ne
+relit les prix qu'en cas de différence ; il retourne les variants dont un prix
+a changé, pour que les produits concernés soient resérialisés.
+"""
+import os
+import threading
+import time
+from typing import Dict, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import ChannelPricing
+
+# Canal dont les prix sont exposés dans les produits sérialisés
+SYLIUS_CHANNEL = os.getenv("SYLIUS_CHANNEL", "FASHION_WEB")
+PRICE_REFRESH_INTERVAL = float(os.getenv("PRICE_REFRESH_INTERVAL", "30"))
+# Lignes lues par lot par le curseur serveur
+SCAN_BATCH_SIZE = 10000
+
+# (prix, prix barré) en centimes
+Price = Tuple[Optional[int], Optional[int]]
+
+
+def to_amount(cents: Optional[int]) -> Optional[float]:
+    """Montant décimal d'un prix Sylius en centimes"""
+    return cents / 100 if cents is not None else None
+
+
+class PriceCache:
+    """Table canal → variant → prix, remplacée en bloc à chaque changement"""
+
+    def __init__(self, channel: str = SYLIUS_CHANNEL):
+        self.channel = channel
+        self.prices: Dict[str, Dict[int, Price]] = {}
+        self.signature: Optional[Tuple] = None
+        self.loaded_at: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.last_load_seconds = 0.0
+        self.last_changed_variants = 0
+        # Une seule lecture de la table à la fois ; les lectures du cache ne prennent pas de verrou
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    # Chargement ----------------------------------------------------------
+
+    def _signature(self, db: Session) -> Tuple:
+        row = db.query(
+            func.count(ChannelPricing.id),
+            func.max(ChannelPricing.id),
+            func.sum(ChannelPricing.price),
+            func.sum(ChannelPricing.original_price),
+            func.sum(ChannelPricing.product_variant_id * ChannelPricing.price),
+        ).one()
+        return tuple(int(value) if value is not None else None for value in row)
+
+    def _read(self, db: Session) -> Dict[str, Dict[int, Price]]:
+        prices: Dict[str, Dict[int, Price]] = {}
+        query = db.query(
+            ChannelPricing.channel_code, ChannelPricing.product_variant_id,
+            ChannelPricing.price, ChannelPricing.original_price,
+        ).yield_per(SCAN_BATCH_SIZE)
+        for channel_code, variant_id, price, original_price in query:
+            prices.setdefault(channel_code, {})[variant_id] = (price, original_price)
+        return prices
+
+    def load(self, db: Session) -> Set[int]:
+        """Relit tous les prix ; retourne les variants dont un prix a changé"""
+        with self._refresh_lock:
+            start = time.perf_counter()
+            signature = self._signature(db)
+            prices = self._read(db)
+            changed: Set[int] = set()
+            if self.loaded:
+                for channel in set(prices) | set(self.prices):
+                    old, new = self.prices.get(channel, {}), prices.get(channel, {})
+                    changed.update(vid for vid in set(old) | set(new) if old.get(vid) != new.get(vid))
+            self.prices, self.signature = prices, signature
+            self.loaded_at = self.checked_at = time.time()
+            self.last_load_seconds = time.perf_counter() - start
+            self.last_changed_variants = len(changed)
+        return changed
+
+    def refresh(self, db: Session) -> Set[int]:
+        """Relit les prix si la signature de la table a changé"""
+        if not self.loaded:
+            self.load(db)
+            return set()
+        self.checked_at = time.time()
+        if self._signature(db) == self.signature:
+            return set()
+        return self.load(db)
+
+    # Lecture -------------------------------------------------------------
+
+    def get(self, variant_id: int, channel: Optional[str] = None) -> Price:
+        """(prix, prix barré) en centimes, (None, None) si le variant n'a pas de prix"""
+        return self.prices.get(channel or self.channel, {}).get(variant_id, (None, None))
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "loaded": self.loaded,
+            "channel": self.channel,
+            "channels": sorted(self.prices),
+            "prices": sum(len(prices) for prices in self.prices.values()),
+            "loaded_at": self.loaded_at,
+            "checked_at": self.checked_at,
+            "last_load_seconds": round(self.last_load_seconds, 6),
+            "last_changed_variants": self.last_changed_variants,
+        }
+
+
+price_cache = PriceCache()
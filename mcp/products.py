@@ -0,0 +1,308 @@
+"""
+Chargement et sérialisation en masse des produits Sylius
+
+Toutes les requêtes produit passent par ici : les traductions et les variants
+actifs sont chargés par des requêtes ``IN`` groupées (selectinload), donc le
+nombre d'allers-retours MySQL ne dépend pas du nombre de produits retournés.
+Les prix du canal viennent du cache en mémoire de ``pricing`` : aucune requête
+supplémentaire par variant.
+
+Les textes sont demandés dans une chaîne de locales (locale demandée puis
+replis, ex. ``fr_BE,fr_FR`` puis ``en_US``) : seules les traductions de la
+chaîne sont chargées. Un produit qui n'a aucune traduction dans la chaîne
+garde un dernier repli sur une traduction quelconque : ses traductions ne
+sont chargées que pour lui.
+
+Le filtre de stock (``min_available``) est évalué dans la requête : un produit
+n'est chargé que si l'un de ses variants actifs est disponible (non suivi, ou
+``on_hand - on_hold`` suffisant), et seuls ces variants sont chargés.
+
+Une projection (``fields``, ex. ``code,name,variants.price``) réduit à la fois
+le chargement et la sortie : sans champ texte les traductions ne sont pas
+chargées, sans ``description`` la colonne reste dans MySQL, sans variants la
+relation n'est pas chargée.
+"""
+import base64
+import json
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import and_, exists, or_
+from sqlalchemy.orm import Query, Session, aliased, raiseload, selectinload
+
+from models import Product, ProductTranslation, ProductVariant
+from pricing import price_cache, to_amount
+from search_index import Translations
+
+DEFAULT_LOCALE = 'en_US'
+# Locales essayées après celles demandées
+LOCALE_FALLBACKS = tuple(
+    locale.strip() for locale in os.getenv("LOCALE_FALLBACKS", DEFAULT_LOCALE).split(",") if locale.strip()
+)
+
+LOCALE_PATTERN = re.compile(r"^[A-Za-z]{2,3}(_[A-Za-z0-9]{2,4})?$")
+
+# Chaîne de locales, de la préférée au dernier repli
+Locales = Tuple[str, ...]
+
+
+def locale_chain(locale: Optional[str] = None) -> Locales:
+    """Locales demandées (une locale ou une liste séparée par des virgules) suivies des replis
+
+    ValueError si une locale est mal formée.
+    """
+    requested = [part.strip() for part in (locale or "").split(",") if part.strip()]
+    for code in requested:
+        if not LOCALE_PATTERN.match(code):
+            raise ValueError(f"Invalid locale '{code}'")
+    return tuple(dict.fromkeys(requested + list(LOCALE_FALLBACKS)))
+
+
+DEFAULT_LOCALES = locale_chain()
+
+
+# Champs sérialisés, dans l'ordre de sortie
+PRODUCT_FIELDS = ("id", "code", "name", "description", "locale", "enabled", "created_at", "variants")
+VARIANT_FIELDS = ("id", "code", "price", "original_price", "on_hand", "available", "tracked")
+# Chemins acceptés par l'argument `fields` des outils
+FIELD_PATHS = PRODUCT_FIELDS + tuple(f"variants.{name}" for name in VARIANT_FIELDS)
+# Champs lus dans les traductions
+TEXT_FIELDS = ("name", "description", "locale")
+# Gardés par la sérialisation pour les curseurs, scores et étiquettes de cache ; retirés par l'outil
+KEY_FIELDS = ("id", "code")
+
+
+@dataclass(frozen=True)
+class Fields:
+    """Projection : champs du produit et de ses variants, dans l'ordre de sérialisation"""
+    product: Tuple[str, ...]
+    variant: Tuple[str, ...] = ()
+
+    @property
+    def translations(self) -> bool:
+        return any(name in TEXT_FIELDS for name in self.product)
+
+    @property
+    def variants(self) -> bool:
+        return "variants" in self.product
+
+    def with_keys(self) -> "Fields":
+        return Fields(tuple(name for name in PRODUCT_FIELDS if name in self.product or name in KEY_FIELDS), self.variant)
+
+
+def parse_fields(paths: Optional[Sequence[str]]) -> Optional[Fields]:
+    """Projection demandée (``variants`` seul : tous les champs des variants), None pour tout
+
+    ValueError si un chemin est inconnu.
+    """
+    if paths is None:
+        return None
+    product, variant = set(), set()
+    for path in paths:
+        if path not in FIELD_PATHS:
+            raise ValueError(f"Unknown field '{path}'")
+        name, _, sub = path.partition(".")
+        product.add(name)
+        if name == "variants":
+            variant.update((sub,) if sub else VARIANT_FIELDS)
+    return Fields(
+        tuple(name for name in PRODUCT_FIELDS if name in product),
+        tuple(name for name in VARIANT_FIELDS if name in variant),
+    )
+
+
+def project(product: Dict[str, Any], fields: Optional[Fields]) -> Dict[str, Any]:
+    """Produit sérialisé réduit à la projection
+
+    Les champs ajoutés par un outil (``score``...) sont conservés.
+    """
+    if fields is None:
+        return product
+    projected = {key: value for key, value in product.items() if key in fields.product or key not in PRODUCT_FIELDS}
+    if "variants" in projected and len(fields.variant) < len(VARIANT_FIELDS):
+        projected["variants"] = [
+            {key: value for key, value in variant.items() if key in fields.variant} for variant in projected["variants"]
+        ]
+    return projected
+
+
+def project_products(products: Any, fields: Optional[Fields]) -> Any:
+    """Projection d'un résultat d'outil (produit, liste de produits ou message)"""
+    if fields is None:
+        return products
+    if isinstance(products, dict):
+        return project(products, fields)
+    if isinstance(products, list):
+        return [project(product, fields) if isinstance(product, dict) else product for product in products]
+    return products
+
+
+def _as_chain(locales: Union[str, Sequence[str]]) -> Sequence[str]:
+    return locale_chain(locales) if isinstance(locales, str) else locales
+
+
+def translation_filter(locales: Sequence[str]):
+    """Condition SQL sur ProductTranslation : locale de la chaîne, ou produit sans aucune traduction de la chaîne"""
+    locales = list(locales)
+    other = aliased(ProductTranslation)
+    return or_(
+        ProductTranslation.locale.in_(locales),
+        ~exists().where(other.product_id == ProductTranslation.product_id, other.locale.in_(locales)),
+    )
+
+
+def stock_threshold(in_stock_only: bool = False, min_available: Optional[int] = None) -> Optional[int]:
+    """Quantité disponible minimale demandée, None sans filtre de stock"""
+    if min_available is not None:
+        return max(min_available, 1 if in_stock_only else 0)
+    return 1 if in_stock_only else None
+
+
+def variant_available(min_available: int):
+    """Condition SQL : variant actif disponible en au moins `min_available` exemplaires"""
+    return and_(
+        ProductVariant.enabled == True,
+        or_(ProductVariant.tracked == False, ProductVariant.on_hand - ProductVariant.on_hold >= min_available),
+    )
+
+
+def product_query(db: Session, locales: Optional[Sequence[str]] = None, min_available: Optional[int] = None,
+                  fields: Optional[Fields] = None) -> Query:
+    """Requête de base sur les produits avec chargement groupé des relations
+
+    Avec `locales`, seules les traductions de ces locales sont chargées. Avec
+    `min_available`, seuls les produits ayant un variant disponible sont
+    retournés, avec ces seuls variants. Avec `fields`, seules les relations et
+    colonnes de la projection sont chargées.
+    """
+    translations = Product.translations
+    if locales is not None:
+        translations = translations.and_(translation_filter(locales))
+    variants = ProductVariant.enabled == True if min_available is None else variant_available(min_available)
+    if fields is None or fields.translations:
+        load_translations = selectinload(translations)
+        if fields is not None and "description" not in fields.product:
+            load_translations = load_translations.load_only(ProductTranslation.locale, ProductTranslation.name,
+                                                            raiseload=True)
+    else:
+        # Hors projection : tout accès lèverait une erreur plutôt qu'une requête par produit
+        load_translations = raiseload(Product.translations)
+    query = db.query(Product).options(
+        load_translations,
+        selectinload(Product.variants.and_(variants)) if fields is None or fields.variants else raiseload(Product.variants),
+    )
+    if min_available is not None:
+        query = query.filter(Product.variants.any(variants))
+    return query
+
+
+def pick_translation(translations: Translations, locales: Union[str, Sequence[str]]) -> Optional[str]:
+    """Première locale de la chaîne disponible pour ce produit, sinon la première de ses locales"""
+    for locale in _as_chain(locales):
+        if locale in translations:
+            return locale
+    # Dernier repli, stable quel que soit l'ordre de chargement
+    return min(translations) if translations else None
+
+
+def serialize_variant(variant: ProductVariant) -> Dict[str, Any]:
+    """Convertit un variant en dictionnaire (prix du canal lus dans le cache, sans requête)"""
+    price, original_price = price_cache.get(variant.id)
+    return {
+        "id": variant.id,
+        "code": variant.code,
+        "price": to_amount(price),
+        "original_price": to_amount(original_price),
+        "on_hand": variant.on_hand,
+        "available": availability(variant.tracked, variant.on_hand, variant.on_hold),
+        "tracked": variant.tracked
+    }
+
+
+def availability(tracked: bool, on_hand: Optional[int], on_hold: Optional[int]) -> Optional[int]:
+    """Quantité vendable d'un variant suivi, None s'il n'est pas suivi (toujours disponible)"""
+    if not tracked:
+        return None
+    return (on_hand or 0) - (on_hold or 0)
+
+
+def restrict_to_available(product: Dict[str, Any], min_available: int) -> Optional[Dict[str, Any]]:
+    """Produit sérialisé réduit à ses variants disponibles, None s'il n'en a aucun"""
+    variants = [v for v in product["variants"] if v["available"] is None or v["available"] >= min_available]
+    if not variants:
+        return None
+    return product if len(variants) == len(product["variants"]) else {**product, "variants": variants}
+
+
+def serialize_product(product: Product, locales: Union[str, Sequence[str]] = DEFAULT_LOCALES,
+                      fields: Optional[Fields] = None) -> Dict[str, Any]:
+    """Convertit un produit (relations déjà chargées) en dictionnaire
+
+    Nom et description viennent de la première locale de la chaîne disponible,
+    sinon d'une traduction quelconque ; sans traduction, le nom est le code. Avec `fields` (chargée par
+    `product_query` avec la même projection), seuls ces champs et `KEY_FIELDS`
+    sont produits, sans toucher aux relations ni colonnes non chargées.
+    """
+    if fields is not None:
+        fields = fields.with_keys()
+    translation, locale = None, None
+    if fields is None or fields.translations:
+        # Un seul passage sur les traductions chargées
+        by_locale = {translation.locale: translation for translation in product.translations}
+        locale = pick_translation(by_locale, locales)
+        translation = by_locale[locale] if locale is not None else None
+
+    serialized = {
+        "id": product.id,
+        "code": product.code,
+        "name": translation.name if translation else product.code,
+        "description": translation.description if translation and (fields is None or "description" in fields.product) else "",
+        "locale": locale,
+        "enabled": product.enabled,
+        "created_at": product.created_at.isoformat() if product.created_at else None,
+        "variants": [serialize_variant(v) for v in product.variants if v.enabled] if fields is None or fields.variants else [],
+    }
+    return project(serialized, fields)
+
+
+def serialize_products(products: Iterable[Product], locales: Union[str, Sequence[str]] = DEFAULT_LOCALES,
+                       fields: Optional[Fields] = None) -> List[Dict[str, Any]]:
+    """Convertit une liste de produits en dictionnaires"""
+    locales = _as_chain(locales)
+    return [serialize_product(product, locales, fields) for product in products]
+
+
+def localize(product: Dict[str, Any], translations: Translations, locales: Sequence[str]) -> Dict[str, Any]:
+    """Copie d'un produit sérialisé avec le nom et la description d'une autre chaîne de locales"""
+    locale = pick_translation(translations, locales)
+    if locale == product.get("locale"):
+        return product
+    name, description = translations[locale] if locale is not None else (product["code"], "")
+    return {**product, "name": name, "description": description, "locale": locale}
+
+
+def encode_cursor(last_id: int) -> str:
+    """Curseur opaque pointant après le produit `last_id`"""
+    payload = json.dumps({"after": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Id après lequel reprendre ; ValueError si le curseur est invalide"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        after = json.loads(base64.urlsafe_b64decode(padded.encode()))["after"]
+    except Exception:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    if not isinstance(after, int):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return after
+
+
+def next_cursor(products: List[Dict[str, Any]], limit: int) -> Optional[str]:
+    """Curseur de la page suivante, ou None si la page est la dernière"""
+    if limit <= 0 or len(products) < limit:
+        return None
+    return encode_cursor(products[-1]["id"])
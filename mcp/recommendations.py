@@ -0,0 +1,275 @@
+"""
+Recommandations de produits similaires par le contenu
+
+Chaque produit est représenté par un vecteur TF-IDF (matrice creuse SciPy)
+construit à partir des noms et descriptions de toutes ses traductions, avec
+la même normalisation et la même pondération nom/description que l'index
+BM25. Les vecteurs sont normalisés, le produit scalaire est donc la
+similarité cosinus.
+
+Les k plus proches voisins de chaque produit sont calculés à l'avance, par
+blocs de lignes : servir une recommandation est une simple lecture dans un
+dictionnaire. Lors des rafraîchissements incrémentaux du catalogue (snapshot,
+ou traductions suivies sans lui), seuls les produits modifiés et ceux dont la
+liste de voisins les contenait sont recalculés ; l'IDF reste figée jusqu'à la
+prochaine reconstruction complète.
+"""
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy.orm import Session
+
+from models import Product, ProductTranslation
+from search_index import REBUILD_THRESHOLD, Translations, document_terms
+
+# Nombre de voisins gardés par produit
+RECO_TOP_K = int(os.getenv("RECO_TOP_K", "20"))
+# Lignes de la matrice multipliées à la fois (borne la mémoire du calcul)
+BLOCK_SIZE = 512
+# En dessous, deux produits ne partagent aucun terme utile
+MIN_SIMILARITY = 1e-6
+
+# Voisins d'un produit : (ids, scores) triés par score décroissant
+Neighbors = Tuple[np.ndarray, np.ndarray]
+
+
+def load_documents(db: Session) -> List[Tuple[int, Translations]]:
+    """Traductions des produits actifs, pour construire l'index sans snapshot"""
+    rows = db.query(
+        ProductTranslation.product_id, ProductTranslation.locale,
+        ProductTranslation.name, ProductTranslation.description,
+    ).join(Product, Product.id == ProductTranslation.product_id).filter(Product.enabled == True).all()
+    documents: Dict[int, Translations] = {}
+    for product_id, locale, name, description in rows:
+        documents.setdefault(product_id, {})[locale] = (name, description)
+    return sorted(documents.items())
+
+
+# Vectorisation ------------------------------------------------------------
+
+def vectorize(documents: List[Dict[str, float]], vocabulary: Dict[str, int],
+              idf: np.ndarray) -> sparse.csr_matrix:
+    """Vecteurs TF-IDF normalisés des documents"""
+    indptr, indices, weights = [0], [], []
+    for terms in documents:
+        for term, tf in terms.items():
+            indices.append(vocabulary[term])
+            # TF sous-linéaire : un terme répété ne domine pas le vecteur
+            weights.append(1.0 + math.log(tf))
+        indptr.append(len(indices))
+    indices = np.asarray(indices, dtype=np.int32)
+    data = np.asarray(weights, dtype=np.float32) * idf[indices]
+    # Normalisation L2 de chaque ligne
+    row_of = np.repeat(np.arange(len(documents)), np.diff(indptr))
+    norms = np.sqrt(np.bincount(row_of, weights=data ** 2, minlength=len(documents)))
+    norms[norms == 0] = 1.0
+    data /= norms[row_of].astype(np.float32)
+    return sparse.csr_matrix((data, indices, np.asarray(indptr)), shape=(len(documents), len(idf)))
+
+
+def build_vectors(documents: Iterable[Tuple[int, Translations]]) -> Tuple[List[int], Dict[str, int], np.ndarray, sparse.csr_matrix]:
+    """Ids, vocabulaire, IDF et matrice TF-IDF des produits"""
+    ids, terms = [], []
+    for pid, translations in documents:
+        ids.append(pid)
+        terms.append(document_terms(translations))
+
+    vocabulary: Dict[str, int] = {}
+    df: List[int] = []
+    for document in terms:
+        for term in document:
+            column = vocabulary.setdefault(term, len(vocabulary))
+            if column == len(df):
+                df.append(0)
+            df[column] += 1
+    # IDF lissée : log((1 + n) / (1 + df)) + 1
+    idf = (np.log((1 + len(ids)) / (1 + np.asarray(df, dtype=np.float32))) + 1).astype(np.float32)
+    return ids, vocabulary, idf, vectorize(terms, vocabulary, idf)
+
+
+def top_k_neighbors(matrix: sparse.csr_matrix, ids: np.ndarray, rows: Iterable[int], k: int) -> Dict[int, Neighbors]:
+    """Voisins des lignes `rows` parmi toutes les lignes de `matrix`"""
+    rows = list(rows)
+    transposed = matrix.T.tocsc()
+    result = {}
+    for start in range(0, len(rows), BLOCK_SIZE):
+        block = rows[start:start + BLOCK_SIZE]
+        similarities = (matrix[block] @ transposed).tocsr()
+        for i, row in enumerate(block):
+            begin, end = similarities.indptr[i], similarities.indptr[i + 1]
+            cols = similarities.indices[begin:end]
+            scores = similarities.data[begin:end]
+            keep = (cols != row) & (scores > MIN_SIMILARITY)
+            cols, scores = cols[keep], scores[keep]
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+                cols, scores = cols[top], scores[top]
+            neighbor_ids = ids[cols]
+            order = np.lexsort((neighbor_ids, -scores))
+            result[int(ids[row])] = (neighbor_ids[order], scores[order].astype(np.float32))
+    return result
+
+
+class SimilarProductIndex:
+    """Vecteurs TF-IDF des produits et table des k plus proches voisins"""
+
+    def __init__(self, top_k: int = RECO_TOP_K):
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        self.vocabulary: Dict[str, int] = {}
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.ids: List[int] = []
+        self.rows: Dict[int, int] = {}
+        self.matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.neighbors: Dict[int, Neighbors] = {}
+        self.built_at: Optional[float] = None
+        self.build_seconds = 0.0
+        self.last_update_seconds = 0.0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _vectorize(self, documents: List[Dict[str, float]], vocabulary: Dict[str, int],
+                   idf: np.ndarray) -> sparse.csr_matrix:
+        return vectorize(documents, vocabulary, idf)
+
+    def _top_k(self, matrix: sparse.csr_matrix, ids: np.ndarray, rows: Iterable[int]) -> Dict[int, Neighbors]:
+        return top_k_neighbors(matrix, ids, rows, self.top_k)
+
+    # Construction --------------------------------------------------------
+
+    def rebuild(self, documents: Iterable[Tuple[int, Translations]]) -> None:
+        """Reconstruit vecteurs, IDF et voisins à côté puis remplace l'index"""
+        start = time.perf_counter()
+        ids, vocabulary, idf, matrix = build_vectors(documents)
+        id_array = np.asarray(ids, dtype=np.int64)
+        neighbors = self._top_k(matrix, id_array, range(len(ids)))
+
+        with self._lock:
+            self.vocabulary = vocabulary
+            self.idf = idf
+            self.ids = ids
+            self.rows = {pid: row for row, pid in enumerate(ids)}
+            self.matrix = matrix
+            self.neighbors = neighbors
+            self.built_at = time.time()
+            self.build_seconds = time.perf_counter() - start
+
+    def update(self, documents: Iterable[Tuple[int, Translations]], removed: Iterable[int] = ()) -> None:
+        """Remplace quelques produits et recalcule les voisins touchés"""
+        start = time.perf_counter()
+        documents = list(documents)
+        with self._lock:
+            changed = [pid for pid, _ in documents]
+            stale = set(changed) | set(removed)
+            terms = [document_terms(translations) for _, translations in documents]
+
+            # Les termes nouveaux reçoivent l'IDF d'un terme présent dans un seul produit
+            vocabulary = dict(self.vocabulary)
+            new_terms = [term for document in terms for term in document if term not in vocabulary]
+            for term in new_terms:
+                vocabulary.setdefault(term, len(vocabulary))
+            rare_idf = math.log((1 + len(self.ids)) / 2) + 1
+            idf = np.concatenate([self.idf, np.full(len(vocabulary) - len(self.idf), rare_idf, dtype=np.float32)])
+
+            keep = [row for row, pid in enumerate(self.ids) if pid not in stale]
+            kept = self.matrix[keep]
+            kept.resize((len(keep), len(idf)))
+            matrix = sparse.vstack([kept, self._vectorize(terms, vocabulary, idf)], format="csr")
+            ids = [self.ids[row] for row in keep] + changed
+            rows = {pid: row for row, pid in enumerate(ids)}
+            id_array = np.asarray(ids, dtype=np.int64)
+
+            # Produits à recalculer : les modifiés et ceux qui pointaient vers un produit modifié
+            neighbors = {pid: entry for pid, entry in self.neighbors.items() if pid not in stale}
+            affected = set(changed)
+            if neighbors:
+                owners = np.fromiter(neighbors, dtype=np.int64, count=len(neighbors))
+                lists = [neighbor_ids for neighbor_ids, _ in neighbors.values()]
+                owner_of = np.repeat(owners, [len(neighbor_ids) for neighbor_ids in lists])
+                pointing = np.isin(np.concatenate(lists), np.fromiter(stale, dtype=np.int64, count=len(stale)))
+                affected.update(owner_of[pointing].tolist())
+            neighbors.update(self._top_k(matrix, id_array, (rows[pid] for pid in affected)))
+
+            # Les produits modifiés peuvent entrer dans la liste des autres produits
+            if changed:
+                self._insert_changed(matrix, id_array, [rows[pid] for pid in changed], affected, neighbors)
+
+            self.vocabulary = vocabulary
+            self.idf = idf
+            self.ids = ids
+            self.rows = rows
+            self.matrix = matrix
+            self.neighbors = neighbors
+            self.last_update_seconds = time.perf_counter() - start
+
+    def _insert_changed(self, matrix: sparse.csr_matrix, ids: np.ndarray, changed_rows: List[int],
+                        affected: Set[int], neighbors: Dict[int, Neighbors]) -> None:
+        k = self.top_k
+        # Score du k-ième voisin de chaque ligne (-1 si la liste n'est pas pleine)
+        thresholds = np.full(len(ids), -1.0, dtype=np.float32)
+        for row, pid in enumerate(ids):
+            entry = neighbors.get(int(pid))
+            if entry is not None and len(entry[1]) >= k:
+                thresholds[row] = entry[1][-1]
+        similarities = (matrix[changed_rows] @ matrix.T).tocsr()
+        for i, changed_row in enumerate(changed_rows):
+            begin, end = similarities.indptr[i], similarities.indptr[i + 1]
+            cols = similarities.indices[begin:end]
+            scores = similarities.data[begin:end]
+            candidates = (scores > thresholds[cols]) & (scores > MIN_SIMILARITY) & (cols != changed_row)
+            changed_id = ids[changed_row]
+            for col, score in zip(cols[candidates], scores[candidates]):
+                pid = int(ids[col])
+                if pid in affected:
+                    continue
+                neighbor_ids, neighbor_scores = neighbors.get(pid, (ids[:0], np.zeros(0, dtype=np.float32)))
+                neighbor_ids = np.append(neighbor_ids, changed_id)
+                neighbor_scores = np.append(neighbor_scores, np.float32(score))
+                order = np.lexsort((neighbor_ids, -neighbor_scores))[:k]
+                neighbors[pid] = (neighbor_ids[order], neighbor_scores[order])
+                if len(order) >= k:
+                    thresholds[col] = neighbors[pid][1][-1]
+
+    def attach(self, snapshot) -> None:
+        """Abonne l'index aux changements du catalogue (snapshot ou traductions suivies)"""
+        def on_change(changed: Set[int], removed: Set[int]) -> None:
+            translations = snapshot.translations
+            if len(changed) > REBUILD_THRESHOLD or not self.ids:
+                self.rebuild(translations.items())
+            else:
+                self.update(((pid, translations[pid]) for pid in changed if pid in translations), removed)
+
+        snapshot.add_listener(on_change)
+
+    # Lecture -------------------------------------------------------------
+
+    def similar(self, product_id: int, k: int = 10) -> List[Tuple[int, float]]:
+        """Produits les plus proches de `product_id`, du plus au moins similaire"""
+        entry = self.neighbors.get(product_id)
+        if entry is None:
+            return []
+        neighbor_ids, scores = entry
+        return [(int(pid), float(score)) for pid, score in zip(neighbor_ids[:k], scores[:k])]
+
+    def stats(self) -> Dict[str, object]:
+        matrix = self.matrix
+        neighbors = self.neighbors
+        return {
+            "products": len(self.ids),
+            "vocabulary": len(self.vocabulary),
+            "top_k": self.top_k,
+            "built_at": self.built_at,
+            "build_seconds": round(self.build_seconds, 3),
+            "last_update_seconds": round(self.last_update_seconds, 3),
+            "matrix_bytes": int(matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes + self.idf.nbytes),
+            "neighbors_bytes": int(sum(ids.nbytes + scores.nbytes for ids, scores in neighbors.values())),
+        }
+
+
+similar_index = SimilarProductIndex()
@@ -0,0 +1,246 @@
+"""
+Index inversé des produits avec classement BM25
+
+Les noms et descriptions de toutes les traductions d'un produit forment un
+seul document (un produit n'apparaît donc qu'une fois dans les résultats).
+Le texte est normalisé (minuscules, accents retirés) puis découpé en termes ;
+le nom pèse plus lourd que la description (BM25F simplifié). Chaque terme
+garde aussi ses postings triés par impact décroissant, ce qui permet
+d'arrêter le parcours dès que le top-k ne peut plus changer (algorithme à
+seuil de Fagin) au lieu de scorer tous les documents. L'index suit le
+snapshot catalogue, ou sans lui les traductions suivies par
+``CatalogDocuments`` : il est reconstruit au chargement complet et mis à
+jour produit par produit lors des rafraîchissements incrémentaux.
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Paramètres BM25
+K1 = 1.2
+B = 0.75
+NAME_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Au-delà de ce nombre de produits modifiés, on reconstruit l'index à côté
+REBUILD_THRESHOLD = 1000
+
+# Recalcul des normes de longueur quand la longueur moyenne dérive de 10 %
+AVGDL_DRIFT = 0.1
+
+STOPWORDS = frozenset("""
+a au aux avec ce ces dans de des du en et la le les leur mais ou par pour sa se ses son sur un une
+an and for in of on or the to with
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+Translations = Dict[str, Tuple[Optional[str], Optional[str]]]
+
+
+def fold(text: str) -> str:
+    """Minuscules et suppression des accents ("Écharpe" -> "echarpe")"""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Découpe un texte normalisé en termes indexables"""
+    if not text:
+        return []
+    return [t for t in _TOKEN_RE.findall(fold(text)) if t not in STOPWORDS]
+
+
+def document_terms(translations: Translations) -> Dict[str, float]:
+    """Fréquences pondérées des termes d'un produit, toutes locales confondues"""
+    terms: Dict[str, float] = {}
+    for name, description in translations.values():
+        for term in tokenize(name):
+            terms[term] = terms.get(term, 0.0) + NAME_WEIGHT
+        for term in tokenize(description):
+            terms[term] = terms.get(term, 0.0) + DESCRIPTION_WEIGHT
+    return terms
+
+
+class ProductSearchIndex:
+    """Index inversé terme -> {id produit: fréquence pondérée}"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self.doc_terms: Dict[int, Dict[str, float]] = {}
+        self.doc_lengths: Dict[int, float] = {}
+        self.total_length = 0.0
+        self._norms: Dict[int, float] = {}
+        self._norm_avgdl = 0.0
+        # terme -> [(-impact, id produit)] trié, impact = tf * (K1 + 1) / (tf + norme)
+        self.impacts: Dict[str, List[Tuple[float, int]]] = {}
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    # Construction --------------------------------------------------------
+
+    def _add(self, pid: int, terms: Dict[str, float]) -> None:
+        if not terms:
+            return
+        self.doc_terms[pid] = terms
+        length = sum(terms.values())
+        self.doc_lengths[pid] = length
+        self.total_length += length
+        norm = self._norm(length, self._norm_avgdl)
+        self._norms[pid] = norm
+        postings, impacts = self.postings, self.impacts
+        for term, tf in terms.items():
+            bucket = postings.get(term)
+            entry = (-_impact(tf, norm), pid)
+            if bucket is None:
+                postings[term] = {pid: tf}
+                impacts[term] = [entry]
+            else:
+                bucket[pid] = tf
+                bisect.insort(impacts[term], entry)
+
+    def _remove(self, pid: int) -> None:
+        terms = self.doc_terms.pop(pid, None)
+        if terms is None:
+            return
+        self.total_length -= self.doc_lengths.pop(pid)
+        norm = self._norms.pop(pid)
+        for term, tf in terms.items():
+            bucket = self.postings.get(term)
+            if bucket is None:
+                continue
+            bucket.pop(pid, None)
+            if not bucket:
+                del self.postings[term]
+                del self.impacts[term]
+                continue
+            ordered = self.impacts[term]
+            position = bisect.bisect_left(ordered, (-_impact(tf, norm), pid))
+            if position < len(ordered) and ordered[position][1] == pid:
+                del ordered[position]
+
+    @staticmethod
+    def _norm(length: float, avgdl: float) -> float:
+        return K1 * (1 - B + B * length / avgdl) if avgdl else K1
+
+    def _refresh_norms(self) -> None:
+        """Recalcule les normes si la longueur moyenne a trop dérivé"""
+        avgdl = self.total_length / len(self.doc_lengths) if self.doc_lengths else 0.0
+        if self._norm_avgdl and abs(avgdl - self._norm_avgdl) <= AVGDL_DRIFT * self._norm_avgdl:
+            return
+        self._norms = norms = {pid: self._norm(length, avgdl) for pid, length in self.doc_lengths.items()}
+        self._norm_avgdl = avgdl
+        self.impacts = {
+            term: sorted((-_impact(tf, norms[pid]), pid) for pid, tf in bucket.items())
+            for term, bucket in self.postings.items()
+        }
+
+    def rebuild(self, documents: Iterable[Tuple[int, Translations]]) -> None:
+        """Reconstruit l'index à côté puis remplace l'index courant"""
+        fresh = ProductSearchIndex()
+        for pid, translations in documents:
+            fresh._add(pid, document_terms(translations))
+        fresh._refresh_norms()
+        with self._lock:
+            self.postings = fresh.postings
+            self.doc_terms = fresh.doc_terms
+            self.doc_lengths = fresh.doc_lengths
+            self.total_length = fresh.total_length
+            self._norms = fresh._norms
+            self._norm_avgdl = fresh._norm_avgdl
+            self.impacts = fresh.impacts
+
+    def update(self, documents: Iterable[Tuple[int, Translations]], removed: Iterable[int] = ()) -> None:
+        """Met à jour quelques produits en place"""
+        prepared = [(pid, document_terms(translations)) for pid, translations in documents]
+        with self._lock:
+            for pid in removed:
+                self._remove(pid)
+            for pid, terms in prepared:
+                self._remove(pid)
+                self._add(pid, terms)
+            self._refresh_norms()
+
+    def attach(self, snapshot) -> None:
+        """Abonne l'index aux changements du catalogue (snapshot ou traductions suivies)"""
+        def on_change(changed: Set[int], removed: Set[int]) -> None:
+            translations = snapshot.translations
+            if len(changed) > REBUILD_THRESHOLD or not self.doc_terms:
+                self.rebuild(translations.items())
+            else:
+                self.update(((pid, translations[pid]) for pid in changed if pid in translations), removed)
+
+        snapshot.add_listener(on_change)
+
+    # Recherche -----------------------------------------------------------
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[int, float]]:
+        """Retourne les (id produit, score) les plus pertinents"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or limit <= 0:
+            return []
+        with self._lock:
+            n_docs = len(self.doc_terms)
+            norms = self._norms
+            lists = []
+            for term in terms:
+                bucket = self.postings.get(term)
+                if bucket:
+                    df = len(bucket)
+                    idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                    lists.append((idf, bucket, self.impacts[term]))
+            if not lists:
+                return []
+            if len(lists) == 1:
+                idf, _, ordered = lists[0]
+                return [(pid, -impact * idf) for impact, pid in ordered[:limit]]
+
+            # Algorithme à seuil : parcours des listes triées en parallèle,
+            # arrêt dès que le k-ième score dépasse le meilleur score possible
+            # d'un document pas encore vu.
+            top: List[Tuple[float, int]] = []
+            seen = set()
+            depth = 0
+            max_depth = max(len(ordered) for _, _, ordered in lists)
+            while depth < max_depth:
+                threshold = 0.0
+                for idf, _, ordered in lists:
+                    if depth >= len(ordered):
+                        continue
+                    impact, pid = ordered[depth]
+                    threshold -= impact * idf
+                    if pid in seen:
+                        continue
+                    seen.add(pid)
+                    norm = norms[pid]
+                    score = 0.0
+                    for other_idf, other_bucket, _ in lists:
+                        tf = other_bucket.get(pid)
+                        if tf is not None:
+                            score += other_idf * _impact(tf, norm)
+                    if len(top) < limit:
+                        heapq.heappush(top, (score, -pid))
+                    elif (score, -pid) > top[0]:
+                        heapq.heapreplace(top, (score, -pid))
+                if len(top) >= limit and top[0][0] >= threshold:
+                    break
+                depth += 1
+        # Départage stable par id croissant à score égal
+        return [(-neg_pid, score) for score, neg_pid in sorted(top, reverse=True)]
+
+
+def _impact(tf: float, norm: float) -> float:
+    """Contribution BM25 d'un terme, hors idf"""
+    return tf * (K1 + 1) / (tf + norm)
+
+
+search_index = ProductSearchIndex()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Recherche sémantique locale : plongements LSA et index IVF en mmap
+
+Sans réseau ni modèle externe : le texte d'un produit (noms et descriptions,
+mêmes termes et pondérations que l'index BM25) est projeté par hachage
+signé (mots et trigrammes de caractères) dans un espace creux de taille fixe,
+pondéré par IDF, puis réduit par SVD tronquée (analyse sémantique latente)
+en vecteurs float32 normalisés. Des termes qui apparaissent dans les mêmes
+produits ("hiver", "laine", "chaud") se retrouvent proches, même quand la
+requête ne contient aucun mot du produit.
+
+Les vecteurs sont regroupés par k-means sphérique (index IVF) et rangés par
+liste : une requête compare le vecteur aux centroïdes puis ne parcourt que
+les ``nprobe`` listes les plus proches, chacune contiguë sur disque. Le mode
+exact compare la requête à tous les vecteurs, pour valider l'approximation.
+
+L'index est construit par lots, écrit dans ``SEMANTIC_INDEX_PATH`` et ouvert
+en mmap au démarrage. Il garde le watermark ``updated_at`` des produits qu'il
+couvre : le serveur le reconstruit en tâche de fond quand le catalogue a
+changé depuis. Usage : python semantic_index.py [--output models/semantic]
+"""
+import argparse
+import math
+import os
+import time
+import zlib
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import svds
+
+from model_store import MappedModel, save_arrays
+from search_index import Translations, document_terms, tokenize
+
+# Par défaut à côté du module : indépendant du répertoire de lancement
+SEMANTIC_INDEX_PATH = os.getenv("SEMANTIC_INDEX_PATH",
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "semantic"))
+SEMANTIC_NPROBE = int(os.getenv("SEMANTIC_NPROBE", "8"))
+# Intervalle minimal (s) entre deux reconstructions par le serveur ; 0 : construction hors ligne seulement
+SEMANTIC_REBUILD_INTERVAL = float(os.getenv("SEMANTIC_REBUILD_INTERVAL", "600"))
+
+# Taille de l'espace haché (puissance de 2)
+HASH_FEATURES = 2 ** 15
+EMBEDDING_DIM = 128
+# Documents hachés / vecteurs affectés par lot
+BATCH_SIZE = 10000
+KMEANS_ITERATIONS = 10
+
+
+# Plongements --------------------------------------------------------------
+
+@lru_cache(maxsize=1 << 18)
+def _term_features(term: str) -> Tuple[Tuple[int, float], ...]:
+    """Colonnes signées d'un mot et de ses trigrammes, pour un poids de 1"""
+    padded = f"#{term}#"
+    grams = [padded[i:i + 3] for i in range(len(padded) - 2)]
+    # Les trigrammes d'un terme pèsent ensemble autant que le terme
+    features = [(f"w:{term}", 1.0)] + [(f"c:{gram}", 1.0 / len(grams)) for gram in grams]
+    columns = []
+    for feature, weight in features:
+        # crc32 plutôt que hash() : stable d'un processus à l'autre
+        code = zlib.crc32(feature.encode())
+        columns.append((code & (HASH_FEATURES - 1), weight if code >> 31 else -weight))
+    return tuple(columns)
+
+
+def hashed_features(terms: Dict[str, float]) -> Dict[int, float]:
+    """Colonnes signées des mots et de leurs trigrammes de caractères"""
+    features: Dict[int, float] = {}
+    for term, weight in terms.items():
+        for column, signed in _term_features(term):
+            features[column] = features.get(column, 0.0) + signed * weight
+    return features
+
+
+def hashed_matrix(documents: Iterable[Dict[str, float]]) -> sparse.csr_matrix:
+    """Matrice documents x colonnes hachées, construite par lots"""
+    blocks, indptr, indices, data = [], [0], [], []
+
+    def flush():
+        if len(indptr) > 1:
+            blocks.append(sparse.csr_matrix(
+                (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr)),
+                shape=(len(indptr) - 1, HASH_FEATURES),
+            ))
+        indptr[:], indices[:], data[:] = [0], [], []
+
+    for terms in documents:
+        for column, weight in hashed_features(terms).items():
+            indices.append(column)
+            data.append(weight)
+        indptr.append(len(indices))
+        if len(indptr) > BATCH_SIZE:
+            flush()
+    flush()
+    if not blocks:
+        return sparse.csr_matrix((0, HASH_FEATURES), dtype=np.float32)
+    return sparse.vstack(blocks, format="csr")
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+def _weighted(matrix: sparse.csr_matrix, idf: np.ndarray) -> sparse.csr_matrix:
+    """Pondération IDF puis normalisation L2 des lignes"""
+    weighted = (matrix @ sparse.diags(idf)).tocsr()
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return (sparse.diags(1.0 / norms) @ weighted).tocsr().astype(np.float32)
+
+
+# Index IVF ----------------------------------------------------------------
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Centroïde le plus proche de chaque vecteur, par lots"""
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), BATCH_SIZE):
+        assignment[start:start + BATCH_SIZE] = np.argmax(vectors[start:start + BATCH_SIZE] @ centroids.T, axis=1)
+    return assignment
+
+
+def spherical_kmeans(vectors: np.ndarray, lists: int, iterations: int = KMEANS_ITERATIONS,
+                     seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Centroïdes normalisés et affectation des vecteurs"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _assign(vectors, centroids)
+        membership = sparse.csr_matrix(
+            (np.ones(len(vectors), dtype=np.float32), (assignment, np.arange(len(vectors)))),
+            shape=(lists, len(vectors)),
+        )
+        sums = membership @ vectors
+        filled = np.asarray(membership.sum(axis=1)).ravel() > 0
+        # Une liste vide garde son centroïde
+        centroids[filled] = _normalize_rows(sums[filled])
+    return centroids, _assign(vectors, centroids)
+
+
+def build_arrays(documents: Iterable[Tuple[int, Translations]],
+                 dim: int = EMBEDDING_DIM) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """Tableaux de l'index sémantique pour ces produits"""
+    start = time.perf_counter()
+    ids, terms = [], []
+    for pid, translations in documents:
+        ids.append(pid)
+        terms.append(document_terms(translations))
+
+    counts = hashed_matrix(terms)
+    df = np.bincount(counts.indices, minlength=HASH_FEATURES)
+    idf = (np.log((1 + len(ids)) / (1 + df)) + 1).astype(np.float32)
+    weighted = _weighted(counts, idf)
+
+    rank = min(dim, min(weighted.shape) - 1)
+    if rank >= 1:
+        _, _, vt = svds(weighted, k=rank, random_state=0)
+        components = np.ascontiguousarray(vt.T, dtype=np.float32)
+    else:
+        components = np.zeros((HASH_FEATURES, 0), dtype=np.float32)
+    vectors = _normalize_rows(np.asarray(weighted @ components))
+
+    lists = max(1, int(math.sqrt(len(ids))))
+    if len(ids):
+        centroids, assignment = spherical_kmeans(vectors, lists)
+    else:
+        centroids, assignment = np.zeros((1, components.shape[1]), dtype=np.float32), np.zeros(0, dtype=np.int32)
+    # Vecteurs rangés par liste : une liste est une tranche contiguë
+    order = np.argsort(assignment, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(centroids)))])
+
+    arrays = {
+        "ids": np.asarray(ids, dtype=np.int64)[order],
+        "vectors": vectors[order],
+        "centroids": centroids.astype(np.float32),
+        "offsets": offsets.astype(np.int64),
+        "components": components,
+        "idf": idf,
+    }
+    meta = {
+        "products": len(ids),
+        "dim": int(components.shape[1]),
+        "lists": int(len(centroids)),
+        "hash_features": HASH_FEATURES,
+        "built_at": time.time(),
+        "build_seconds": round(time.perf_counter() - start, 3),
+    }
+    return arrays, meta
+
+
+def _watermark(product_watermark: Optional[datetime]) -> Optional[str]:
+    return product_watermark.isoformat() if product_watermark else None
+
+
+def build_index(documents: Iterable[Tuple[int, Translations]], path: str = SEMANTIC_INDEX_PATH,
+                product_watermark: Optional[datetime] = None) -> Dict:
+    """Construit l'index et l'écrit dans `path`, avec le watermark des produits couverts"""
+    arrays, meta = build_arrays(documents)
+    meta["product_watermark"] = _watermark(product_watermark)
+    save_arrays(path, arrays, meta)
+    return meta
+
+
+class SemanticIndex(MappedModel):
+    """Index IVF des plongements produits, ouvert en mmap"""
+
+    ARRAYS = ("ids", "vectors", "centroids", "offsets", "components", "idf")
+
+    def __init__(self, path: str = SEMANTIC_INDEX_PATH, nprobe: int = SEMANTIC_NPROBE):
+        super().__init__(path)
+        self.nprobe = nprobe
+
+    def embed_query(self, query: str) -> Optional[np.ndarray]:
+        """Vecteur normalisé de la requête, None si elle ne contient aucun terme"""
+        arrays = self.arrays
+        terms: Dict[str, float] = {}
+        for term in tokenize(query):
+            terms[term] = terms.get(term, 0.0) + 1.0
+        if not terms or arrays is None:
+            return None
+        row = _weighted(hashed_matrix([terms]), np.asarray(arrays["idf"]))
+        vector = np.asarray(row @ arrays["components"]).ravel()
+        norm = np.linalg.norm(vector)
+        return (vector / norm).astype(np.float32) if norm > 0 else None
+
+    def search(self, query: str, limit: int = 10, exact: bool = False,
+               nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """(id, similarité cosinus) des produits les plus proches de la requête"""
+        arrays = self.arrays
+        vector = self.embed_query(query)
+        if vector is None or limit <= 0:
+            return []
+        vectors, offsets = arrays["vectors"], arrays["offsets"]
+        if exact:
+            rows = np.arange(len(vectors))
+            scores = vectors @ vector
+        else:
+            centroid_scores = arrays["centroids"] @ vector
+            probe = min(nprobe or self.nprobe, len(centroid_scores))
+            lists = np.argpartition(-centroid_scores, probe - 1)[:probe]
+            rows = np.concatenate([np.arange(offsets[l], offsets[l + 1]) for l in lists])
+            scores = np.concatenate([vectors[offsets[l]:offsets[l + 1]] @ vector for l in lists])
+        if not len(rows):
+            return []
+        k = min(limit, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        ids = arrays["ids"]
+        return [(int(ids[rows[i]]), float(scores[i])) for i in top]
+
+    def is_outdated(self, product_watermark: Optional[datetime]) -> bool:
+        """Vrai si l'index manque ou a été construit avant ce watermark du catalogue"""
+        return not self.loaded or self.meta.get("product_watermark") != _watermark(product_watermark)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "loaded": self.loaded,
+            "path": self.path,
+            "nprobe": self.nprobe,
+            "rebuild_interval_seconds": SEMANTIC_REBUILD_INTERVAL,
+            "mapped_bytes": self.mapped_bytes(),
+            **self.meta,
+        }
+
+
+semantic_index = SemanticIndex()
+
+
+def main():
+    from sqlalchemy import func
+
+    from models import Product, session_scope
+    from recommendations import load_documents
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=SEMANTIC_INDEX_PATH)
+    args = parser.parse_args()
+
+    with session_scope() as db:
+        # Lu avant les documents : une modification pendant la lecture déclenchera une reconstruction
+        product_watermark = db.query(func.max(Product.updated_at)).scalar()
+        documents = load_documents(db)
+    meta = build_index(documents, args.output, product_watermark)
+    print(f"✅ Index sémantique : {meta['products']} produits, {meta['dim']} dimensions, "
+          f"{meta['lists']} listes ({meta['build_seconds']}s) dans {args.output}")
+
+
+if __name__ == "__main__":
+    main()
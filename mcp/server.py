@@ -3,20 +3,105 @@
 MCP Server with Sylius Product Integration
 """
 import asyncio
-import json
-from typing import Any, Dict, List, Optional
-from datetime import datetime
+import contextvars
+from contextlib import asynccontextmanager
+import hmac
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+from datetime import datetime, timezone
 import uvicorn
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Body, Depends, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 from sqlalchemy.orm import Session
 
 # Import des modèles Sylius
-from models import get_db, Product, ProductVariant, ProductTranslation
+from models import session_scope, get_pool_stats, Product, ProductVariant, ProductTranslation
+from products import (DEFAULT_LOCALES, FIELD_PATHS, Fields, Locales, availability, locale_chain, parse_fields, product_query,
+                      project_products, serialize_product, serialize_products, stock_threshold, decode_cursor, next_cursor)
+from pricing import price_cache, PRICE_REFRESH_INTERVAL
+from catalog import (catalog, catalog_documents, LOAD_BATCH_SIZE, CATALOG_DOCUMENTS, CATALOG_SNAPSHOT,
+                     CATALOG_REFRESH_INTERVAL, CATALOG_RECONCILE_INTERVAL)
+from search_index import search_index
+from fuzzy_index import name_index
+from tool_cache import tool_cache, product_tags, code_tag, CATALOG_TAG
+from tool_registry import registry, ToolError, ToolResult
+from encoding import dumps, dumps_text, MCP_PRETTY_JSON
+from export import iter_export_chunks
+from recommendations import RECO_TOP_K, similar_index, load_documents
+from co_purchase import co_purchase, COPURCHASE_REFRESH_INTERVAL
+from customer_model import customer_model
+from semantic_index import semantic_index, build_index, SEMANTIC_REBUILD_INTERVAL
+from model_store import file_lock
+from precompute import get_precomputed
+from browse import BROWSE_SORTS, BrowseFilters, BrowsePage, browse_database, facet_index
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, UNKNOWN_TOOL, tool_metrics
+from sql_stats import sql_instrumentation
+
+# The BM25 search index follows the catalog snapshot, or the tracked translations without it
+search_index.attach(catalog)
+search_index.attach(catalog_documents)
+# So does the name (prefix/trigram) index behind autocompletion and fuzzy search
+name_index.attach(catalog)
+name_index.attach(catalog_documents)
+# Cached results are invalidated by whichever source follows the catalog
+tool_cache.attach(catalog)
+tool_cache.attach(catalog_documents)
+# The similar-products table is updated with the snapshot, or with the tracked translations without it
+similar_index.attach(catalog)
+similar_index.attach(catalog_documents)
+facet_index.attach(catalog)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the optional catalog snapshot and start the background refresh tasks"""
+    refresh_task = semantic_task = None
+    # Memory-mapped, so every uvicorn worker shares one copy of the factors
+    if not customer_model.load():
+        print(f"No customer recommendation model at {customer_model.path} (run customer_model.py)")
+    if not semantic_index.load():
+        print(f"No semantic index at {semantic_index.path} (run semantic_index.py, or wait for the background build)")
+    # Prices first: the snapshot serializes products with them
+    try:
+        await run_db(price_cache.load)
+    except Exception as e:
+        print(f"Error loading channel prices: {e}")
+    price_task = asyncio.create_task(refresh_prices_forever())
+    if CATALOG_SNAPSHOT:
+        try:
+            # Categories first: the snapshot load rebuilds the facet columns
+            await run_db(facet_index.load_taxons)
+        except Exception as e:
+            print(f"Error loading taxons: {e}")
+        try:
+            await run_db(catalog.load_full)
+        except Exception as e:
+            catalog.last_error = str(e)
+            print(f"Error building catalog snapshot: {e}")
+        refresh_task = asyncio.create_task(refresh_catalog_forever())
+    elif CATALOG_DOCUMENTS:
+        # Without the snapshot, the search indexes still follow the product translations
+        try:
+            await run_db(catalog_documents.load_full)
+        except Exception as e:
+            catalog_documents.last_error = str(e)
+            print(f"Error loading catalog documents: {e}")
+        refresh_task = asyncio.create_task(refresh_documents_forever())
+    if SEMANTIC_REBUILD_INTERVAL > 0:
+        semantic_task = asyncio.create_task(rebuild_semantic_index_forever())
+    co_purchase_task = asyncio.create_task(refresh_co_purchase_forever())
+    yield
+    price_task.cancel()
+    co_purchase_task.cancel()
+    for task in (refresh_task, semantic_task):
+        if task is not None:
+            task.cancel()
 
 # Create FastAPI app for MCP server
-app = FastAPI(title="MCP Hello World Server")
+app = FastAPI(title="MCP Hello World Server", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -27,17 +112,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Sylius DB access runs in a bounded thread pool so that blocking MySQL I/O
+# never stalls the event loop; DB_OFFLOAD=0 restores inline execution.
+DB_OFFLOAD = os.getenv("DB_OFFLOAD", "1") != "0"
+DB_WORKERS = int(os.getenv("DB_WORKERS", "10"))
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="sylius-db")
+
+async def run_db(func, **kwargs):
+    """Run a Sylius tool function with a DB session, off the event loop"""
+    def call():
+        with session_scope() as db:
+            return func(db=db, **kwargs)
+
+    if not DB_OFFLOAD:
+        return call()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, contextvars.copy_context().run, call)
+
+async def run_db_background(func, **kwargs):
+    """Like run_db, on a thread of its own: a long scan never holds a DB worker that tool calls wait for"""
+    def call():
+        with session_scope() as db:
+            return func(db=db, **kwargs)
+
+    return await asyncio.to_thread(call)
+
+# Bulk lookups resolve at most this many codes in one IN query
+MAX_CODES_PER_CALL = int(os.getenv("MAX_CODES_PER_CALL", "500"))
+
+# JSON-RPC batches on /mcp
+MCP_BATCH_MAX_SIZE = int(os.getenv("MCP_BATCH_MAX_SIZE", "100"))
+MCP_BATCH_CONCURRENCY = int(os.getenv("MCP_BATCH_CONCURRENCY", "8"))
+
 # Pydantic models for requests
 class ToolCallRequest(BaseModel):
     name: str
     arguments: Dict[str, Any] = {}
 
+# JSON-RPC 2.0 request ids: number, string or null
+RequestId = Union[int, str, None]
+
 class MCPRequest(BaseModel):
     jsonrpc: str = "2.0"
-    id: int
+    id: RequestId = None
     method: str
     params: Dict[str, Any] = {}
 
+    @property
+    def is_notification(self) -> bool:
+        """A request without an `id` member (an explicit null id still gets a response)"""
+        return "id" not in self.model_fields_set
+
 # Tool functions
 def hello_world(name: str = "World") -> str:
     """Say hello to someone"""
@@ -47,126 +172,939 @@ def get_current_time() -> str:
     """Get the current time"""
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-def get_sylius_products(limit: int = 10, offset: int = 0, db: Session = None) -> List[Dict[str, Any]]:
-    """Get products from Sylius database"""
+def get_sylius_products(limit: int = 10, offset: int = 0, after: Optional[int] = None, locales: Locales = DEFAULT_LOCALES,
+                        min_available: Optional[int] = None, fields: Optional[Fields] = None, db: Session = None) -> List[Dict[str, Any]]:
+    """Get products from Sylius database, ordered by id"""
     if db is None:
         return []
 
     try:
-        products = db.query(Product).filter(Product.enabled == True).offset(offset).limit(limit).all()
-
-        result = []
-        for product in products:
-            product_data = {
-                "id": product.id,
-                "code": product.code,
-                "name": product.get_name(),
-                "description": product.get_description(),
-                "enabled": product.enabled,
-                "created_at": product.created_at.isoformat() if product.created_at else None,
-                "variants": []
-            }
-
-            # Ajouter les variants
-            for variant in product.variants:
-                if variant.enabled:
-                    variant_data = {
-                        "id": variant.id,
-                        "code": variant.code,
-                        "price": variant.get_price(),
-                        "on_hand": variant.on_hand,
-                        "tracked": variant.tracked
-                    }
-                    product_data["variants"].append(variant_data)
-
-            result.append(product_data)
-
-        return result
+        query = product_query(db, locales, min_available, fields).filter(Product.enabled == True).order_by(Product.id)
+        if after is not None:
+            # Pagination par clé : coût constant quelle que soit la page
+            query = query.filter(Product.id > after)
+        else:
+            query = query.offset(offset)
+        products = query.limit(limit).all()
+        return serialize_products(products, locales, fields)
     except Exception as e:
         print(f"Error fetching products: {e}")
         return []
 
-def get_sylius_product_by_code(code: str, db: Session = None) -> Optional[Dict[str, Any]]:
+def get_sylius_product_by_code(code: str, locales: Locales = DEFAULT_LOCALES, fields: Optional[Fields] = None,
+                               db: Session = None) -> Optional[Dict[str, Any]]:
     """Get a specific product by code from Sylius database"""
     if db is None:
         return None
 
     try:
-        product = db.query(Product).filter(Product.code == code, Product.enabled == True).first()
+        product = product_query(db, locales, fields=fields).filter(Product.code == code, Product.enabled == True).first()
 
         if not product:
             return None
 
-        product_data = {
-            "id": product.id,
-            "code": product.code,
-            "name": product.get_name(),
-            "description": product.get_description(),
-            "enabled": product.enabled,
-            "created_at": product.created_at.isoformat() if product.created_at else None,
-            "variants": []
-        }
-
-        # Ajouter les variants
-        for variant in product.variants:
-            if variant.enabled:
-                variant_data = {
-                    "id": variant.id,
-                    "code": variant.code,
-                    "price": variant.get_price(),
-                    "on_hand": variant.on_hand,
-                    "tracked": variant.tracked
-                }
-                product_data["variants"].append(variant_data)
-
-        return product_data
+        return serialize_product(product, locales, fields)
     except Exception as e:
         print(f"Error fetching product {code}: {e}")
         return None
 
-def search_sylius_products(query: str, limit: int = 10, db: Session = None) -> List[Dict[str, Any]]:
+def get_sylius_products_by_codes(codes: List[str], locales: Locales = DEFAULT_LOCALES, min_available: Optional[int] = None,
+                                 fields: Optional[Fields] = None, db: Session = None) -> List[Dict[str, Any]]:
+    """Get products by code with one IN query, in the order of `codes`"""
+    if db is None or not codes:
+        return []
+
+    try:
+        products = product_query(db, locales, min_available, fields).filter(Product.code.in_(codes), Product.enabled == True).all()
+        by_code = {product.code: serialize_product(product, locales, fields) for product in products}
+        return [by_code[code] for code in codes if code in by_code]
+    except Exception as e:
+        print(f"Error fetching products by code: {e}")
+        return []
+
+def search_sylius_products(query: str, limit: int = 10, locales: Locales = DEFAULT_LOCALES, min_available: Optional[int] = None,
+                           fields: Optional[Fields] = None, db: Session = None) -> List[Dict[str, Any]]:
     """Search products by name or description"""
     if db is None:
         return []
 
     try:
-        # Recherche dans les traductions
-        products = db.query(Product).join(Product.translations).filter(
+        # Recherche dans toutes les traductions (EXISTS : un produit n'apparaît qu'une fois)
+        products = product_query(db, locales, min_available, fields).filter(
             Product.enabled == True,
-            (ProductTranslation.name.contains(query) | ProductTranslation.description.contains(query))
-        ).limit(limit).all()
-
-        result = []
-        for product in products:
-            product_data = {
-                "id": product.id,
-                "code": product.code,
-                "name": product.get_name(),
-                "description": product.get_description(),
-                "enabled": product.enabled,
-                "created_at": product.created_at.isoformat() if product.created_at else None,
-                "variants": []
+            Product.translations.any(
+                ProductTranslation.name.contains(query) | ProductTranslation.description.contains(query)
+            )
+        ).order_by(Product.id).limit(limit).all()
+        return serialize_products(products, locales, fields)
+    except Exception as e:
+        print(f"Error searching products: {e}")
+        return []
+
+def get_stock_levels(codes: List[str], db: Session = None) -> List[Dict[str, Any]]:
+    """Availability of variants by code, one IN query on the variant table only"""
+    if db is None or not codes:
+        return []
+
+    try:
+        rows = db.query(
+            ProductVariant.code, ProductVariant.enabled, ProductVariant.tracked,
+            ProductVariant.on_hand, ProductVariant.on_hold,
+        ).filter(ProductVariant.code.in_(codes)).all()
+        levels = {}
+        for code, enabled, tracked, on_hand, on_hold in rows:
+            available = availability(tracked, on_hand, on_hold)
+            levels[code] = {
+                "code": code,
+                "enabled": enabled,
+                "tracked": tracked,
+                "on_hand": on_hand,
+                "on_hold": on_hold,
+                "available": available,
+                "in_stock": bool(enabled) and (available is None or available > 0),
             }
+        return [levels[code] for code in codes if code in levels]
+    except Exception as e:
+        print(f"Error fetching stock levels: {e}")
+        return []
+
+def browse_sylius_products(filters: BrowseFilters, sort: str = "newest", limit: int = 10, offset: int = 0,
+                           scores: Optional[Dict[int, float]] = None, locales: Locales = DEFAULT_LOCALES,
+                           fields: Optional[Fields] = None, db: Session = None) -> Tuple[List[Dict[str, Any]], Optional[BrowsePage]]:
+    """Filtered and sorted page of products with facet counts, evaluated by the database"""
+    if db is None:
+        return [], None
 
-            # Ajouter les variants
-            for variant in product.variants:
-                if variant.enabled:
-                    variant_data = {
-                        "id": variant.id,
-                        "code": variant.code,
-                        "price": variant.get_price(),
-                        "on_hand": variant.on_hand,
-                        "tracked": variant.tracked
-                    }
-                    product_data["variants"].append(variant_data)
-
-            result.append(product_data)
-
-        return result
+    try:
+        page = browse_database(db, filters, sort=sort, limit=limit, offset=offset, scores=scores)
+        products = product_query(db, locales, filters.min_available, fields).filter(Product.id.in_(page.ids)).all()
+        by_id = {product.id: serialize_product(product, locales, fields) for product in products}
+        return [by_id[pid] for pid in page.ids if pid in by_id], page
+    except ValueError:
+        raise
     except Exception as e:
-        print(f"Error searching products: {e}")
+        print(f"Error browsing products: {e}")
+        return [], None
+
+def autocomplete_sylius_products(prefix: str, limit: int = 10, db: Session = None) -> List[Dict[str, Any]]:
+    """Complete product names starting with a prefix"""
+    if db is None:
+        return []
+
+    try:
+        rows = db.query(Product.id, Product.code, ProductTranslation.name).join(Product.translations).filter(
+            Product.enabled == True,
+            ProductTranslation.name.startswith(prefix, autoescape=True)
+        ).order_by(ProductTranslation.name, Product.id).limit(limit * 4).all()
+
+        result, seen = [], set()
+        for product_id, code, name in rows:
+            if product_id not in seen:
+                seen.add(product_id)
+                result.append({"id": product_id, "code": code, "name": name})
+        return result[:limit]
+    except Exception as e:
+        print(f"Error completing products: {e}")
         return []
 
+def get_sylius_products_by_ids(ids: List[int], locales: Locales = DEFAULT_LOCALES, min_available: Optional[int] = None,
+                               fields: Optional[Fields] = None, db: Session = None) -> List[Dict[str, Any]]:
+    """Get products by id, in the order of `ids`"""
+    if db is None or not ids:
+        return []
+
+    try:
+        products = product_query(db, locales, min_available, fields).filter(Product.id.in_(ids), Product.enabled == True).all()
+        by_id = {product.id: serialize_product(product, locales, fields) for product in products}
+        return [by_id[pid] for pid in ids if pid in by_id]
+    except Exception as e:
+        print(f"Error fetching products by id: {e}")
+        return []
+
+def get_precomputed_recommendations(kind: str, subject_id: Optional[int] = None, code: Optional[str] = None,
+                                    db: Session = None) -> Optional[Tuple[List[Tuple[int, float]], datetime]]:
+    """Recommendations written by precompute.py: a single primary-key lookup"""
+    if db is None:
+        return None
+
+    try:
+        return get_precomputed(db, kind, subject_id=subject_id, code=code)
+    except Exception as e:
+        print(f"Error reading precomputed recommendations: {e}")
+        return None
+
+def build_similar_index(db: Session = None) -> None:
+    """Build the recommendation index straight from the database (no snapshot)"""
+    similar_index.rebuild(load_documents(db))
+
+def build_semantic_index(source) -> bool:
+    """Build and save the semantic index from the in-memory translations (snapshot or tracked documents)
+
+    One uvicorn worker builds at a time: the others skip and pick up its index. Returns True if built here.
+    """
+    with file_lock(f"{semantic_index.path}.build.lock", blocking=False) as acquired:
+        if not acquired:
+            return False
+        # Another worker may have just written an index for this watermark
+        semantic_index.reload_if_changed()
+        if not semantic_index.is_outdated(source.product_watermark):
+            return False
+        build_index(sorted(source.translations.items()), semantic_index.path, source.product_watermark)
+        return True
+
+# Product tools are served from the in-memory snapshot while it is fresh enough.
+# A field projection narrows the database path; tools then project either path's output.
+async def fetch_products(limit: int = 10, offset: int = 0, after: Optional[int] = None, locales: Locales = DEFAULT_LOCALES,
+                         min_available: Optional[int] = None, fields: Optional[Fields] = None) -> List[Dict[str, Any]]:
+    if catalog.is_fresh():
+        return catalog.list_products(limit=limit, offset=offset, after=after, locales=locales, min_available=min_available)
+    return await run_db(get_sylius_products, limit=limit, offset=offset, after=after, locales=locales,
+                        min_available=min_available, fields=fields)
+
+async def fetch_product_by_code(code: str, locales: Locales = DEFAULT_LOCALES,
+                                fields: Optional[Fields] = None) -> Optional[Dict[str, Any]]:
+    if catalog.is_fresh():
+        return catalog.get_by_code(code, locales)
+    return await run_db(get_sylius_product_by_code, code=code, locales=locales, fields=fields)
+
+async def fetch_products_by_codes(codes: List[str], locales: Locales = DEFAULT_LOCALES, min_available: Optional[int] = None,
+                                  fields: Optional[Fields] = None) -> List[Dict[str, Any]]:
+    if catalog.is_fresh():
+        ids_by_code = catalog.ids_by_code
+        return catalog.get_many([ids_by_code[code] for code in codes if code in ids_by_code], locales, min_available)
+    return await run_db(get_sylius_products_by_codes, codes=codes, locales=locales, min_available=min_available, fields=fields)
+
+async def find_products(query: str, limit: int = 10, fuzzy: bool = False, locales: Locales = DEFAULT_LOCALES,
+                        min_available: Optional[int] = None,
+                        fields: Optional[Fields] = None) -> Tuple[List[Dict[str, Any]], bool]:
+    """Matching products, and whether the in-memory indexes (ranking, typo tolerance) were used"""
+    if catalog.is_fresh():
+        if fuzzy:
+            query = name_index.expand_query(query)
+        if min_available is None:
+            return catalog.get_many([pid for pid, _ in search_index.search(query, limit=limit)], locales), True
+        # Unavailable products are skipped: rank every match, then keep the first available ones
+        ranked = search_index.search(query, limit=len(catalog.products))
+        return catalog.get_many([pid for pid, _ in ranked], locales, min_available)[:limit], True
+    if catalog_documents.is_fresh():
+        if fuzzy:
+            query = name_index.expand_query(query)
+        # BM25 ranking in memory, products read from the database
+        ranked = search_index.search(query, limit=limit if min_available is None else len(search_index))
+        return await fetch_ranked_products([pid for pid, _ in ranked], limit, locales, min_available, fields), True
+    products = await run_db(search_sylius_products, query=query, limit=limit, locales=locales,
+                            min_available=min_available, fields=fields)
+    return products, False
+
+async def fetch_ranked_products(ids: List[int], limit: int, locales: Locales = DEFAULT_LOCALES,
+                                min_available: Optional[int] = None, fields: Optional[Fields] = None) -> List[Dict[str, Any]]:
+    """First `limit` products of a ranking that are enabled (and available), read by blocks of ids"""
+    block = limit if min_available is None else MAX_CODES_PER_CALL
+    found: List[Dict[str, Any]] = []
+    for start in range(0, len(ids), max(block, 1)):
+        found.extend(await fetch_products_by_ids(ids[start:start + block], locales, fields, min_available))
+        if len(found) >= limit:
+            break
+    return found[:limit]
+
+def search_index_ready() -> bool:
+    """True when the BM25 index follows the catalog (snapshot or translations)"""
+    return catalog.is_fresh() or catalog_documents.is_fresh()
+
+async def browse_products(filters: BrowseFilters, sort: str = "newest", limit: int = 10, offset: int = 0,
+                          locales: Locales = DEFAULT_LOCALES,
+                          fields: Optional[Fields] = None) -> Tuple[List[Dict[str, Any]], Optional[BrowsePage]]:
+    scores = None
+    if filters.query and search_index_ready():
+        # Every match is ranked: the other filters then narrow the set
+        scores = dict(search_index.search(filters.query, limit=len(search_index)))
+    if catalog.is_fresh() and facet_index.loaded:
+        page = facet_index.browse(filters, sort=sort, limit=limit, offset=offset, scores=scores)
+        return catalog.get_many(page.ids, locales, filters.min_available), page
+    # Without scores the database matches the query with LIKE and cannot sort by relevance
+    return await run_db(browse_sylius_products, filters=filters, sort=sort, limit=limit, offset=offset, scores=scores,
+                        locales=locales, fields=fields)
+
+async def fetch_stock_levels(codes: List[str]) -> List[Dict[str, Any]]:
+    # Always read from the database: stock moves faster than the snapshot
+    return await run_db(get_stock_levels, codes=codes)
+
+COMPLETION_FIELDS = parse_fields(["code", "name"])
+
+async def complete_products(prefix: str, limit: int = 10, locales: Locales = DEFAULT_LOCALES) -> List[Dict[str, Any]]:
+    if catalog.is_fresh():
+        return [
+            {"id": product["id"], "code": product["code"], "name": product["name"]}
+            for product in catalog.get_many(name_index.complete(prefix, limit=limit), locales)
+        ]
+    if catalog_documents.is_fresh():
+        # Prefix index in memory, names of the matches read in the locale chain
+        return await fetch_products_by_ids(name_index.complete(prefix, limit=limit), locales, COMPLETION_FIELDS)
+    return await run_db(autocomplete_sylius_products, prefix=prefix, limit=limit)
+
+async def fetch_products_by_ids(ids: List[int], locales: Locales = DEFAULT_LOCALES, fields: Optional[Fields] = None,
+                                min_available: Optional[int] = None) -> List[Dict[str, Any]]:
+    if catalog.is_fresh():
+        return catalog.get_many(ids, locales, min_available)
+    return await run_db(get_sylius_products_by_ids, ids=ids, locales=locales, min_available=min_available, fields=fields)
+
+similar_index_build = asyncio.Lock()
+
+async def similar_products(product_id: int, k: int = 10, locales: Locales = DEFAULT_LOCALES,
+                           fields: Optional[Fields] = None) -> List[Dict[str, Any]]:
+    if not len(similar_index) and not catalog.loaded and not catalog_documents.loaded:
+        # Neither source loaded (CATALOG_DOCUMENTS=0): built from the database on first use
+        async with similar_index_build:
+            if not len(similar_index):
+                await run_db(build_similar_index)
+    neighbors = similar_index.similar(product_id, k)
+    scores = dict(neighbors)
+    products = await fetch_products_by_ids([pid for pid, _ in neighbors], locales, fields)
+    return [{**product, "score": round(scores[product["id"]], 4)} for product in products]
+
+async def bought_together(product_id: int, k: int = 10, metric: str = "cosine", locales: Locales = DEFAULT_LOCALES,
+                          fields: Optional[Fields] = None) -> List[Dict[str, Any]]:
+    # Never built during a request: the full order scan runs in the background task
+    if not co_purchase.loaded:
+        raise ToolError("Co-purchase index is not built yet (built in the background at startup)", code=-32000)
+    related = co_purchase.related(product_id, k=k, metric=metric)
+    stats = {pid: (score, together) for pid, score, together in related}
+    products = await fetch_products_by_ids([pid for pid, _, _ in related], locales, fields)
+    return [
+        {**product, "score": round(stats[product["id"]][0], 4), "orders_together": stats[product["id"]][1]}
+        for product in products
+    ]
+
+async def recommend_customer_products(customer_id: int, k: int = 10, locales: Locales = DEFAULT_LOCALES,
+                                      fields: Optional[Fields] = None) -> Dict[str, Any]:
+    customer_model.reload_if_changed()
+    if not customer_model.loaded:
+        raise ToolError("Customer recommendation model is not trained (run customer_model.py)", code=-32000)
+    # Surplus candidates absorb products disabled since training
+    recommended, personalized = customer_model.recommend(customer_id, k=k + 10)
+    scores = dict(recommended)
+    products = (await fetch_products_by_ids([pid for pid, _ in recommended], locales, fields))[:k]
+    return {
+        "personalized": personalized,
+        "products": [{**product, "score": round(scores[product["id"]], 4)} for product in products],
+    }
+
+async def semantic_search(query: str, limit: int = 10, exact: bool = False, locales: Locales = DEFAULT_LOCALES,
+                          fields: Optional[Fields] = None) -> List[Dict[str, Any]]:
+    # Picks up an index rebuilt offline by semantic_index.py
+    semantic_index.reload_if_changed()
+    if not semantic_index.loaded:
+        raise ToolError("Semantic index is not built yet (run semantic_index.py, or wait for the background build)",
+                        code=-32000)
+    # Surplus candidates absorb products disabled since the build
+    matches = semantic_index.search(query, limit=limit + 10, exact=exact)
+    scores = dict(matches)
+    products = (await fetch_products_by_ids([pid for pid, _ in matches], locales, fields))[:limit]
+    return [{**product, "score": round(scores[product["id"]], 4)} for product in products]
+
+def refresh_prices(db: Session = None) -> int:
+    """Reload channel prices if they changed and reserialize the affected products"""
+    changed = sorted(price_cache.refresh(db))
+    if not changed:
+        return 0
+    product_ids = set()
+    for start in range(0, len(changed), LOAD_BATCH_SIZE):
+        product_ids.update(pid for (pid,) in db.query(ProductVariant.product_id).filter(
+            ProductVariant.id.in_(changed[start:start + LOAD_BATCH_SIZE])))
+    if catalog.loaded:
+        # The refresh notifies the indexes and the tool cache
+        catalog.mark_stale(product_ids)
+        catalog.refresh(db)
+    else:
+        tool_cache.invalidate_products(ids=product_ids)
+    return len(changed)
+
+async def refresh_prices_forever():
+    """Background task: pick up channel price changes"""
+    while True:
+        await asyncio.sleep(PRICE_REFRESH_INTERVAL)
+        try:
+            await run_db(refresh_prices)
+        except Exception as e:
+            print(f"Error refreshing channel prices: {e}")
+
+async def refresh_co_purchase_forever():
+    """Background task: build the co-purchase matrix at startup, then add orders completed since
+    its watermark and withdraw cancelled or refunded ones"""
+    while True:
+        try:
+            # The first call (or the first after a failed build) scans every order
+            await run_db_background(co_purchase.refresh)
+        except Exception as e:
+            print(f"Error refreshing co-purchase index: {e}")
+        await asyncio.sleep(COPURCHASE_REFRESH_INTERVAL)
+
+def refresh_taxons(db: Session = None) -> bool:
+    """Reload categories and product memberships if they changed"""
+    if not facet_index.refresh_taxons(db, catalog.products):
+        return False
+    tool_cache.invalidate_tags({CATALOG_TAG})
+    return True
+
+async def refresh_catalog_forever():
+    """Background task: incremental snapshot refresh plus periodic full reconcile"""
+    while True:
+        await asyncio.sleep(CATALOG_REFRESH_INTERVAL)
+        try:
+            reconciled_at = catalog.reconciled_at
+            if reconciled_at is None or time.monotonic() - reconciled_at >= CATALOG_RECONCILE_INTERVAL:
+                await run_db(catalog.load_full)
+            else:
+                await run_db(catalog.refresh)
+            await run_db(refresh_taxons)
+        except Exception as e:
+            catalog.last_error = str(e)
+            print(f"Error refreshing catalog snapshot: {e}")
+
+async def rebuild_semantic_index_forever():
+    """Background task: build the semantic index once the catalog is loaded, then rebuild it when it changes"""
+    built_at = None
+    while True:
+        # Index written by another worker or by semantic_index.py
+        semantic_index.reload_if_changed()
+        source = catalog if catalog.loaded else catalog_documents
+        due = built_at is None or time.monotonic() - built_at >= SEMANTIC_REBUILD_INTERVAL
+        if source.loaded and due and semantic_index.is_outdated(source.product_watermark):
+            try:
+                # CPU-bound and DB-free: its own thread, neither the event loop nor a DB worker
+                if await asyncio.to_thread(build_semantic_index, source):
+                    semantic_index.load()
+            except Exception as e:
+                print(f"Error building semantic index: {e}")
+            built_at = time.monotonic()
+        await asyncio.sleep(CATALOG_REFRESH_INTERVAL)
+
+async def refresh_documents_forever():
+    """Background task: incremental refresh of the tracked translations plus periodic full reconcile"""
+    while True:
+        await asyncio.sleep(CATALOG_REFRESH_INTERVAL)
+        try:
+            reconciled_at = catalog_documents.reconciled_at
+            if reconciled_at is None or time.monotonic() - reconciled_at >= CATALOG_RECONCILE_INTERVAL:
+                await run_db(catalog_documents.load_full)
+            else:
+                await run_db(catalog_documents.refresh)
+        except Exception as e:
+            catalog_documents.last_error = str(e)
+            print(f"Error refreshing catalog documents: {e}")
+
+# Tool declarations: each tool is declared once and dispatched by name
+PRODUCT_LIST_LIMIT = {"type": "integer", "description": "Maximum number of products to return", "default": 10}
+PRODUCT_LOCALE = {"type": "string", "description": f"Locale of names and descriptions, or a comma-separated fallback chain (e.g. fr_BE,fr_FR); then {', '.join(DEFAULT_LOCALES)}"}
+
+PRODUCT_IN_STOCK_ONLY = {"type": "boolean", "description": "Only return products with an available variant, and only those variants", "default": False}
+PRODUCT_MIN_AVAILABLE = {"type": "integer", "minimum": 0, "description": "Minimum available quantity (on_hand - on_hold) of a tracked variant; untracked variants are always available"}
+PRODUCT_FIELDS = {"type": "array", "items": {"type": "string", "enum": list(FIELD_PATHS)}, "uniqueItems": True,
+                  "description": "Only return these product fields (e.g. [\"code\", \"name\", \"variants.price\"]); 'variants' alone keeps every variant field"}
+
+def tool_stock_threshold(arguments: Dict[str, Any]) -> Optional[int]:
+    """Stock filter requested by a tool call, None when there is none"""
+    min_available = arguments.get("min_available")
+    if min_available is not None and (not isinstance(min_available, int) or isinstance(min_available, bool) or min_available < 0):
+        raise ToolError("Parameter 'min_available' must be a non-negative integer")
+    return stock_threshold(bool(arguments.get("in_stock_only", False)), min_available)
+
+def tool_codes(arguments: Dict[str, Any]) -> List[str]:
+    """Deduplicated `codes` argument; the first occurrence wins the position"""
+    codes = arguments["codes"]
+    if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+        raise ToolError("Parameter 'codes' must be a list of strings")
+    if len(codes) > MAX_CODES_PER_CALL:
+        raise ToolError(f"At most {MAX_CODES_PER_CALL} codes per call")
+    return list(dict.fromkeys(codes))
+
+def tool_amount(arguments: Dict[str, Any], name: str) -> Optional[int]:
+    """Non-negative amount argument, in cents like Sylius prices"""
+    value = arguments.get(name)
+    if value is None:
+        return None
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+        raise ToolError(f"Parameter '{name}' must be a non-negative number")
+    return round(value * 100)
+
+def tool_integer(arguments: Dict[str, Any], name: str, default: int, minimum: int = 1,
+                 maximum: Optional[int] = None) -> int:
+    """Integer argument between `minimum` and `maximum` (inclusive)"""
+    value = arguments.get(name, default)
+    if (not isinstance(value, int) or isinstance(value, bool) or value < minimum
+            or (maximum is not None and value > maximum)):
+        bounds = f"between {minimum} and {maximum}" if maximum is not None else f"of at least {minimum}"
+        raise ToolError(f"Parameter '{name}' must be an integer {bounds}")
+    return value
+
+def tool_datetime(arguments: Dict[str, Any], name: str) -> Optional[datetime]:
+    """ISO 8601 date or datetime argument, as naive UTC like the Sylius columns"""
+    value = arguments.get(name)
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        raise ToolError(f"Parameter '{name}' must be an ISO 8601 date")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def tool_fields(arguments: Dict[str, Any]) -> Optional[Fields]:
+    """Field projection requested by a tool call, None for full products"""
+    fields = arguments.get("fields")
+    if fields is None:
+        return None
+    if not isinstance(fields, list) or not fields or not all(isinstance(name, str) for name in fields):
+        raise ToolError("Parameter 'fields' must be a non-empty list of field names")
+    try:
+        return parse_fields(fields)
+    except ValueError as e:
+        raise ToolError(f"{e}; expected one of: {', '.join(FIELD_PATHS)}")
+
+def tool_locales(arguments: Dict[str, Any]) -> Locales:
+    """Locale chain requested by a tool call"""
+    try:
+        return locale_chain(arguments.get("locale"))
+    except ValueError as e:
+        raise ToolError(str(e))
+
+@registry.tool("hello_world", "Say hello to someone", {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string", "description": "Name to greet"}
+    }
+})
+def hello_world_tool(arguments: Dict[str, Any]) -> str:
+    return hello_world(arguments.get("name", "World"))
+
+@registry.tool("get_current_time", "Get the current time")
+def get_current_time_tool(arguments: Dict[str, Any]) -> str:
+    return get_current_time()
+
+@registry.tool("get_sylius_products", "Get products from Sylius e-commerce platform", {
+    "type": "object",
+    "properties": {
+        "limit": PRODUCT_LIST_LIMIT,
+        "offset": {"type": "integer", "description": "Number of products to skip (prefer cursor for deep pages)", "default": 0},
+        "cursor": {"type": "string", "description": "Opaque next_cursor returned by the previous page"},
+        "locale": PRODUCT_LOCALE,
+        "in_stock_only": PRODUCT_IN_STOCK_ONLY,
+        "min_available": PRODUCT_MIN_AVAILABLE,
+        "fields": PRODUCT_FIELDS
+    }
+}, cache_ttl=60)
+async def get_sylius_products_tool(arguments: Dict[str, Any]) -> ToolResult:
+    limit = arguments.get("limit", 10)
+    offset = arguments.get("offset", 0)
+    cursor = arguments.get("cursor")
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise ToolError(str(e))
+    fields = tool_fields(arguments)
+    products = await fetch_products(limit=limit, offset=offset, after=after, locales=tool_locales(arguments),
+                                    min_available=tool_stock_threshold(arguments), fields=fields)
+    return ToolResult(
+        data=project_products(products, fields),
+        extra={"next_cursor": next_cursor(products, limit)},
+        tags=product_tags(products) | {CATALOG_TAG},
+    )
+
+@registry.tool("get_sylius_product_by_code", "Get a specific product by its code from Sylius", {
+    "type": "object",
+    "properties": {
+        "code": {"type": "string", "description": "Product code to search for"},
+        "locale": PRODUCT_LOCALE,
+        "fields": PRODUCT_FIELDS
+    },
+    "required": ["code"]
+}, cache_ttl=300)
+async def get_sylius_product_by_code_tool(arguments: Dict[str, Any]) -> ToolResult:
+    code = arguments["code"]
+    fields = tool_fields(arguments)
+    product = await fetch_product_by_code(code, tool_locales(arguments), fields)
+    data = project_products(product, fields) if product else f"Product with code '{code}' not found"
+    # A product created later may take the code of a "not found" answer
+    return ToolResult(data=data, tags=product_tags(product) | {code_tag(code)} | (set() if product else {CATALOG_TAG}))
+
+@registry.tool("get_sylius_products_by_codes", "Get several products by their codes in one call, in the given order", {
+    "type": "object",
+    "properties": {
+        "codes": {"type": "array", "items": {"type": "string"}, "maxItems": MAX_CODES_PER_CALL,
+                  "description": f"Product codes to resolve (at most {MAX_CODES_PER_CALL})"},
+        "locale": PRODUCT_LOCALE,
+        "in_stock_only": PRODUCT_IN_STOCK_ONLY,
+        "min_available": PRODUCT_MIN_AVAILABLE,
+        "fields": PRODUCT_FIELDS
+    },
+    "required": ["codes"]
+}, cache_ttl=300)
+async def get_sylius_products_by_codes_tool(arguments: Dict[str, Any]) -> ToolResult:
+    codes = tool_codes(arguments)
+    fields = tool_fields(arguments)
+    products = await fetch_products_by_codes(codes, tool_locales(arguments), tool_stock_threshold(arguments), fields)
+    found = {product["code"] for product in products}
+    missing = [code for code in codes if code not in found]
+    return ToolResult(
+        data=project_products(products, fields),
+        summary=f"{len(products)} of {len(codes)} products found" + (f" (missing: {', '.join(missing)}):" if missing else ":"),
+        extra={"missing": missing},
+        tags=product_tags(products) | {code_tag(code) for code in codes} | ({CATALOG_TAG} if missing else set()),
+    )
+
+@registry.tool("search_sylius_products", "Search products by name or description in Sylius", {
+    "type": "object",
+    "properties": {
+        "query": {"type": "string", "description": "Search query"},
+        "limit": PRODUCT_LIST_LIMIT,
+        "fuzzy": {"type": "boolean", "description": "Tolerate typos in the query terms", "default": False},
+        "locale": PRODUCT_LOCALE,
+        "in_stock_only": PRODUCT_IN_STOCK_ONLY,
+        "min_available": PRODUCT_MIN_AVAILABLE,
+        "fields": PRODUCT_FIELDS
+    },
+    "required": ["query"]
+}, cache_ttl=60)
+async def search_sylius_products_tool(arguments: Dict[str, Any]) -> ToolResult:
+    query = arguments["query"]
+    fields = tool_fields(arguments)
+    fuzzy = bool(arguments.get("fuzzy", False))
+    products, indexed = await find_products(query, limit=arguments.get("limit", 10), fuzzy=fuzzy,
+                                            locales=tool_locales(arguments), min_available=tool_stock_threshold(arguments),
+                                            fields=fields)
+    summary = f"Found {len(products)} products matching '{query}'"
+    if fuzzy and not indexed:
+        # Without the in-memory indexes the search is a substring match: typos are not tolerated
+        summary += " (search index not loaded, typos not tolerated)"
+    return ToolResult(
+        data=project_products(products, fields),
+        summary=summary + ":",
+        extra={"fuzzy_applied": indexed} if fuzzy else {},
+        tags=product_tags(products) | {CATALOG_TAG},
+    )
+
+@registry.tool("browse_sylius_products", "Browse products with filters (category, price, stock, date), sorting and facet counts", {
+    "type": "object",
+    "properties": {
+        "query": {"type": "string", "description": "Optional words to match in names or descriptions"},
+        "taxon": {"type": "string", "description": "Category (taxon) code; products of its sub-categories are included"},
+        "price_min": {"type": "number", "minimum": 0, "description": "Minimum price in the channel currency"},
+        "price_max": {"type": "number", "minimum": 0, "description": "Maximum price in the channel currency"},
+        "in_stock_only": PRODUCT_IN_STOCK_ONLY,
+        "min_available": PRODUCT_MIN_AVAILABLE,
+        "created_after": {"type": "string", "format": "date-time", "description": "Only products created at or after this ISO 8601 date"},
+        "created_before": {"type": "string", "format": "date-time", "description": "Only products created at or before this ISO 8601 date"},
+        "sort": {"type": "string", "enum": list(BROWSE_SORTS), "description": "Sort order (default: relevance with a query, newest otherwise)"},
+        "limit": PRODUCT_LIST_LIMIT,
+        "offset": {"type": "integer", "description": "Number of products to skip", "default": 0},
+        "locale": PRODUCT_LOCALE,
+        "fields": PRODUCT_FIELDS
+    }
+}, cache_ttl=60)
+async def browse_sylius_products_tool(arguments: Dict[str, Any]) -> ToolResult:
+    query = arguments.get("query") or None
+    # Relevance by default only when the search index can rank the query; the summary names the sort used
+    sort = arguments.get("sort") or ("relevance" if query and search_index_ready() else "newest")
+    if sort not in BROWSE_SORTS:
+        raise ToolError(f"Parameter 'sort' must be one of: {', '.join(BROWSE_SORTS)}")
+    if sort == "relevance" and not query:
+        raise ToolError("Sorting by relevance needs a query")
+    limit, offset = arguments.get("limit", 10), arguments.get("offset", 0)
+    if not isinstance(limit, int) or not isinstance(offset, int) or limit < 0 or offset < 0:
+        raise ToolError("Parameters 'limit' and 'offset' must be non-negative integers")
+    filters = BrowseFilters(
+        query=query,
+        taxon=arguments.get("taxon") or None,
+        price_min=tool_amount(arguments, "price_min"),
+        price_max=tool_amount(arguments, "price_max"),
+        min_available=tool_stock_threshold(arguments),
+        created_after=tool_datetime(arguments, "created_after"),
+        created_before=tool_datetime(arguments, "created_before"),
+    )
+    locales, fields = tool_locales(arguments), tool_fields(arguments)
+    try:
+        products, page = await browse_products(filters, sort=sort, limit=limit, offset=offset, locales=locales, fields=fields)
+    except ValueError as e:
+        raise ToolError(str(e))
+    total = page.total if page else 0
+    facets = page.facets(locales) if page else {}
+    categories = ", ".join(f"{taxon['name']} ({taxon['count']})" for taxon in facets.get("taxons", []))
+    return ToolResult(
+        data=project_products(products, fields),
+        summary=f"{total} products match" + (f" (categories: {categories})" if categories else "")
+                + f", showing {len(products)} sorted by {sort}:",
+        extra={"total": total, "facets": facets},
+        tags=product_tags(products) | {CATALOG_TAG},
+    )
+
+@registry.tool("get_stock_levels", "Get live availability of many product variants by code, without product details", {
+    "type": "object",
+    "properties": {
+        "codes": {"type": "array", "items": {"type": "string"}, "maxItems": MAX_CODES_PER_CALL,
+                  "description": f"Variant codes (at most {MAX_CODES_PER_CALL})"}
+    },
+    "required": ["codes"]
+})
+async def get_stock_levels_tool(arguments: Dict[str, Any]) -> ToolResult:
+    codes = tool_codes(arguments)
+    levels = await fetch_stock_levels(codes)
+    found = {level["code"] for level in levels}
+    missing = [code for code in codes if code not in found]
+    in_stock = sum(level["in_stock"] for level in levels)
+    return ToolResult(
+        data=levels,
+        summary=f"{in_stock} of {len(levels)} variants in stock" + (f" (unknown: {', '.join(missing)}):" if missing else ":"),
+        extra={"missing": missing},
+    )
+
+@registry.tool("autocomplete_sylius_products", "Complete partial product names as the user types", {
+    "type": "object",
+    "properties": {
+        "prefix": {"type": "string", "description": "Beginning of a product name"},
+        "limit": {"type": "integer", "description": "Maximum number of suggestions to return", "default": 10},
+        "locale": PRODUCT_LOCALE
+    },
+    "required": ["prefix"]
+}, cache_ttl=60)
+async def autocomplete_sylius_products_tool(arguments: Dict[str, Any]) -> ToolResult:
+    suggestions = await complete_products(arguments["prefix"], limit=arguments.get("limit", 10), locales=tool_locales(arguments))
+    return ToolResult(data=suggestions, tags=product_tags(suggestions) | {CATALOG_TAG})
+
+@registry.tool("recommend_similar_products", "Recommend products similar to a given product (content-based)", {
+    "type": "object",
+    "properties": {
+        "code": {"type": "string", "description": "Code of the reference product"},
+        "k": {"type": "integer", "minimum": 1, "maximum": RECO_TOP_K, "description": "Number of recommendations to return", "default": 10},
+        "locale": PRODUCT_LOCALE,
+        "fields": PRODUCT_FIELDS
+    },
+    "required": ["code"]
+}, cache_ttl=300)
+async def recommend_similar_products_tool(arguments: Dict[str, Any]) -> ToolResult:
+    code, fields = arguments["code"], tool_fields(arguments)
+    # Only RECO_TOP_K neighbors are precomputed per product
+    k = tool_integer(arguments, "k", 10, maximum=RECO_TOP_K)
+    product = await fetch_product_by_code(code)
+    if not product:
+        return ToolResult(data=f"Product with code '{code}' not found", tags={code_tag(code), CATALOG_TAG})
+    recommendations = await similar_products(product["id"], k=k, locales=tool_locales(arguments), fields=fields)
+    return ToolResult(
+        data=project_products(recommendations, fields),
+        summary=f"{len(recommendations)} products similar to '{code}':",
+        tags=product_tags(recommendations) | product_tags(product) | {CATALOG_TAG},
+    )
+
+@registry.tool("frequently_bought_together", "Products most often bought in the same orders as a given product", {
+    "type": "object",
+    "properties": {
+        "code": {"type": "string", "description": "Code of the reference product"},
+        "k": {"type": "integer", "description": "Number of recommendations to return", "default": 10, "minimum": 1},
+        "metric": {"type": "string", "enum": ["cosine", "lift"], "description": "Co-occurrence normalization", "default": "cosine"},
+        "locale": PRODUCT_LOCALE,
+        "fields": PRODUCT_FIELDS
+    },
+    "required": ["code"]
+}, cache_ttl=300)
+async def frequently_bought_together_tool(arguments: Dict[str, Any]) -> ToolResult:
+    code, fields = arguments["code"], tool_fields(arguments)
+    k = tool_integer(arguments, "k", 10)
+    product = await fetch_product_by_code(code)
+    if not product:
+        return ToolResult(data=f"Product with code '{code}' not found", tags={code_tag(code), CATALOG_TAG})
+    try:
+        recommendations = await bought_together(product["id"], k=k, metric=arguments.get("metric", "cosine"),
+                                                locales=tool_locales(arguments), fields=fields)
+    except ValueError as e:
+        raise ToolError(str(e))
+    return ToolResult(
+        data=project_products(recommendations, fields),
+        summary=f"{len(recommendations)} products frequently bought with '{code}':",
+        tags=product_tags(recommendations) | product_tags(product) | {CATALOG_TAG},
+    )
+
+@registry.tool("recommend_for_customer", "Personalized product recommendations for a customer, from their order history", {
+    "type": "object",
+    "properties": {
+        "customer_id": {"type": "integer", "description": "Sylius customer id", "minimum": 1},
+        "k": {"type": "integer", "description": "Number of recommendations to return", "default": 10, "minimum": 1},
+        "locale": PRODUCT_LOCALE,
+        "fields": PRODUCT_FIELDS
+    },
+    "required": ["customer_id"]
+}, cache_ttl=300)
+async def recommend_for_customer_tool(arguments: Dict[str, Any]) -> ToolResult:
+    customer_id, fields = tool_integer(arguments, "customer_id", None), tool_fields(arguments)
+    k = tool_integer(arguments, "k", 10)
+    result = await recommend_customer_products(customer_id, k=k, locales=tool_locales(arguments), fields=fields)
+    products = result["products"]
+    kind = "personalized" if result["personalized"] else "popular (unknown customer)"
+    return ToolResult(
+        data=project_products(products, fields),
+        summary=f"{len(products)} {kind} recommendations for customer {customer_id}:",
+        extra={"personalized": result["personalized"]},
+        tags=product_tags(products) | {CATALOG_TAG},
+    )
+
+@registry.tool("semantic_search_sylius_products", "Search products by meaning rather than exact words (local embeddings)", {
+    "type": "object",
+    "properties": {
+        "query": {"type": "string", "description": "Natural-language description of the wanted products"},
+        "limit": {"type": "integer", "description": "Number of products to return", "default": 10, "minimum": 1},
+        "exact": {"type": "boolean", "description": "Compare against every product instead of the nearest clusters", "default": False},
+        "locale": PRODUCT_LOCALE,
+        "fields": PRODUCT_FIELDS
+    },
+    "required": ["query"]
+}, cache_ttl=60)
+async def semantic_search_sylius_products_tool(arguments: Dict[str, Any]) -> ToolResult:
+    query, fields = arguments["query"], tool_fields(arguments)
+    limit = tool_integer(arguments, "limit", 10)
+    products = await semantic_search(query, limit=limit, exact=bool(arguments.get("exact", False)),
+                                     locales=tool_locales(arguments), fields=fields)
+    return ToolResult(
+        data=project_products(products, fields),
+        summary=f"{len(products)} products semantically close to '{query}':",
+        tags=product_tags(products) | {CATALOG_TAG},
+    )
+
+@registry.tool("get_precomputed_recommendations", "Recommendations computed offline for a product (similar products) or a customer", {
+    "type": "object",
+    "properties": {
+        "code": {"type": "string", "description": "Code of the reference product"},
+        "customer_id": {"type": "integer", "description": "Sylius customer id (instead of code)"},
+        "k": {"type": "integer", "description": "Number of recommendations to return", "default": 10,
+              "minimum": 1, "maximum": RECO_TOP_K},
+        "locale": PRODUCT_LOCALE,
+        "fields": PRODUCT_FIELDS
+    }
+}, cache_ttl=300)
+async def get_precomputed_recommendations_tool(arguments: Dict[str, Any]) -> ToolResult:
+    code, customer_id = arguments.get("code"), arguments.get("customer_id")
+    locales, fields = tool_locales(arguments), tool_fields(arguments)
+    k = tool_integer(arguments, "k", 10, maximum=RECO_TOP_K)
+    if code:
+        stored = await run_db(get_precomputed_recommendations, kind="similar", code=code)
+        subject, tags = f"product '{code}'", {code_tag(code)}
+    elif customer_id is not None:
+        stored = await run_db(get_precomputed_recommendations, kind="customer", subject_id=customer_id)
+        subject, tags = f"customer {customer_id}", set()
+    else:
+        raise ToolError("Parameter 'code' or 'customer_id' is required")
+    if stored is None:
+        return ToolResult(data=f"No precomputed recommendations for {subject} (run precompute.py)", tags=tags)
+    items, computed_at = stored
+    scores = dict(items)
+    # Products disabled since the run are dropped
+    products = (await fetch_products_by_ids(list(scores), locales, fields))[:k]
+    products = [{**product, "score": scores[product["id"]]} for product in products]
+    return ToolResult(
+        data=project_products(products, fields),
+        summary=f"{len(products)} precomputed recommendations for {subject}:",
+        extra={"computed_at": computed_at.isoformat()},
+        tags=product_tags(products) | tags | {CATALOG_TAG},
+    )
+
+for _tool in registry.tools.values():
+    tool_cache.set_default_ttl(_tool.name, _tool.cache_ttl)
+
+# Gauges read on each /metrics scrape, never on the tool call path
+def pool_stat(name: str):
+    return lambda: get_pool_stats().get(name)
+
+tool_metrics.add_gauge("mcp_tool_cache_entries", "Entries in the tool result cache", lambda: tool_cache.stats()["entries"])
+tool_metrics.add_gauge("mcp_tool_cache_bytes", "Bytes held by the tool result cache", lambda: tool_cache.stats()["bytes"])
+tool_metrics.add_gauge("mcp_tool_cache_evictions_total", "Tool result cache evictions",
+                       lambda: tool_cache.stats()["evictions"], kind="counter")
+tool_metrics.add_gauge("mcp_db_pool_size", "Permanent connections of the SQLAlchemy pool", pool_stat("size"))
+tool_metrics.add_gauge("mcp_db_pool_checked_out", "Connections currently in use", pool_stat("checked_out"))
+tool_metrics.add_gauge("mcp_db_pool_overflow", "Connections opened beyond the pool size", pool_stat("overflow"))
+tool_metrics.add_gauge("mcp_db_pool_waits_total", "Checkouts that had to wait for a connection", pool_stat("waits"), kind="counter")
+tool_metrics.add_gauge("mcp_db_pool_timeouts_total", "Checkouts that timed out", pool_stat("timeouts"), kind="counter")
+tool_metrics.add_gauge("mcp_db_executor_queued", "DB calls waiting for a worker thread", lambda: db_executor._work_queue.qsize())
+tool_metrics.add_gauge("mcp_catalog_products", "Products in the in-memory snapshot",
+                       lambda: len(catalog.products) if catalog.loaded else None)
+tool_metrics.add_gauge("mcp_catalog_staleness_seconds", "Age of the in-memory snapshot", catalog.staleness)
+
+# Transport encoding: payloads are serialized once, compact unless pretty is requested
+def encode_mcp_result(result: ToolResult, pretty: bool = False) -> bytes:
+    """MCP tools/call result: text content plus extra fields"""
+    if result.text is not None:
+        text = result.text
+    elif isinstance(result.data, str):
+        text = result.data
+    else:
+        text = dumps_text(result.data, pretty)
+        if result.summary:
+            text = f"{result.summary}\n{text}"
+    return dumps({"content": [{"type": "text", "text": text}], **result.extra}, pretty)
+
+def encode_http_result(result: ToolResult, pretty: bool = False) -> bytes:
+    """/tools/{tool_name} body: raw result plus extra fields"""
+    return dumps({"result": result.data, **result.extra}, pretty)
+
+TRANSPORT_ENCODERS = {"mcp": encode_mcp_result, "tools": encode_http_result}
+
+async def run_tool(tool_name: Optional[str], arguments: Any, transport: str, pretty: bool = False) -> bytes:
+    """Look up, call and encode a tool, going through the result cache and recording its metrics"""
+    tool = registry.get(tool_name)
+    call = tool_metrics.start(tool.name if tool is not None else UNKNOWN_TOOL, transport)
+    try:
+        if tool is None:
+            raise ToolError(f"Tool '{tool_name}' not found", code=-32601)
+        if not isinstance(arguments, dict):
+            raise ToolError("Parameter 'arguments' must be an object")
+
+        cache_key = None
+        if tool_cache.is_cacheable(tool.name):
+            cache_key = tool_cache.key(tool.name, arguments, f"{transport}:pretty" if pretty else transport)
+            cached = tool_cache.get(cache_key)
+            if cached is not None:
+                call.cached, call.size = True, len(cached)
+                return cached
+
+        result = await tool.call(arguments)
+        payload = TRANSPORT_ENCODERS[transport](result, pretty)
+        if cache_key is not None:
+            tool_cache.put(cache_key, payload, result.tags)
+        call.size = len(payload)
+        return payload
+    except ToolError as e:
+        call.error = str(e.code)
+        raise
+    except Exception:
+        call.error = "exception"
+        raise
+    finally:
+        tool_metrics.finish(call)
+
+def json_response(body, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def with_meta(result_json: bytes, meta: Dict[str, Any]) -> bytes:
+    """Add `_meta` to an encoded result object without decoding it (never cached)"""
+    return result_json.rstrip()[:-1] + b',"_meta":' + dumps(meta) + b"}"
+
+def jsonrpc_result_response(request_id: RequestId, result_json: bytes) -> Response:
+    """JSON-RPC response wrapping an already serialized result"""
+    return json_response(b'{"jsonrpc":"2.0","id":%s,"result":%s}' % (dumps(request_id), result_json))
+
+def jsonrpc_error(request_id: RequestId, code: int, message: str) -> Dict[str, Any]:
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {
+            "code": code,
+            "message": message
+        }
+    }
+
+def response_body(response) -> bytes:
+    """Encoded body of a handler result (dict or pre-serialized Response)"""
+    if isinstance(response, Response):
+        return response.body
+    return dumps(response)
+
 @app.get("/")
 async def root():
     return {"message": "MCP Hello World Server is running"}
@@ -175,295 +1113,175 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
+@app.get("/catalog")
+async def catalog_status():
+    """In-memory catalog snapshot status and staleness"""
+    return {**catalog.status(), "documents": catalog_documents.status(), "prices": price_cache.stats(),
+            "facets": facet_index.stats()}
+
+# The /debug routes (SQL, runtime settings) and cache invalidation are disabled unless DEBUG_TOKEN
+# is set, then the token must be sent in the X-Debug-Token header. Each uvicorn worker answers for itself.
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+
+def require_debug_token(x_debug_token: Optional[str] = Header(None)) -> None:
+    """Guard shared by the /debug routes and POST /cache/invalidate"""
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Debug endpoints are disabled (set DEBUG_TOKEN)")
+    if x_debug_token is None or not hmac.compare_digest(x_debug_token.encode(), DEBUG_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Debug-Token")
+
+@app.get("/cache")
+async def cache_stats():
+    """Tool result cache statistics"""
+    return tool_cache.stats()
+
+@app.post("/cache/invalidate", dependencies=[Depends(require_debug_token)])
+async def invalidate_cache(request: Dict[str, Any]):
+    """Drop cached results for the given product ids/codes (everything if none given)"""
+    ids = request.get("ids", [])
+    codes = request.get("codes", [])
+    if not ids and not codes:
+        tool_cache.clear()
+        return {"invalidated": "all"}
+    return {"invalidated": tool_cache.invalidate_products(ids=ids, codes=codes)}
+
+@app.get("/recommendations")
+async def recommendations_stats():
+    """Recommendation indexes: size, build time and memory"""
+    return {
+        "similar_products": similar_index.stats(),
+        "co_purchase": co_purchase.stats(),
+        "customer_model": customer_model.stats(),
+        "semantic_search": semantic_index.stats(),
+    }
+
+@app.get("/pool")
+async def pool_stats():
+    """Live connection pool statistics"""
+    return get_pool_stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Per-tool metrics and cache/pool/snapshot gauges in the Prometheus text format"""
+    return Response(content=tool_metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/debug/sql", dependencies=[Depends(require_debug_token)])
+async def sql_debug_status():
+    """SQL instrumentation settings and the most recent sampled slow queries of this worker"""
+    return sql_instrumentation.status()
+
+@app.post("/debug/sql", dependencies=[Depends(require_debug_token)])
+async def configure_sql_debug(request: Dict[str, Any]):
+    """Change SQL instrumentation at runtime (`enabled`, `slow_log`, `slow_ms`, `sample_rate`) in this worker"""
+    try:
+        return sql_instrumentation.configure(
+            enabled=bool(request["enabled"]) if "enabled" in request else None,
+            slow_ms=float(request["slow_ms"]) if request.get("slow_ms") is not None else None,
+            sample_rate=float(request["sample_rate"]) if request.get("sample_rate") is not None else None,
+            slow_log=bool(request["slow_log"]) if "slow_log" in request else None,
+        )
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/export/products.ndjson")
+def export_products(enabled_only: bool = True, updated_since: Optional[datetime] = None, locale: Optional[str] = None):
+    """Stream the catalog as NDJSON, one product per line, through a server-side cursor"""
+    try:
+        locales = locale_chain(locale)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def stream():
+        with session_scope() as db:
+            yield from iter_export_chunks(db, enabled_only=enabled_only, updated_since=updated_since, locale=locales)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.post("/mcp")
-async def handle_mcp_request(request: MCPRequest):
-    """Handle MCP requests"""
+async def handle_mcp_request(
+    payload: Union[List[Any], Dict[str, Any]] = Body(...),
+    pretty: bool = Query(MCP_PRETTY_JSON, description="Indent JSON output for humans"),
+):
+    """Handle MCP requests, single or JSON-RPC 2.0 batch; notifications get no response"""
+    if isinstance(payload, dict):
+        response = await handle_mcp_entry(payload, pretty)
+        return json_response(response_body(response)) if response is not None else Response(status_code=204)
+
+    if not payload:
+        return json_response(dumps(jsonrpc_error(None, -32600, "Invalid Request: empty batch")))
+    if len(payload) > MCP_BATCH_MAX_SIZE:
+        return json_response(dumps(jsonrpc_error(None, -32600, f"Invalid Request: batch larger than {MCP_BATCH_MAX_SIZE}")))
+
+    # Independent calls run concurrently, bounded so one batch cannot take the whole DB pool
+    semaphore = asyncio.Semaphore(MCP_BATCH_CONCURRENCY)
+
+    async def run(entry):
+        async with semaphore:
+            return await handle_mcp_entry(entry, pretty)
+
+    responses = [response for response in await asyncio.gather(*(run(entry) for entry in payload)) if response is not None]
+    if not responses:
+        # A batch of notifications only: nothing to return
+        return Response(status_code=204)
+    return json_response(b"[" + b",".join(response_body(response) for response in responses) + b"]")
+
+async def handle_mcp_entry(entry: Any, pretty: bool = False):
+    """Validate one JSON-RPC object and dispatch it; None for a notification"""
+    try:
+        request = MCPRequest.model_validate(entry)
+    except ValidationError as e:
+        request_id = entry.get("id") if isinstance(entry, dict) else None
+        if not isinstance(request_id, (int, str)):
+            # An id that is not a number or a string cannot be echoed back
+            request_id = None
+        return jsonrpc_error(request_id, -32600, f"Invalid Request: {e.errors()[0]['msg']}")
+    response = await dispatch_mcp_request(request, pretty)
+    # Notifications are processed but never answered, errors included
+    return None if request.is_notification else response
+
+async def dispatch_mcp_request(request: MCPRequest, pretty: bool = False):
+    """Handle one MCP request"""
     try:
         if request.method == "tools/list":
-            return {
-                "jsonrpc": "2.0",
-                "id": request.id,
-                "result": {
-                    "tools": [
-                        {
-                            "name": "hello_world",
-                            "description": "Say hello to someone",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "name": {
-                                        "type": "string",
-                                        "description": "Name to greet"
-                                    }
-                                }
-                            }
-                        },
-                        {
-                            "name": "get_current_time",
-                            "description": "Get the current time",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {}
-                            }
-                        },
-                        {
-                            "name": "get_sylius_products",
-                            "description": "Get products from Sylius e-commerce platform",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "limit": {
-                                        "type": "integer",
-                                        "description": "Maximum number of products to return",
-                                        "default": 10
-                                    },
-                                    "offset": {
-                                        "type": "integer",
-                                        "description": "Number of products to skip",
-                                        "default": 0
-                                    }
-                                }
-                            }
-                        },
-                        {
-                            "name": "get_sylius_product_by_code",
-                            "description": "Get a specific product by its code from Sylius",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "code": {
-                                        "type": "string",
-                                        "description": "Product code to search for"
-                                    }
-                                },
-                                "required": ["code"]
-                            }
-                        },
-                        {
-                            "name": "search_sylius_products",
-                            "description": "Search products by name or description in Sylius",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "query": {
-                                        "type": "string",
-                                        "description": "Search query"
-                                    },
-                                    "limit": {
-                                        "type": "integer",
-                                        "description": "Maximum number of products to return",
-                                        "default": 10
-                                    }
-                                },
-                                "required": ["query"]
-                            }
-                        }
-                    ]
-                }
-            }
+            return jsonrpc_result_response(request.id, registry.listing().mcp_result)
         elif request.method == "tools/call":
             tool_name = request.params.get("name")
-            arguments = request.params.get("arguments", {})
-
-            if tool_name == "hello_world":
-                name = arguments.get("name", "World")
-                result = hello_world(name)
-                return {
-                    "jsonrpc": "2.0",
-                    "id": request.id,
-                    "result": {
-                        "content": [{"type": "text", "text": result}]
-                    }
-                }
-            elif tool_name == "get_current_time":
-                result = get_current_time()
-                return {
-                    "jsonrpc": "2.0",
-                    "id": request.id,
-                    "result": {
-                        "content": [{"type": "text", "text": result}]
-                    }
-                }
-            elif tool_name == "get_sylius_products":
-                # Obtenir une session DB
-                db = next(get_db())
-                limit = arguments.get("limit", 10)
-                offset = arguments.get("offset", 0)
-                products = get_sylius_products(limit=limit, offset=offset, db=db)
-                result = json.dumps(products, indent=2, ensure_ascii=False)
-                return {
-                    "jsonrpc": "2.0",
-                    "id": request.id,
-                    "result": {
-                        "content": [{"type": "text", "text": result}]
-                    }
-                }
-            elif tool_name == "get_sylius_product_by_code":
-                code = arguments.get("code")
-                if not code:
-                    return {
-                        "jsonrpc": "2.0",
-                        "id": request.id,
-                        "error": {
-                            "code": -32602,
-                            "message": "Parameter 'code' is required"
-                        }
-                    }
-                db = next(get_db())
-                product = get_sylius_product_by_code(code=code, db=db)
-                if product is None:
-                    result = f"Product with code '{code}' not found"
-                else:
-                    result = json.dumps(product, indent=2, ensure_ascii=False)
-                return {
-                    "jsonrpc": "2.0",
-                    "id": request.id,
-                    "result": {
-                        "content": [{"type": "text", "text": result}]
-                    }
-                }
-            elif tool_name == "search_sylius_products":
-                query = arguments.get("query")
-                if not query:
-                    return {
-                        "jsonrpc": "2.0",
-                        "id": request.id,
-                        "error": {
-                            "code": -32602,
-                            "message": "Parameter 'query' is required"
-                        }
-                    }
-                db = next(get_db())
-                limit = arguments.get("limit", 10)
-                products = search_sylius_products(query=query, limit=limit, db=db)
-                result = json.dumps(products, indent=2, ensure_ascii=False)
-                return {
-                    "jsonrpc": "2.0",
-                    "id": request.id,
-                    "result": {
-                        "content": [{"type": "text", "text": f"Found {len(products)} products matching '{query}':\n{result}"}]
-                    }
-                }
-            else:
-                return {
-                    "jsonrpc": "2.0",
-                    "id": request.id,
-                    "error": {
-                        "code": -32601,
-                        "message": f"Tool '{tool_name}' not found"
-                    }
-                }
+            with sql_instrumentation.track(tool_name) as queries:
+                payload = await run_tool(tool_name, request.params.get("arguments", {}), "mcp", pretty)
+            if sql_instrumentation.enabled:
+                payload = with_meta(payload, {"db": queries.as_meta()})
+            return jsonrpc_result_response(request.id, payload)
         else:
-            return {
-                "jsonrpc": "2.0",
-                "id": request.id,
-                "error": {
-                    "code": -32601,
-                    "message": f"Method '{request.method}' not supported"
-                }
-            }
+            return jsonrpc_error(request.id, -32601, f"Method '{request.method}' not supported")
+    except ToolError as e:
+        return jsonrpc_error(request.id, e.code, e.message)
     except Exception as e:
-        return {
-            "jsonrpc": "2.0",
-            "id": request.id,
-            "error": {
-                "code": -32000,
-                "message": str(e)
-            }
-        }
+        return jsonrpc_error(request.id, -32000, str(e))
 
 @app.get("/tools")
-async def list_tools():
-    """List available tools"""
-    return {
-        "tools": [
-            {
-                "name": "hello_world",
-                "description": "Say hello to someone",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "name": {"type": "string", "description": "Name to greet"}
-                    }
-                }
-            },
-            {
-                "name": "get_current_time",
-                "description": "Get the current time"
-            },
-            {
-                "name": "get_sylius_products",
-                "description": "Get products from Sylius e-commerce platform",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "limit": {"type": "integer", "description": "Maximum number of products to return", "default": 10},
-                        "offset": {"type": "integer", "description": "Number of products to skip", "default": 0}
-                    }
-                }
-            },
-            {
-                "name": "get_sylius_product_by_code",
-                "description": "Get a specific product by its code from Sylius",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "code": {"type": "string", "description": "Product code to search for"}
-                    },
-                    "required": ["code"]
-                }
-            },
-            {
-                "name": "search_sylius_products",
-                "description": "Search products by name or description in Sylius",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {"type": "string", "description": "Search query"},
-                        "limit": {"type": "integer", "description": "Maximum number of products to return", "default": 10}
-                    },
-                    "required": ["query"]
-                }
-            }
-        ]
-    }
+async def list_tools(request: Request):
+    """List available tools (pre-serialized, with ETag revalidation)"""
+    listing = registry.listing()
+    headers = {"ETag": listing.etag}
+    if request.headers.get("if-none-match") == listing.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=listing.http_body, media_type="application/json", headers=headers)
 
 @app.post("/tools/{tool_name}")
-async def call_tool(tool_name: str, request: Dict[str, Any]):
+async def call_tool(
+    tool_name: str,
+    request: Dict[str, Any],
+    pretty: bool = Query(MCP_PRETTY_JSON, description="Indent JSON output for humans"),
+):
     """Call a specific tool"""
     try:
-        if tool_name == "hello_world":
-            name = request.get("arguments", {}).get("name", "World")
-            result = hello_world(name)
-        elif tool_name == "get_current_time":
-            result = get_current_time()
-        elif tool_name == "get_sylius_products":
-            db = next(get_db())
-            limit = request.get("arguments", {}).get("limit", 10)
-            offset = request.get("arguments", {}).get("offset", 0)
-            products = get_sylius_products(limit=limit, offset=offset, db=db)
-            result = products
-        elif tool_name == "get_sylius_product_by_code":
-            code = request.get("arguments", {}).get("code")
-            if not code:
-                return {"error": "Parameter 'code' is required"}
-            db = next(get_db())
-            product = get_sylius_product_by_code(code=code, db=db)
-            result = product if product else f"Product with code '{code}' not found"
-        elif tool_name == "search_sylius_products":
-            query = request.get("arguments", {}).get("query")
-            if not query:
-                return {"error": "Parameter 'query' is required"}
-            db = next(get_db())
-            limit = request.get("arguments", {}).get("limit", 10)
-            products = search_sylius_products(query=query, limit=limit, db=db)
-            result = products
-        else:
-            return {"error": f"Tool '{tool_name}' not found"}
-
-        return {"result": result}
+        with sql_instrumentation.track(tool_name) as queries:
+            payload = await run_tool(tool_name, request.get("arguments", {}), "tools", pretty)
+        return json_response(payload, queries.headers() if sql_instrumentation.enabled else None)
+    except ToolError as e:
+        return json_response(dumps({"error": e.message}))
     except Exception as e:
-        return {"error": str(e)}
+        return json_response(dumps({"error": str(e)}))
 
 if __name__ == "__main__":
     print("🚀 Starting MCP Hello World Server...")
@@ -0,0 +1,185 @@
+"""
+Instrumentation SQL : requêtes et temps MySQL par appel d'outil, journal des requêtes lentes
+
+Des écouteurs d'évènements SQLAlchemy (``before/after_cursor_execute``) sur
+le moteur de ``models.py`` mesurent chaque instruction et l'attribuent à
+l'appel d'outil en cours via une ``ContextVar`` : ``run_db`` copie le
+contexte vers le thread de la base, les instructions exécutées pour un appel
+s'additionnent donc dans ses statistiques. Ce détail par appel n'existe
+qu'en mode debug (``SQL_DEBUG``) : le serveur le renvoie alors (en-têtes
+``X-DB-*`` sur ``/tools/{tool_name}``, ``_meta`` du résultat sur ``/mcp``).
+
+Le journal des requêtes lentes est indépendant du mode debug : dès que
+``SLOW_QUERY_MS`` est défini (ou en debug), les instructions plus lentes
+que ``slow_ms`` sont journalisées, échantillonnées (``sample_rate``), avec la
+forme des paramètres (types et tailles) et non leurs valeurs. Tout se règle
+à chaud (``POST /debug/sql``) ; sans debug ni journal, les écouteurs sont
+retirés du moteur et ne coûtent rien. Chaque worker uvicorn a sa propre
+instrumentation.
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from encoding import dumps
+
+SQL_DEBUG = os.getenv("SQL_DEBUG", "0") == "1"
+# Défini : journal des requêtes lentes actif hors debug
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_MS") is not None
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS") or "200")
+SLOW_QUERY_SAMPLE = float(os.getenv("SLOW_QUERY_SAMPLE", "1"))
+# Requêtes lentes gardées pour GET /debug/sql
+SLOW_QUERY_LOG_SIZE = 100
+# Longueur maximale d'une instruction journalisée
+STATEMENT_MAX_LENGTH = 2000
+
+
+@dataclass
+class QueryStats:
+    """Instructions SQL d'un appel d'outil"""
+    tool: Optional[str] = None
+    queries: int = 0
+    seconds: float = 0.0
+
+    def as_meta(self) -> Dict[str, Any]:
+        return {"queries": self.queries, "time_ms": round(self.seconds * 1000, 3)}
+
+    def headers(self) -> Dict[str, str]:
+        return {"X-DB-Queries": str(self.queries), "X-DB-Time-Ms": f"{self.seconds * 1000:.3f}"}
+
+
+current_stats: ContextVar[Optional[QueryStats]] = ContextVar("sql_query_stats", default=None)
+
+
+def _type_name(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})" if len(value) > 64 else type(value).__name__
+    return type(value).__name__
+
+
+def parameter_shape(parameters: Any) -> Any:
+    """Forme des paramètres sans leurs valeurs : types, tailles, listes résumées (``(1, 2, 3, "a")`` → ``["int x3", "str"]``)"""
+    if isinstance(parameters, dict):
+        return {key: _type_name(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            # executemany : une forme pour toutes les lignes
+            return {"rows": len(parameters), "row": parameter_shape(parameters[0])}
+        shape: List[str] = []
+        previous, count = None, 0
+        for value in parameters:
+            name = _type_name(value)
+            if name != previous and previous is not None:
+                shape.append(previous if count == 1 else f"{previous} x{count}")
+                count = 0
+            previous, count = name, count + 1
+        if previous is not None:
+            shape.append(previous if count == 1 else f"{previous} x{count}")
+        return shape
+    return _type_name(parameters)
+
+
+class SqlInstrumentation:
+    def __init__(self, enabled: bool = SQL_DEBUG, slow_ms: float = SLOW_QUERY_MS, sample_rate: float = SLOW_QUERY_SAMPLE,
+                 slow_log: bool = SLOW_QUERY_LOG):
+        self.engine: Optional[Engine] = None
+        # Mode debug : statistiques par appel d'outil
+        self.enabled = enabled
+        # Journal des requêtes lentes hors debug
+        self.slow_log = slow_log
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.slow_queries: Deque[Dict[str, Any]] = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        self.slow_total = 0
+        self._lock = threading.Lock()
+        self._listening = False
+
+    def attach(self, engine: Engine) -> None:
+        """Instrumente `engine` (écouteurs posés seulement en debug ou avec le journal des requêtes lentes)"""
+        self.engine = engine
+        self.configure()
+
+    def configure(self, enabled: Optional[bool] = None, slow_ms: Optional[float] = None,
+                  sample_rate: Optional[float] = None, slow_log: Optional[bool] = None) -> Dict[str, Any]:
+        """Réglage à chaud ; ValueError si une valeur est hors bornes"""
+        if slow_ms is not None and slow_ms < 0:
+            raise ValueError("slow_ms must be non-negative")
+        if sample_rate is not None and not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        with self._lock:
+            if slow_ms is not None:
+                self.slow_ms = slow_ms
+            if sample_rate is not None:
+                self.sample_rate = sample_rate
+            if enabled is not None:
+                self.enabled = enabled
+            if slow_log is not None:
+                self.slow_log = slow_log
+            listen = self.enabled or self.slow_log
+            if self.engine is not None and listen != self._listening:
+                (event.listen if listen else event.remove)(self.engine, "before_cursor_execute", self._before)
+                (event.listen if listen else event.remove)(self.engine, "after_cursor_execute", self._after)
+                self._listening = listen
+        return self.settings()
+
+    def settings(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "slow_log": self.enabled or self.slow_log, "slow_ms": self.slow_ms,
+                "sample_rate": self.sample_rate, "pid": os.getpid()}
+
+    @contextmanager
+    def track(self, tool: Optional[str] = None) -> Iterator[QueryStats]:
+        """Statistiques des instructions exécutées dans le bloc, threads de run_db compris"""
+        stats = QueryStats(tool)
+        token = current_stats.set(stats)
+        try:
+            yield stats
+        finally:
+            current_stats.reset(token)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        if context is not None:
+            context._mcp_query_started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        started = getattr(context, "_mcp_query_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        stats = current_stats.get()
+        if stats is not None and self.enabled:
+            stats.queries += 1
+            stats.seconds += elapsed
+        if elapsed * 1000 >= self.slow_ms and random.random() < self.sample_rate:
+            self._log_slow(statement, parameters, elapsed, stats)
+
+    def _log_slow(self, statement: str, parameters: Any, elapsed: float, stats: Optional[QueryStats]) -> None:
+        entry = {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "tool": stats.tool if stats is not None else None,
+            "duration_ms": round(elapsed * 1000, 3),
+            "statement": " ".join(statement.split())[:STATEMENT_MAX_LENGTH],
+            "parameters": parameter_shape(parameters),
+        }
+        with self._lock:
+            self.slow_queries.append(entry)
+            self.slow_total += 1
+        print(f"Slow query: {dumps(entry).decode()}")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.settings(), "slow_total": self.slow_total, "slow_queries": list(self.slow_queries)}
+
+
+sql_instrumentation = SqlInstrumentation()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Tests de la navigation à facettes (index en mémoire et requêtes SQL)
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from browse import BrowseFilters, FacetIndex, browse_database
+from catalog import CatalogSnapshot
+from models import ChannelPricing, ProductTaxon, ProductVariant, Taxon, TaxonTranslation
+from pricing import SYLIUS_CHANNEL, price_cache
+from search_index import ProductSearchIndex
+
+
+# (id, code, parent, bornes de l'ensemble imbriqué, nom)
+TAXONS = [
+    (1, "MENU_CATEGORY", None, 1, 10, "Catégorie"),
+    (2, "SHOES", 1, 2, 5, "Chaussures"),
+    (3, "SNEAKERS", 2, 3, 4, "Baskets"),
+    (4, "HATS", 1, 6, 7, "Chapeaux"),
+    (5, "SHIRTS", 1, 8, 9, "Chemises"),
+]
+
+
+@pytest.fixture
+def catalog_data(db, monkeypatch):
+    """Produit i : catégorie selon i % 3, prix (i + 1) x 10, i % 4 exemplaires, créé le jour i"""
+    for taxon_id, code, parent_id, left, right, name in TAXONS:
+        db.add(Taxon(id=taxon_id, code=code, parent_id=parent_id, tree_root=1, tree_left=left, tree_right=right,
+                     position=taxon_id))
+        db.add(TaxonTranslation(translatable_id=taxon_id, locale="fr_FR", name=name, slug=code.lower()))
+    for variant in db.query(ProductVariant).filter(ProductVariant.enabled == True).all():
+        i = variant.product_id - 1
+        variant.tracked, variant.on_hand, variant.on_hold = True, i % 4, 0
+        variant.product.created_at = datetime(2024, 1, 1) + timedelta(days=i)
+        db.add(ChannelPricing(product_variant_id=variant.id, channel_code=SYLIUS_CHANNEL, price=(i + 1) * 1000))
+        db.add(ProductTaxon(product_id=variant.product_id, taxon_id=(3, 4, 5)[i % 3]))
+    db.commit()
+    monkeypatch.setattr(price_cache, "prices", {})
+    monkeypatch.setattr(price_cache, "loaded_at", None)
+    price_cache.load(db)
+    return db
+
+
+@pytest.fixture
+def index(catalog_data):
+    snapshot = CatalogSnapshot(max_staleness=60)
+    facets = FacetIndex()
+    facets.attach(snapshot)
+    facets.load_taxons(catalog_data)
+    snapshot.load_full(catalog_data)
+    return facets
+
+
+def search_scores(db, query):
+    """Scores BM25 de tous les produits trouvés, comme browse_products les calcule"""
+    search = ProductSearchIndex()
+    snapshot = CatalogSnapshot(max_staleness=60)
+    snapshot.load_full(db)
+    search.rebuild(snapshot.translations.items())
+    return dict(search.search(query, limit=len(search)))
+
+
+CASES = [
+    (BrowseFilters(), "newest"),
+    (BrowseFilters(taxon="SHOES", price_max=15000), "price_desc"),
+    (BrowseFilters(price_min=5000, price_max=20000, min_available=2), "price_asc"),
+    (BrowseFilters(taxon="HATS", created_after=datetime(2024, 1, 10), created_before=datetime(2024, 1, 25)), "newest"),
+    (BrowseFilters(query="Shirt 12", taxon="SNEAKERS"), "relevance"),
+    (BrowseFilters(query="Shirt 1", min_available=1), "price_asc"),
+]
+
+
+@pytest.mark.parametrize("filters,sort", CASES)
+def test_memory_and_sql_paths_agree(catalog_data, index, filters, sort):
+    scores = search_scores(catalog_data, filters.query) if filters.query else None
+    expected = browse_database(catalog_data, filters, sort=sort, limit=4, offset=1, scores=scores)
+    assert index.browse(filters, sort=sort, limit=4, offset=1, scores=scores) == expected
+    assert expected.total > 0
+
+
+def test_filters_sort_and_facets(catalog_data, index):
+    page = index.browse(BrowseFilters(taxon="SHOES", price_max=15000, min_available=1), sort="price_desc", limit=3)
+
+    # Baskets à 150 au plus : i = 0, 3, 6, 9, 12, dont 0 et 12 épuisés (i % 4 == 0)
+    assert page.ids == [10, 7, 4]
+    assert page.total == 3
+    assert page.taxons == [("SNEAKERS", {"fr_FR": "Baskets"}, 3)]
+    facets = page.facets(("fr_FR", "en_US"))
+    assert facets["taxons"] == [{"code": "SNEAKERS", "name": "Baskets", "count": 3}]
+    assert facets["price"] == [{"min": 20.0, "max": 50.0, "count": 1}, {"min": 50.0, "max": 100.0, "count": 1},
+                               {"min": 100.0, "max": 200.0, "count": 1}]
+    assert facets["availability"] == {"in_stock": 3, "out_of_stock": 0}
+
+    # Sans catégorie, la racine unique est sautée : ses enfants forment la facette
+    assert [code for code, _, _ in index.browse(BrowseFilters(), limit=0).taxons] == ["SHOES", "HATS", "SHIRTS"]
+    with pytest.raises(ValueError):
+        index.browse(BrowseFilters(taxon="UNKNOWN"))
+
+
+def test_relevance_follows_search_scores(catalog_data, index):
+    scores = search_scores(catalog_data, "Shirt 12")
+
+    page = index.browse(BrowseFilters(query="Shirt 12", taxon="SNEAKERS"), sort="relevance", limit=2, scores=scores)
+
+    assert page.ids[0] == 13
+    assert page.total == 10
+
+    # Sans index de recherche, la base ne sait pas classer par pertinence
+    with pytest.raises(ValueError, match="search index"):
+        browse_database(catalog_data, BrowseFilters(query="Shirt 12"), sort="relevance")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests du snapshot en mémoire du catalogue
+"""
+from datetime import datetime, timedelta
+
+from catalog import CatalogSnapshot
+from models import Product, ProductTranslation, ProductVariant
+from products import locale_chain
+
+
+def test_snapshot_serves_product_tools(db):
+    snapshot = CatalogSnapshot(max_staleness=60)
+    snapshot.load_full(db)
+
+    assert snapshot.is_fresh()
+    assert len(snapshot.products) == 30
+    assert [p["code"] for p in snapshot.list_products(limit=2, offset=1)] == ["PRODUCT_1", "PRODUCT_2"]
+    assert [p["id"] for p in snapshot.list_products(limit=2, after=29)] == [30]
+    assert snapshot.get_by_code("PRODUCT_4")["name"] == "Shirt 4"
+    assert snapshot.translations[5]["fr_FR"] == ("Chemise 4", "Coton")
+
+
+def test_snapshot_localizes_without_touching_the_database(db):
+    snapshot = CatalogSnapshot(max_staleness=60)
+    snapshot.load_full(db)
+    db.close()
+
+    default = snapshot.get_by_code("PRODUCT_4")
+    french = snapshot.get_by_code("PRODUCT_4", locale_chain("fr_BE,fr_FR"))
+    assert (french["name"], french["description"], french["locale"]) == ("Chemise 4", "Coton", "fr_FR")
+    assert {**french, "name": "Shirt 4", "description": "Cotton", "locale": "en_US"} == default
+    assert snapshot.get_by_code("PRODUCT_4", locale_chain("de_DE")) is default
+
+
+def test_snapshot_stock_filter_counts_only_available_products(db):
+    for i in range(30):
+        db.query(ProductVariant).filter_by(code=f"PRODUCT_{i}_S").update({"tracked": True, "on_hand": i % 3})
+    db.commit()
+    snapshot = CatalogSnapshot(max_staleness=60)
+    snapshot.load_full(db)
+
+    page = snapshot.list_products(limit=3, offset=2, min_available=2)
+    assert [p["code"] for p in page] == ["PRODUCT_8", "PRODUCT_11", "PRODUCT_14"]
+    assert [p["code"] for p in snapshot.list_products(limit=2, after=page[-1]["id"], min_available=1)] \
+        == ["PRODUCT_16", "PRODUCT_17"]
+    assert snapshot.get_many([1, 2, 3], min_available=1) == [snapshot.products[2], snapshot.products[3]]
+
+
+def test_snapshot_incremental_refresh(db):
+    snapshot = CatalogSnapshot(max_staleness=60)
+    snapshot.load_full(db)
+    events = []
+    snapshot.add_listener(lambda changed, removed: events.append((changed, removed)))
+
+    later = datetime.utcnow() + timedelta(minutes=1)
+    product = db.query(Product).filter(Product.code == "PRODUCT_2").one()
+    product.updated_at = later
+    db.query(ProductTranslation).filter(
+        ProductTranslation.product_id == product.id, ProductTranslation.locale == "en_US"
+    ).update({"name": "Polo 2"})
+    disabled = db.query(Product).filter(Product.code == "PRODUCT_5").one()
+    disabled.enabled = False
+    disabled.updated_at = later
+    db.commit()
+    product_id, disabled_id = product.id, disabled.id
+
+    changed, removed = snapshot.refresh(db)
+
+    assert changed == {product_id}
+    assert removed == {disabled_id}
+    assert events == [({product_id}, {disabled_id})]
+    assert snapshot.get_by_code("PRODUCT_2")["name"] == "Polo 2"
+    assert snapshot.get_by_code("PRODUCT_5") is None
+    assert len(snapshot.list_products(limit=100)) == 29
+
+
+def test_snapshot_staleness_bound(db):
+    snapshot = CatalogSnapshot(max_staleness=0)
+    assert not snapshot.is_fresh()
+    snapshot.load_full(db)
+    snapshot.refreshed_at -= 1
+    assert not snapshot.is_fresh()
+    assert snapshot.status()["staleness_seconds"] >= 1
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Tests des recommandations « fréquemment achetés ensemble »
+"""
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from co_purchase import CoPurchaseIndex
+from models import Order, OrderItem
+from tool_registry import ToolError
+
+START = datetime(2024, 1, 1)
+
+
+def add_order(db, order_id, product_ids, minutes, state="new"):
+    # Dans la fixture, le variant actif du produit p a l'id 2p - 1
+    completed_at = START + timedelta(minutes=minutes)
+    db.add(Order(id=order_id, number=f"{order_id:06d}", state=state, checkout_state="completed",
+                 checkout_completed_at=completed_at, updated_at=completed_at))
+    for pid in product_ids:
+        db.add(OrderItem(order_id=order_id, variant_id=2 * pid - 1, quantity=1))
+    db.commit()
+
+
+def test_co_occurrences_from_order_history(db):
+    add_order(db, 1, [1, 2, 3], 0)
+    add_order(db, 2, [1, 2], 1)
+    add_order(db, 3, [1, 3], 2)
+    add_order(db, 4, [1, 2], 3, state="cancelled")
+    db.add(Order(id=5, state="cart"))
+    db.add(OrderItem(order_id=5, variant_id=1))
+    db.commit()
+
+    index = CoPurchaseIndex(min_support=1)
+    index.build(db)
+
+    assert index.orders == 3
+    assert [(pid, together) for pid, _, together in index.related(1)] == [(2, 2), (3, 2)]
+    assert index.related(2, metric="cosine")[0][0] == 1
+    _, lift, _ = index.related(2, metric="lift")[0]
+    assert lift == pytest.approx(2 * 3 / (3 * 2))
+    assert index.related(999) == []
+    with pytest.raises(ValueError):
+        index.related(1, metric="jaccard")
+
+
+def test_refresh_adds_only_new_orders(db):
+    add_order(db, 1, [1, 2], 0)
+    index = CoPurchaseIndex(min_support=2)
+    index.build(db)
+    assert index.related(1) == []
+
+    add_order(db, 2, [1, 2], 5)
+    add_order(db, 3, [4, 30], 5)
+    assert index.refresh(db) == 2
+    assert index.refresh(db) == 0
+
+    assert [pid for pid, _, _ in index.related(1)] == [2]
+    assert [pid for pid, _, _ in index.related(4, k=1)] == []
+    assert index.matrix[30, 4] == 1
+    assert index.stats()["orders"] == 3
+
+
+def test_refresh_withdraws_cancelled_and_refunded_orders(db):
+    add_order(db, 1, [1, 2], 0)
+    add_order(db, 2, [1, 2], 1)
+    add_order(db, 3, [1, 2, 3], 2)
+    add_order(db, 4, [1, 3], 3, state="cancelled")
+    index = CoPurchaseIndex(min_support=1)
+    index.build(db)
+    assert index.orders == 3 and index.matrix[1, 2] == 3
+
+    def update(order_id, minutes, **values):
+        order = db.get(Order, order_id)
+        for name, value in values.items():
+            setattr(order, name, value)
+        order.updated_at = START + timedelta(minutes=minutes)
+        db.commit()
+
+    update(1, 10, state="cancelled")
+    update(3, 10, payment_state="refunded")
+    # Annulée avant la construction, jamais comptée : rien à retirer
+    update(4, 10, number="000004-B")
+    add_order(db, 5, [2, 3], 11, state="cancelled")
+    assert index.refresh(db) == 0
+    assert index.orders == 1 and index.stats()["last_dropped_orders"] == 2
+    assert [(pid, together) for pid, _, together in index.related(1)] == [(2, 1)]
+    assert index.related(3) == [] and index.matrix[3, 3] == 0
+
+    # Relues au même updated_at, les commandes retirées ne le sont pas deux fois
+    add_order(db, 6, [1, 2], 12)
+    assert index.refresh(db) == 1
+    assert index.orders == 2 and index.matrix[1, 2] == 2 and index.stats()["dropped_orders"] == 4
+
+
+def test_matrix_is_built_in_the_background_never_per_request(db, monkeypatch):
+    add_order(db, 1, [1, 2], 0)
+    add_order(db, 2, [1, 2], 1)
+    index = CoPurchaseIndex()
+    monkeypatch.setattr(server, "co_purchase", index)
+
+    @contextmanager
+    def session_scope():
+        yield db
+
+    async def fetch_products_by_ids(ids, locales=server.DEFAULT_LOCALES, fields=None, min_available=None):
+        return [{"id": pid} for pid in ids]
+
+    monkeypatch.setattr(server, "session_scope", session_scope)
+    monkeypatch.setattr(server, "fetch_products_by_ids", fetch_products_by_ids)
+    with pytest.raises(ToolError) as error:
+        asyncio.run(server.bought_together(1))
+    assert error.value.code == -32000 and not index.loaded
+
+    async def first_pass():
+        task = asyncio.create_task(server.refresh_co_purchase_forever())
+        while not index.loaded:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        return await server.bought_together(1)
+
+    assert asyncio.run(first_pass()) == [{"id": 2, "score": 1.0, "orders_together": 2}]
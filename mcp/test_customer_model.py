@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Tests des recommandations personnalisées (ALS implicite)
+"""
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+
+from customer_model import CustomerModel, load_interactions, save_model, train
+from models import Order, OrderItem
+
+
+def two_communities():
+    """Clients 0-9 achètent les produits 0-4, clients 10-19 les produits 5-9, sauf un chacun"""
+    rows, cols = [], []
+    for user in range(20):
+        group = 0 if user < 10 else 5
+        for item in range(group, group + 5):
+            if item != group + user % 5:
+                rows.append(user)
+                cols.append(item)
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(20, 10))
+
+
+def test_als_recommends_unpurchased_items_of_the_same_community(tmp_path):
+    interactions = two_communities()
+    user_factors, item_factors = train(interactions, factors=4, iterations=10, alpha=10, workers=2)
+    path = str(tmp_path / "als")
+    save_model(path, interactions, np.arange(100, 120), np.arange(1, 11), user_factors, item_factors, {"factors": 4})
+
+    model = CustomerModel(path)
+    assert model.load()
+    assert isinstance(model.arrays["item_factors"], np.memmap)
+
+    recommended, personalized = model.recommend(100, k=1)
+    assert personalized
+    assert recommended[0][0] == 1
+    assert [pid for pid, _ in model.recommend(117, k=1)[0]] == [8]
+    assert len(model.recommend(100, k=50)[0]) == 6
+
+    popular, personalized = model.recommend(999, k=3)
+    assert not personalized and len(popular) == 3
+
+
+def test_interactions_come_from_completed_orders(db):
+    db.add(Order(id=1, customer_id=7, state="new", checkout_state="completed", checkout_completed_at=datetime(2024, 1, 1)))
+    db.add(Order(id=2, customer_id=7, state="cancelled", checkout_state="completed", checkout_completed_at=datetime(2024, 1, 2)))
+    db.add(Order(id=3, customer_id=8, state="cart"))
+    db.add(Order(id=4, customer_id=9, state="fulfilled", payment_state="refunded", checkout_state="completed",
+                 checkout_completed_at=datetime(2024, 1, 3)))
+    db.add_all([OrderItem(order_id=1, variant_id=1, quantity=2), OrderItem(order_id=1, variant_id=3, quantity=1),
+                OrderItem(order_id=2, variant_id=5, quantity=1), OrderItem(order_id=3, variant_id=7, quantity=1),
+                OrderItem(order_id=4, variant_id=9, quantity=1)])
+    db.commit()
+
+    interactions, user_ids, item_ids = load_interactions(db)
+
+    assert list(user_ids) == [7]
+    assert list(item_ids) == [1, 2]
+    assert interactions.toarray().tolist() == [[2.0, 1.0]]
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Tests de l'export NDJSON du catalogue
+"""
+import json
+from datetime import datetime, timedelta
+
+from export import iter_export_chunks
+from models import Product
+from products import product_query, serialize_products
+
+
+def read_export(db, **kwargs):
+    body = b"".join(iter_export_chunks(db, **kwargs))
+    return [json.loads(line) for line in body.splitlines()]
+
+
+def test_export_matches_tool_serialization(db):
+    expected = serialize_products(product_query(db).order_by(Product.id).all(), "fr_FR")
+    db.expunge_all()
+
+    exported = read_export(db, locale="fr_FR", batch_size=7)
+
+    assert [{k: v for k, v in p.items() if k != "updated_at"} for p in exported] == expected
+    assert exported[0]["name"] == "Chemise 0"
+    assert [v["code"] for v in exported[0]["variants"]] == ["PRODUCT_0_S"]
+
+
+def test_export_filters(db):
+    later = datetime.utcnow() + timedelta(minutes=1)
+    db.query(Product).filter(Product.code == "PRODUCT_3").update({"updated_at": later})
+    db.query(Product).filter(Product.code == "PRODUCT_4").update({"enabled": False})
+    db.commit()
+
+    assert len(read_export(db)) == 29
+    assert len(read_export(db, enabled_only=False)) == 30
+    assert [p["code"] for p in read_export(db, updated_since=later)] == ["PRODUCT_3"]
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests de l'autocomplétion et de la recherche tolérante aux fautes
+"""
+import asyncio
+from contextlib import contextmanager
+
+import server
+from catalog import CatalogDocuments
+from fuzzy_index import ProductNameIndex, edit_distance
+from search_index import ProductSearchIndex
+
+DOCUMENTS = {
+    1: {"fr_FR": ("T-Shirt Rouge", "Coton"), "en_US": ("Red T-Shirt", "Cotton")},
+    2: {"fr_FR": ("Chaussures Noires", "Cuir")},
+    3: {"fr_FR": ("Chaussettes de sport", "Coton")},
+    4: {"fr_FR": ("Sac Marron", "Cuir")},
+}
+
+
+def build_index():
+    index = ProductNameIndex()
+    index.rebuild(DOCUMENTS.items())
+    return index
+
+
+def test_edit_distance_is_bounded():
+    assert edit_distance("chausure", "chaussure", 2) == 1
+    assert edit_distance("chemise", "pantalon", 2) == 3
+
+
+def test_prefix_completion():
+    index = build_index()
+
+    assert index.complete("t-shi") == [1]
+    assert index.complete("Chau") == [2, 3]
+    assert index.complete("rou") == [1]
+    assert index.complete("xyz") == []
+
+
+def test_typo_corrections_expand_the_query():
+    index = build_index()
+
+    assert index.corrections("chausure") == ["chaussures"]
+    assert index.expand_query("chausure noire") == "chausure chaussures noire noires"
+    assert index.corrections("sac") == ["sac"]
+
+
+def test_incremental_update():
+    index = build_index()
+    index.update([(4, {"fr_FR": ("Chapeau Vert", "")})], removed=[1])
+
+    assert index.complete("t-sh") == []
+    assert index.complete("chap") == [4]
+    assert index.corrections("marron") == []
+    assert len(index) == 3
+
+
+def test_fuzzy_search_and_completion_without_the_snapshot(db, monkeypatch):
+    @contextmanager
+    def session_scope():
+        yield db
+
+    documents = CatalogDocuments(max_staleness=60)
+    names, search = ProductNameIndex(), ProductSearchIndex()
+    names.attach(documents)
+    search.attach(documents)
+    monkeypatch.setattr(server, "session_scope", session_scope)
+    monkeypatch.setattr(server, "catalog_documents", documents)
+    monkeypatch.setattr(server, "name_index", names)
+    monkeypatch.setattr(server, "search_index", search)
+    monkeypatch.setattr(server.tool_cache, "enabled", False)
+
+    # Index pas encore chargé : recherche exacte, signalée à l'appelant
+    result = asyncio.run(server.registry.get("search_sylius_products").call({"query": "chemis 7", "fuzzy": True}))
+    assert result.data == [] and result.extra == {"fuzzy_applied": False}
+
+    documents.load_full(db)
+    result = asyncio.run(server.registry.get("search_sylius_products").call(
+        {"query": "chemis 7", "fuzzy": True, "limit": 1, "locale": "fr_FR"}))
+    assert result.extra == {"fuzzy_applied": True}
+    assert [(p["code"], p["name"]) for p in result.data] == [("PRODUCT_7", "Chemise 7")]
+    suggestions = asyncio.run(server.complete_products("chemise 1", limit=2, locales=("fr_FR",)))
+    assert suggestions == [{"id": 2, "code": "PRODUCT_1", "name": "Chemise 1"},
+                           {"id": 11, "code": "PRODUCT_10", "name": "Chemise 10"}]
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Tests de l'interface JSON-RPC /mcp (sans base de données)
+"""
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from tool_registry import ToolError, ToolRegistry
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def fake_fetch_product_by_code(code, locales=server.DEFAULT_LOCALES, fields=None):
+        await asyncio.sleep(0.2)
+        return {"id": 1, "code": code}
+
+    monkeypatch.setattr(server, "fetch_product_by_code", fake_fetch_product_by_code)
+    monkeypatch.setattr(server.tool_cache, "enabled", False)
+    with TestClient(server.app) as client:
+        yield client
+
+
+def call(request_id, name, arguments):
+    return {"jsonrpc": "2.0", "id": request_id, "method": "tools/call",
+            "params": {"name": name, "arguments": arguments}}
+
+
+def test_batch_returns_one_response_per_entry_in_order(client):
+    responses = client.post("/mcp", json=[
+        call(1, "hello_world", {"name": "Alice"}),
+        call(2, "get_sylius_product_by_code", {}),
+        {"jsonrpc": "2.0", "id": 3},
+        call(4, "unknown_tool", {}),
+    ]).json()
+
+    assert [r["id"] for r in responses] == [1, 2, 3, 4]
+    assert responses[0]["result"]["content"][0]["text"] == "Hello, Alice!"
+    assert responses[1]["error"]["code"] == -32602
+    assert responses[2]["error"]["code"] == -32600
+    assert responses[3]["error"]["code"] == -32601
+
+
+def test_string_and_null_ids_are_echoed_and_notifications_get_no_response(client):
+    assert client.post("/mcp", json=call("req-1", "hello_world", {})).json()["id"] == "req-1"
+    assert client.post("/mcp", json=call(None, "hello_world", {})).json()["id"] is None
+    assert client.post("/mcp", json={"jsonrpc": "2.0", "id": {"x": 1}}).json()["id"] is None
+
+    notification = {"jsonrpc": "2.0", "method": "notifications/initialized"}
+    response = client.post("/mcp", json=notification)
+    assert response.status_code == 204 and response.content == b""
+
+    responses = client.post("/mcp", json=[notification, call("a", "hello_world", {}), notification]).json()
+    assert [r["id"] for r in responses] == ["a"]
+    assert client.post("/mcp", json=[notification, {"jsonrpc": "2.0", "method": "tools/list"}]).status_code == 204
+
+
+def test_batch_entries_run_concurrently(client):
+    start = time.perf_counter()
+    responses = client.post("/mcp", json=[
+        call(i, "get_sylius_product_by_code", {"code": f"P{i}"}) for i in range(5)
+    ]).json()
+
+    assert time.perf_counter() - start < 0.6
+    assert [r["id"] for r in responses] == list(range(5))
+
+
+def test_empty_batch_is_invalid(client):
+    response = client.post("/mcp", json=[]).json()
+    assert response["error"]["code"] == -32600
+
+
+def test_single_request_still_supported(client):
+    response = client.post("/mcp", json=call(9, "hello_world", {})).json()
+    assert response == {"jsonrpc": "2.0", "id": 9, "result": {"content": [{"type": "text", "text": "Hello, World!"}]}}
+
+
+def test_tool_listings_come_from_the_registry(client):
+    listed = client.post("/mcp", json={"jsonrpc": "2.0", "id": 3, "method": "tools/list"}).json()
+    names = [tool["name"] for tool in listed["result"]["tools"]]
+    assert names == list(server.registry.tools)
+
+    response = client.get("/tools")
+    assert [tool["name"] for tool in response.json()["tools"]] == names
+    etag = response.headers["etag"]
+    assert client.get("/tools", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_falsy_required_arguments_are_accepted():
+    registry = ToolRegistry()
+
+    @registry.tool("count", "Echo", {"type": "object", "required": ["value", "flag"]})
+    def count(arguments):
+        return [arguments["value"], arguments["flag"]]
+
+    tool = registry.get("count")
+    assert asyncio.run(tool.call({"value": 0, "flag": False})).data == [0, False]
+    for arguments in ({"flag": False}, {"value": None, "flag": False}):
+        with pytest.raises(ToolError, match="'value' is required"):
+            asyncio.run(tool.call(arguments))
+
+
+def test_results_are_compact_unless_pretty_is_requested(client):
+    body = client.post("/tools/get_sylius_product_by_code", json={"arguments": {"code": "HAT"}}).content
+    assert body == b'{"result":{"id":1,"code":"HAT"}}'
+
+    response = client.post("/mcp?pretty=true", json=call(1, "get_sylius_product_by_code", {"code": "HAT"})).json()
+    assert response["result"]["content"][0]["text"] == '{\n  "id": 1,\n  "code": "HAT"\n}'
+
+
+def test_bulk_lookup_reports_missing_codes_on_both_transports(client, monkeypatch):
+    async def fake_fetch_products_by_codes(codes, locales=server.DEFAULT_LOCALES, min_available=None, fields=None):
+        return [{"id": i, "code": code} for i, code in enumerate(codes) if code.startswith("P")]
+
+    monkeypatch.setattr(server, "fetch_products_by_codes", fake_fetch_products_by_codes)
+    arguments = {"codes": ["P2", "X", "P1", "P2"]}
+
+    result = client.post("/mcp", json=call(1, "get_sylius_products_by_codes", arguments)).json()["result"]
+    assert result["missing"] == ["X"]
+    assert result["content"][0]["text"].startswith("2 of 3 products found (missing: X):")
+
+    body = client.post("/tools/get_sylius_products_by_codes", json={"arguments": arguments}).json()
+    assert [p["code"] for p in body["result"]] == ["P2", "P1"]
+    assert body["missing"] == ["X"]
+
+    too_many = {"codes": [f"P{i}" for i in range(server.MAX_CODES_PER_CALL + 1)]}
+    error = client.post("/mcp", json=call(2, "get_sylius_products_by_codes", too_many)).json()["error"]
+    assert error["code"] == -32602
+
+
+def test_locale_chains_are_validated_and_passed_to_fetchers(client, monkeypatch):
+    async def fake_fetch_products_by_codes(codes, locales=server.DEFAULT_LOCALES, min_available=None, fields=None):
+        return [{"id": 1, "code": codes[0], "locales": list(locales)}]
+
+    monkeypatch.setattr(server, "fetch_products_by_codes", fake_fetch_products_by_codes)
+
+    result = client.post("/tools/get_sylius_products_by_codes",
+                         json={"arguments": {"codes": ["P1"], "locale": "fr_BE, fr_FR"}}).json()["result"]
+    assert result[0]["locales"] == ["fr_BE", "fr_FR", "en_US"]
+
+    error = client.post("/mcp", json=call(2, "get_sylius_products_by_codes",
+                                          {"codes": ["P1"], "locale": "fr-FR;drop"})).json()["error"]
+    assert error["code"] == -32602 and "fr-FR;drop" in error["message"]
+
+
+def test_browse_arguments_are_validated_before_any_query(client, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise AssertionError("no query expected")
+
+    monkeypatch.setattr(server, "browse_products", fail)
+    for arguments, message in [
+        ({"sort": "relevance"}, "needs a query"),
+        ({"sort": "cheapest"}, "must be one of"),
+        ({"price_max": -1}, "price_max"),
+        ({"created_after": "last week"}, "created_after"),
+    ]:
+        error = client.post("/mcp", json=call(1, "browse_sylius_products", arguments)).json()["error"]
+        assert error["code"] == -32602 and message in error["message"]
+
+
+def test_similar_products_reject_more_neighbors_than_precomputed(client, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise AssertionError("no query expected")
+
+    monkeypatch.setattr(server, "similar_products", fail)
+    schema = server.registry.get("recommend_similar_products").input_schema["properties"]["k"]
+    assert schema["maximum"] == server.RECO_TOP_K
+    for k in (server.RECO_TOP_K + 1, 0, "5"):
+        error = client.post("/mcp", json=call(1, "recommend_similar_products", {"code": "HAT", "k": k})).json()["error"]
+        assert error["code"] == -32602 and "'k'" in error["message"]
+
+
+def test_bought_together_validates_k_before_any_query(client, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise AssertionError("no query expected")
+
+    monkeypatch.setattr(server, "fetch_product_by_code", fail)
+    for k in (0, -3, "5", True):
+        error = client.post("/mcp", json=call(1, "frequently_bought_together", {"code": "HAT", "k": k})).json()["error"]
+        assert error["code"] == -32602 and "'k'" in error["message"]
+
+
+def test_customer_recommendations_validate_their_arguments(client, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise AssertionError("no query expected")
+
+    monkeypatch.setattr(server, "recommend_customer_products", fail)
+    for arguments, name in [({"customer_id": 7, "k": -3}, "'k'"), ({"customer_id": 7, "k": "5"}, "'k'"),
+                            ({"customer_id": "7"}, "'customer_id'"), ({"customer_id": 1.5}, "'customer_id'")]:
+        error = client.post("/mcp", json=call(1, "recommend_for_customer", arguments)).json()["error"]
+        assert error["code"] == -32602 and name in error["message"]
+
+
+def test_precomputed_recommendations_reject_k_out_of_range(client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("no query expected")
+
+    monkeypatch.setattr(server, "get_precomputed_recommendations", fail)
+    for k in (-1, 0, server.RECO_TOP_K + 1, "5"):
+        error = client.post("/mcp", json=call(1, "get_precomputed_recommendations", {"code": "HAT", "k": k})).json()["error"]
+        assert error["code"] == -32602 and "'k'" in error["message"]
+
+
+def test_semantic_search_rejects_invalid_limits(client, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise AssertionError("no search expected")
+
+    monkeypatch.setattr(server, "semantic_search", fail)
+    for limit in (-2, 0, "10", 1.5):
+        error = client.post("/mcp", json=call(1, "semantic_search_sylius_products", {"query": "pull", "limit": limit})).json()["error"]
+        assert error["code"] == -32602 and "'limit'" in error["message"]
+
+
+def test_fields_are_validated_and_project_both_transports(client, monkeypatch):
+    async def fake_fetch_products_by_codes(codes, locales=server.DEFAULT_LOCALES, min_available=None, fields=None):
+        assert fields == server.parse_fields(["name", "variants.price"])
+        return [{"id": 1, "code": "P1", "name": "Shirt", "description": "Long text",
+                 "variants": [{"id": 3, "code": "P1_S", "price": 12.5, "tracked": False}]}]
+
+    monkeypatch.setattr(server, "fetch_products_by_codes", fake_fetch_products_by_codes)
+    arguments = {"codes": ["P1"], "fields": ["name", "variants.price"]}
+
+    body = client.post("/tools/get_sylius_products_by_codes", json={"arguments": arguments}).json()
+    assert body["result"] == [{"name": "Shirt", "variants": [{"price": 12.5}]}]
+    assert body["missing"] == []
+    text = client.post("/mcp", json=call(1, "get_sylius_products_by_codes", arguments)).json()["result"]["content"][0]["text"]
+    assert "Long text" not in text
+
+    error = client.post("/mcp", json=call(2, "get_sylius_products_by_codes",
+                                          {"codes": ["P1"], "fields": ["name", "weight"]})).json()["error"]
+    assert error["code"] == -32602 and "weight" in error["message"]
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Tests des métriques Prometheus des outils
+"""
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import exc
+
+import server
+from metrics import ToolMetrics
+from models import InstrumentedQueuePool
+
+
+def test_histograms_are_cumulative_and_errors_keyed_by_code():
+    metrics = ToolMetrics(enabled=True, latency_buckets=(0.1, 1.0), size_buckets=(100,))
+    for size, error in [(50, None), (500, None), (None, "-32602")]:
+        call = metrics.start("search", "mcp")
+        call.size, call.error = size, error
+        metrics.finish(call)
+    metrics.add_gauge("mcp_test_gauge", "Gauge read on scrape", lambda: 7)
+    metrics.add_gauge("mcp_test_missing", "Omitted when unknown", lambda: None)
+
+    text = metrics.render()
+    assert 'mcp_tool_requests_total{tool="search",transport="mcp"} 3' in text
+    assert 'mcp_tool_errors_total{tool="search",transport="mcp",code="-32602"} 1' in text
+    assert 'mcp_tool_in_flight{tool="search",transport="mcp"} 0' in text
+    assert 'mcp_tool_latency_seconds_bucket{tool="search",transport="mcp",le="+Inf"} 3' in text
+    assert 'mcp_tool_response_bytes_bucket{tool="search",transport="mcp",le="100.0"} 1' in text
+    assert 'mcp_tool_response_bytes_bucket{tool="search",transport="mcp",le="+Inf"} 2' in text
+    assert 'mcp_tool_response_bytes_sum{tool="search",transport="mcp"} 550.0' in text
+    assert "mcp_test_gauge 7" in text and "mcp_test_missing" not in text
+
+
+def test_metrics_endpoint_counts_both_transports(monkeypatch):
+    metrics = ToolMetrics(enabled=True)
+    metrics.gauges = server.tool_metrics.gauges
+    monkeypatch.setattr(server, "tool_metrics", metrics)
+    monkeypatch.setattr(server.tool_cache, "enabled", False)
+    with TestClient(server.app) as client:
+        client.post("/mcp", json={"jsonrpc": "2.0", "id": 1, "method": "tools/call",
+                                  "params": {"name": "hello_world", "arguments": {}}})
+        client.post("/tools/hello_world", json={"arguments": {}})
+        client.post("/tools/no_such_tool", json={"arguments": {}})
+        response = client.get("/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'mcp_tool_requests_total{tool="hello_world",transport="mcp"} 1' in text
+    assert 'mcp_tool_requests_total{tool="hello_world",transport="tools"} 1' in text
+    assert 'mcp_tool_errors_total{tool="unknown",transport="tools",code="-32601"} 1' in text
+    assert "mcp_db_executor_queued 0" in text
+
+
+def test_pool_counts_only_successful_checkouts():
+    pool = InstrumentedQueuePool(lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=0, timeout=0.01)
+    held = pool.connect()
+    # Pool saturé : une attente, terminée par un timeout
+    with pytest.raises(exc.TimeoutError):
+        pool.connect()
+    held.close()
+    assert (pool.checkouts, pool.timeouts, pool.waits) == (1, 1, 1)
+
+    def unreachable():
+        raise sqlite3.OperationalError("unreachable")
+
+    # Connexion impossible : ni checkout ni timeout
+    failing = InstrumentedQueuePool(unreachable, pool_size=1, max_overflow=0, timeout=0.01)
+    with pytest.raises(sqlite3.OperationalError):
+        failing.connect()
+    assert (failing.checkouts, failing.timeouts, failing.waits) == (0, 0, 0)
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+Tests de l'ajout des index MCP au schéma Sylius
+"""
+from sqlalchemy import inspect, text
+
+from migrate import migrate
+
+
+def test_missing_indexes_are_created_once(engine):
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX idx_mcp_variant_stock"))
+
+    assert migrate(engine, dry_run=True) == [
+        "CREATE INDEX idx_mcp_variant_stock ON sylius_product_variant (product_id, enabled, tracked, on_hand, on_hold)"]
+    assert "idx_mcp_variant_stock" not in {i["name"] for i in inspect(engine).get_indexes("sylius_product_variant")}
+
+    assert len(migrate(engine)) == 1
+    assert "idx_mcp_variant_stock" in {i["name"] for i in inspect(engine).get_indexes("sylius_product_variant")}
+    assert migrate(engine) == []
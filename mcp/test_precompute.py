@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Tests du précalcul des recommandations
+"""
+from datetime import datetime
+
+import numpy as np
+
+from customer_model import save_model
+from models import Order, OrderItem, PrecomputedRecommendation, PrecomputeRun, Product, ProductTranslation
+from precompute import get_precomputed, precompute_customers, precompute_similar
+from recommendations import SimilarProductIndex, load_documents
+from scipy import sparse
+
+
+COLORS = "rouge bleu vert noir blanc".split()
+ITEMS = "chemise pantalon veste robe jupe chapeau".split()
+
+
+def diversify(db):
+    """Noms variés : une couleur et un article par produit, sans traduction anglaise commune"""
+    db.query(ProductTranslation).filter_by(locale="en_US").delete()
+    for i in range(30):
+        db.query(ProductTranslation).filter_by(product_id=i + 1).update(
+            {"name": f"{ITEMS[i % 6]} {COLORS[i % 5]}", "description": f"{ITEMS[i % 6]} modèle {i}"})
+    db.commit()
+
+
+def rename(db, product_id, name):
+    db.query(ProductTranslation).filter_by(product_id=product_id, locale="fr_FR").update({"name": name})
+    db.query(Product).filter_by(id=product_id).update({"updated_at": datetime.utcnow()})
+    db.commit()
+
+
+def test_full_run_matches_the_in_memory_index(db):
+    stats = precompute_similar(db, top_n=5, workers=2, chunk_size=7)
+
+    assert stats == {"kind": "similar", "incremental": False, "subjects": 30}
+    index = SimilarProductIndex(top_k=5)
+    index.rebuild(load_documents(db))
+    items, computed_at = get_precomputed(db, "similar", code="PRODUCT_3")
+    assert [pid for pid, _ in items] == [pid for pid, _ in index.similar(4)]
+    assert get_precomputed(db, "similar", subject_id=4)[0] == items
+    assert get_precomputed(db, "similar", code="UNKNOWN") is None
+    assert db.get(PrecomputeRun, "similar").completed_at is not None
+
+
+def test_incremental_run_only_recomputes_affected_products(db):
+    diversify(db)
+    precompute_similar(db, top_n=3, workers=2)
+    rename(db, 5, "pantalon bleu")
+
+    stats = precompute_similar(db, top_n=3, workers=2)
+
+    assert stats["incremental"] and 0 < stats["subjects"] < 30
+    index = SimilarProductIndex(top_k=3)
+    index.rebuild(load_documents(db))
+    stored = {pid: [n for n, _ in get_precomputed(db, "similar", subject_id=pid)[0]] for pid in range(1, 31)}
+    assert stored[5] == [n for n, _ in index.similar(5)]
+    # Hors dérive de l'IDF (figée pour les listes non recalculées), le produit modifié est à jour partout
+    assert {pid for pid, items in stored.items() if 5 in items} == \
+        {pid for pid in range(1, 31) if 5 in [n for n, _ in index.similar(pid)]}
+
+    db.query(Product).filter_by(id=5).update({"enabled": False, "updated_at": datetime.utcnow()})
+    db.commit()
+    precompute_similar(db, top_n=3, workers=2)
+    assert get_precomputed(db, "similar", subject_id=5) is None
+    assert 5 not in [pid for pid, _ in get_precomputed(db, "similar", subject_id=8)[0]]
+
+
+def test_interrupted_run_resumes_after_the_last_written_subject(db):
+    precompute_similar(db, top_n=3, workers=1, chunk_size=10)
+    run = db.get(PrecomputeRun, "similar")
+    # Exécution complète arrêtée après le premier bloc
+    run.since, run.completed_at, run.last_subject_id, run.subjects = None, None, 10, 10
+    db.query(PrecomputedRecommendation).filter(PrecomputedRecommendation.subject_id > 10).delete()
+    db.commit()
+
+    stats = precompute_similar(db, top_n=3, workers=1, chunk_size=10)
+
+    assert stats == {"kind": "similar", "incremental": False, "subjects": 30}
+    assert db.query(PrecomputedRecommendation).filter_by(kind="similar").count() == 30
+
+
+def test_customer_lists_exclude_purchases_made_after_training(db, tmp_path):
+    path = str(tmp_path / "als")
+    interactions = sparse.csr_matrix(np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float32))
+    factors = np.eye(3, dtype=np.float32)
+    user_factors = np.array([[1.0, 0.5, 0.2], [0.1, 1.0, 0.2]], dtype=np.float32)
+    save_model(path, interactions, np.array([7, 8]), np.array([1, 2, 3]), user_factors, factors,
+               {"trained_at": datetime(2024, 1, 1).timestamp()})
+    precompute_customers(db, top_n=2, workers=1, model_path=path)
+    assert [pid for pid, _ in get_precomputed(db, "customer", subject_id=7)[0]] == [2, 3]
+
+    db.add(Order(id=1, customer_id=7, state="new", checkout_completed_at=datetime.utcnow()))
+    db.add(OrderItem(order_id=1, variant_id=3, quantity=1))
+    # Remboursée : ne compte pas comme un achat, le produit 3 reste recommandé
+    db.add(Order(id=2, customer_id=7, state="fulfilled", payment_state="refunded", checkout_completed_at=datetime.utcnow()))
+    db.add(OrderItem(order_id=2, variant_id=5, quantity=1))
+    db.commit()
+    stats = precompute_customers(db, top_n=2, workers=1, model_path=path)
+
+    assert stats == {"kind": "customer", "incremental": True, "subjects": 1}
+    assert [pid for pid, _ in get_precomputed(db, "customer", subject_id=7)[0]] == [3]
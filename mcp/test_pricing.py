@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests des prix par canal (cache en mémoire)
+"""
+import pytest
+
+from catalog import CatalogSnapshot
+from conftest import count_queries
+from models import ChannelPricing, ProductVariant
+from pricing import PriceCache, price_cache
+from server import get_sylius_products
+
+
+@pytest.fixture
+def prices(db, monkeypatch):
+    for variant in db.query(ProductVariant).filter(ProductVariant.enabled == True):
+        db.add(ChannelPricing(product_variant_id=variant.id, channel_code="WEB", price=1000 + variant.id))
+        db.add(ChannelPricing(product_variant_id=variant.id, channel_code="B2B", price=500, original_price=900))
+    db.commit()
+    cache = PriceCache(channel="WEB")
+    monkeypatch.setattr(price_cache, "channel", "WEB")
+    monkeypatch.setattr(price_cache, "prices", {})
+    monkeypatch.setattr(price_cache, "loaded_at", None)
+    monkeypatch.setattr(price_cache, "signature", None)
+    return cache
+
+
+def test_products_carry_channel_prices_without_extra_queries(engine, db, prices):
+    price_cache.load(db)
+    db.expunge_all()
+    with count_queries(engine) as statements:
+        products = get_sylius_products(limit=30, db=db)
+    assert len(statements) == 3
+    variant = products[0]["variants"][0]
+    assert variant["price"] == (1000 + variant["id"]) / 100
+    assert variant["original_price"] is None
+    assert price_cache.get(variant["id"], "B2B") == (500, 900)
+    assert price_cache.get(9999) == (None, None)
+
+
+def test_refresh_reloads_only_when_the_table_changes(engine, db, prices):
+    assert prices.refresh(db) == set()
+    with count_queries(engine) as statements:
+        assert prices.refresh(db) == set()
+    assert len(statements) == 1
+
+    pricing = db.query(ChannelPricing).filter_by(channel_code="B2B").first()
+    pricing.original_price = None
+    db.commit()
+    assert prices.refresh(db) == {pricing.product_variant_id}
+    assert prices.get(pricing.product_variant_id, "B2B") == (500, None)
+
+
+def test_stale_products_are_reserialized_on_the_next_refresh(db, prices):
+    price_cache.load(db)
+    snapshot = CatalogSnapshot()
+    snapshot.load_full(db)
+    changes = []
+    snapshot.add_listener(lambda changed, removed: changes.append(changed))
+
+    variant = db.query(ProductVariant).filter_by(code="PRODUCT_4_S").one()
+    db.query(ChannelPricing).filter_by(product_variant_id=variant.id, channel_code="WEB").update({"price": 4200})
+    db.commit()
+    assert price_cache.refresh(db) == {variant.id}
+    snapshot.mark_stale([variant.product_id])
+    snapshot.refresh(db)
+
+    assert changes == [{variant.product_id}]
+    assert snapshot.get_by_code("PRODUCT_4")["variants"][0]["price"] == 42.0
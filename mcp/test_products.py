@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Tests du chargement groupé des produits (base SQLite en mémoire)
+"""
+import pytest
+
+from conftest import count_queries
+from test_export import read_export
+from models import Product, ProductTranslation, ProductVariant
+from products import decode_cursor, locale_chain, next_cursor, parse_fields, product_query, project
+from server import (get_stock_levels, get_sylius_products, get_sylius_product_by_code, get_sylius_products_by_codes,
+                    search_sylius_products)
+
+
+def test_product_listing_query_count_is_constant(engine, db):
+    counts = []
+    for limit in (1, 10, 30):
+        db.expunge_all()
+        with count_queries(engine) as statements:
+            products = get_sylius_products(limit=limit, db=db)
+        assert len(products) == limit
+        counts.append(len(statements))
+    assert counts[0] == counts[1] == counts[2] == 3
+
+
+def test_search_query_count_is_constant(engine, db):
+    counts = []
+    for limit in (1, 20):
+        db.expunge_all()
+        with count_queries(engine) as statements:
+            products = search_sylius_products(query="Shirt", limit=limit, db=db)
+        assert len(products) == limit
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
+
+
+def test_product_serialization(engine, db):
+    db.expunge_all()
+    with count_queries(engine) as statements:
+        product = get_sylius_product_by_code(code="PRODUCT_3", db=db)
+    assert len(statements) == 3
+    assert product["name"] == "Shirt 3"
+    assert product["description"] == "Cotton"
+    assert [v["code"] for v in product["variants"]] == ["PRODUCT_3_S"]
+
+
+def test_bulk_lookup_uses_one_query_and_keeps_input_order(engine, db):
+    db.expunge_all()
+    codes = ["PRODUCT_12", "MISSING", "PRODUCT_3"] + [f"PRODUCT_{i}" for i in range(20, 30)]
+    with count_queries(engine) as statements:
+        products = get_sylius_products_by_codes(codes=codes, db=db)
+    assert len(statements) == 3
+    assert [p["code"] for p in products] == [code for code in codes if code != "MISSING"]
+    assert products[0]["variants"][0]["code"] == "PRODUCT_12_S"
+
+
+def test_only_translations_of_the_locale_chain_are_loaded(engine, db):
+    db.query(ProductTranslation).filter_by(product_id=4, locale="en_US").delete()
+    db.commit()
+    db.expunge_all()
+    with count_queries(engine) as statements:
+        products = get_sylius_products_by_codes(codes=["PRODUCT_2", "PRODUCT_3"], db=db,
+                                                locales=locale_chain("de_DE,fr_FR"))
+    assert len(statements) == 3
+    assert any("locale IN" in statement.replace("\n", " ") for statement in statements)
+    assert [(p["name"], p["locale"]) for p in products] == [("Chemise 2", "fr_FR"), ("Chemise 3", "fr_FR")]
+
+    # Aucune locale de la chaîne : en_US en repli, puis une traduction quelconque
+    product = get_sylius_product_by_code(code="PRODUCT_3", db=db, locales=locale_chain("de_DE"))
+    assert (product["name"], product["locale"]) == ("Chemise 3", "fr_FR")
+    assert get_sylius_product_by_code(code="PRODUCT_2", db=db, locales=locale_chain("de_DE"))["name"] == "Shirt 2"
+
+
+def test_product_with_only_a_french_translation_keeps_its_name(engine, db):
+    """Réglages par défaut (chaîne en_US) : la traduction fr_FR sert de dernier repli"""
+    db.query(ProductTranslation).filter_by(product_id=6, locale="en_US").delete()
+    db.commit()
+    db.expunge_all()
+    with count_queries(engine) as statements:
+        products = get_sylius_products_by_codes(codes=["PRODUCT_4", "PRODUCT_5"], db=db)
+    assert len(statements) == 3
+    assert [(p["name"], p["description"], p["locale"]) for p in products] == [
+        ("Shirt 4", "Cotton", "en_US"), ("Chemise 5", "Coton", "fr_FR")]
+    # Les traductions hors chaîne ne sont chargées que pour le produit sans traduction en_US
+    db.expunge_all()
+    loaded = product_query(db, locales=["en_US"]).filter(Product.id.in_([5, 6])).order_by(Product.id).all()
+    assert [[t.locale for t in p.translations] for p in loaded] == [["en_US"], ["fr_FR"]]
+    product = loaded[1]
+    assert product.get_name() == "Chemise 5" and product.get_description("en_US") == "Coton"
+    assert read_export(db, locale="en_US")[5]["name"] == "Chemise 5"
+
+
+def test_field_projection_narrows_loading_and_output(engine, db):
+    db.expunge_all()
+    with count_queries(engine) as statements:
+        products = get_sylius_products(limit=3, fields=parse_fields(["code"]), db=db)
+    # Ni traductions ni variants : une seule requête ; id et code restent pour les curseurs et le cache
+    assert len(statements) == 1
+    assert products[0] == {"id": 1, "code": "PRODUCT_0"}
+
+    db.expunge_all()
+    fields = parse_fields(["code", "name", "variants.price"])
+    with count_queries(engine) as statements:
+        products = get_sylius_products_by_codes(codes=["PRODUCT_3"], fields=fields, db=db)
+    assert len(statements) == 3
+    assert "description" not in statements[1]
+    assert project(products[0], fields) == {"code": "PRODUCT_3", "name": "Shirt 3", "variants": [{"price": None}]}
+
+
+def test_unknown_fields_are_rejected():
+    assert parse_fields(["variants", "name"]) == parse_fields(["name", "variants.id", "variants.code", "variants.price",
+        "variants.original_price", "variants.on_hand", "variants.available", "variants.tracked"])
+    with pytest.raises(ValueError):
+        parse_fields(["variants.weight"])
+
+
+def test_locale_chain_rejects_malformed_locales():
+    assert locale_chain() == ("en_US",)
+    assert locale_chain("fr_BE, fr_FR,en_US") == ("fr_BE", "fr_FR", "en_US")
+    with pytest.raises(ValueError):
+        locale_chain("fr_FR') OR 1=1")
+
+
+def track_stock(db):
+    """Variants suivis : PRODUCT_i_S a i exemplaires dont 1 réservé, PRODUCT_1 reste non suivi"""
+    for i in range(30):
+        db.query(ProductVariant).filter_by(code=f"PRODUCT_{i}_S").update(
+            {"tracked": i != 1, "on_hand": i, "on_hold": 1})
+    db.commit()
+    db.expunge_all()
+
+
+def test_stock_filter_is_evaluated_in_sql(engine, db):
+    track_stock(db)
+    with count_queries(engine) as statements:
+        products = get_sylius_products(limit=5, min_available=3, db=db)
+    assert len(statements) == 3
+    assert "EXISTS" in statements[0]
+    # PRODUCT_1 n'est pas suivi : toujours disponible ; PRODUCT_0, 2 et 3 ont moins de 3 exemplaires libres
+    assert [p["code"] for p in products] == ["PRODUCT_1", "PRODUCT_4", "PRODUCT_5", "PRODUCT_6", "PRODUCT_7"]
+    assert products[1]["variants"][0]["available"] == 3
+
+    found = search_sylius_products(query="Shirt", limit=3, min_available=1, db=db)
+    assert [p["code"] for p in found] == ["PRODUCT_1", "PRODUCT_2", "PRODUCT_3"]
+    assert [p["code"] for p in get_sylius_products_by_codes(codes=["PRODUCT_0", "PRODUCT_9"], min_available=1, db=db)] \
+        == ["PRODUCT_9"]
+
+
+def test_stock_levels_read_only_the_variant_table(engine, db):
+    track_stock(db)
+    with count_queries(engine) as statements:
+        levels = get_stock_levels(codes=["PRODUCT_4_S", "PRODUCT_1_S", "PRODUCT_0_OFF", "MISSING"], db=db)
+    assert len(statements) == 1 and "sylius_product " not in statements[0]
+    assert [(l["code"], l["available"], l["in_stock"]) for l in levels] == [
+        ("PRODUCT_4_S", 3, True), ("PRODUCT_1_S", None, True), ("PRODUCT_0_OFF", None, False)]
+
+
+def test_cursor_pagination_walks_the_catalog_once(db):
+    seen, after = [], None
+    while True:
+        page = get_sylius_products(limit=7, after=after, db=db)
+        seen.extend(p["code"] for p in page)
+        cursor = next_cursor(page, 7)
+        if cursor is None:
+            break
+        after = decode_cursor(cursor)
+    assert seen == [f"PRODUCT_{i}" for i in range(30)]
+
+
+def test_invalid_cursor_is_rejected():
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Tests des recommandations de produits similaires
+"""
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from catalog import CatalogDocuments, CatalogSnapshot
+from models import Product, ProductTranslation
+from recommendations import SimilarProductIndex
+
+DOCUMENTS = {
+    1: {"fr_FR": ("Sac en cuir marron", "Sac à main en cuir véritable")},
+    2: {"fr_FR": ("Ceinture en cuir", "Ceinture en cuir véritable marron")},
+    3: {"fr_FR": ("Chapeau de paille", "Chapeau d'été")},
+    4: {"fr_FR": ("Chapeau en laine", "Chapeau d'hiver chaud")},
+    5: {"fr_FR": ("Sac en toile", "Sac de plage")},
+}
+
+
+def build_index(documents, top_k=3):
+    index = SimilarProductIndex(top_k=top_k)
+    index.rebuild(documents.items())
+    return index
+
+
+def test_similar_products_share_vocabulary():
+    index = build_index(DOCUMENTS)
+
+    assert [pid for pid, _ in index.similar(1)][:2] == [2, 5]
+    assert [pid for pid, _ in index.similar(3)][0] == 4
+    scores = [score for _, score in index.similar(1)]
+    assert scores == sorted(scores, reverse=True) and 0 < scores[0] <= 1
+    assert index.similar(42) == []
+    assert index.stats()["products"] == 5
+
+
+def test_incremental_update_matches_rebuild_with_same_idf():
+    words = "chemise pantalon sac cuir coton laine rouge bleu vert noir".split()
+    rng = random.Random(7)
+    documents = {
+        pid: {"fr_FR": (" ".join(rng.sample(words, 2)), " ".join(rng.sample(words, 3)))}
+        for pid in range(1, 200)
+    }
+    index = build_index(documents, top_k=5)
+
+    documents[10] = {"fr_FR": ("cuir rouge", "cuir")}
+    documents[11] = {"fr_FR": ("laine verte", "bleu")}
+    del documents[12]
+    index.update([(10, documents[10]), (11, documents[11])], removed=[12])
+
+    # Référence : mêmes vecteurs (même IDF), voisins calculés pour tous les produits
+    expected = index._top_k(index.matrix, np.asarray(index.ids), range(len(index.ids)))
+    assert 12 not in index.neighbors
+    for pid, (_, scores) in expected.items():
+        assert list(index.neighbors[pid][1]) == list(scores), pid
+
+
+def test_index_follows_the_snapshot(db):
+    snapshot = CatalogSnapshot(max_staleness=60)
+    index = SimilarProductIndex(top_k=5)
+    index.attach(snapshot)
+    snapshot.load_full(db)
+
+    assert len(index) == 30
+    assert len(index.similar(1, k=3)) == 3
+
+
+def test_index_follows_the_translations_without_the_snapshot(db):
+    documents = CatalogDocuments(max_staleness=60)
+    index = SimilarProductIndex(top_k=5)
+    index.attach(documents)
+    documents.load_full(db)
+    assert len(index) == 30 and index.similar(1, k=1)[0][0] != 7
+
+    # Le watermark updated_at du produit déclenche la mise à jour incrémentale
+    later = datetime.utcnow() + timedelta(minutes=1)
+    db.query(ProductTranslation).filter_by(product_id=1).update({"name": "Chapeau de paille", "description": "Paille"})
+    db.query(ProductTranslation).filter_by(product_id=7).update({"name": "Chapeau de paille", "description": "Paille"})
+    db.query(Product).filter(Product.id.in_([1, 7])).update({"updated_at": later})
+    db.query(Product).filter_by(id=2).update({"enabled": False, "updated_at": later})
+    db.commit()
+    assert documents.refresh(db) == ({1, 7}, {2})
+
+    assert index.similar(1, k=1)[0][0] == 7
+    assert len(index) == 29 and index.similar(2) == [] and 2 not in dict(index.similar(3, k=5))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Tests de l'index de recherche BM25
+"""
+import asyncio
+import math
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import server
+from catalog import CatalogDocuments, CatalogSnapshot
+from conftest import count_queries
+from models import Product, ProductTranslation
+from search_index import K1, ProductSearchIndex, fold, tokenize
+
+
+def build_index(documents):
+    index = ProductSearchIndex()
+    index.rebuild(documents.items())
+    return index
+
+
+def test_tokenize_folds_accents_and_stopwords():
+    assert fold("Écharpe Légère") == "echarpe legere"
+    assert tokenize("Chaussures de randonnée, T-Shirt") == ["chaussures", "randonnee", "t", "shirt"]
+
+
+def test_bm25_ranks_name_matches_first_and_deduplicates_products():
+    index = build_index({
+        1: {"fr_FR": ("Sac en cuir", "Sac marron"), "en_US": ("Leather bag", "Brown bag")},
+        2: {"fr_FR": ("Ceinture", "Ceinture en cuir véritable")},
+        3: {"fr_FR": ("Chapeau vert", "Chapeau de paille")},
+    })
+
+    results = index.search("cuir", limit=10)
+
+    assert [pid for pid, _ in results] == [1, 2]
+    assert [pid for pid, _ in index.search("CUÍR sac", limit=10)] == [1, 2]
+    assert index.search("inconnu") == []
+
+
+def test_incremental_updates_follow_the_snapshot(db):
+    snapshot = CatalogSnapshot(max_staleness=60)
+    index = ProductSearchIndex()
+    index.attach(snapshot)
+    snapshot.load_full(db)
+    assert len(index) == 30
+
+    index.update([(1, {"fr_FR": ("Écharpe en laine", "")})], removed=[2])
+
+    assert [pid for pid, _ in index.search("echarpe")] == [1]
+    assert 2 not in dict(index.search("chemise", limit=100))
+    assert len(index) == 29
+
+
+def test_search_is_ranked_without_the_snapshot(engine, db, monkeypatch):
+    @contextmanager
+    def session_scope():
+        yield db
+
+    documents = CatalogDocuments(max_staleness=60)
+    index = ProductSearchIndex()
+    index.attach(documents)
+    monkeypatch.setattr(server, "session_scope", session_scope)
+    monkeypatch.setattr(server, "catalog_documents", documents)
+    monkeypatch.setattr(server, "search_index", index)
+    # Hors mémoire, une sous-chaîne : aucun produit ne contient "3 cotton"
+    assert asyncio.run(server.find_products("3 cotton")) == ([], False)
+
+    documents.load_full(db)
+    assert len(index) == 30 and not server.catalog.loaded
+    with count_queries(engine) as statements:
+        products, indexed = asyncio.run(server.find_products("cotton 3", limit=2))
+    # Classement BM25 en mémoire, produits lus en une requête (plus traductions et variants)
+    assert len(statements) == 3
+    assert indexed and [p["code"] for p in products][0] == "PRODUCT_3" and len(products) == 2
+
+    # Le watermark updated_at suit les renommages et les désactivations
+    later = datetime.utcnow() + timedelta(minutes=1)
+    db.query(ProductTranslation).filter_by(product_id=4, locale="en_US").update({"name": "Scarf 3"})
+    db.query(Product).filter_by(id=4).update({"updated_at": later})
+    db.query(Product).filter_by(id=5).update({"enabled": False, "updated_at": later})
+    db.commit()
+    assert documents.refresh(db) == ({4}, {5})
+    assert [p["code"] for p in asyncio.run(server.find_products("scarf"))[0]] == ["PRODUCT_3"]
+    assert 5 not in dict(index.search("shirt", limit=100))
+
+
+def test_threshold_search_matches_exhaustive_scoring():
+    words = "chemise pantalon sac cuir coton laine rouge bleu vert noir".split()
+    documents = {
+        pid: {"fr_FR": (" ".join(words[(pid * k) % len(words)] for k in (1, 3)),
+                        " ".join(words[(pid + k) % len(words)] for k in range(pid % 7)))}
+        for pid in range(1, 400)
+    }
+    index = build_index(documents)
+    index.update([(7, {"fr_FR": ("cuir rouge cuir", "")})], removed=[8])
+
+    for query in ("cuir rouge", "sac laine noir", "bleu"):
+        exhaustive = {}
+        for term in set(tokenize(query)):
+            bucket = index.postings.get(term, {})
+            idf = math.log(1 + (len(index) - len(bucket) + 0.5) / (len(bucket) + 0.5))
+            for pid, tf in bucket.items():
+                exhaustive[pid] = exhaustive.get(pid, 0.0) + idf * tf * (K1 + 1) / (tf + index._norms[pid])
+        expected = sorted(exhaustive.items(), key=lambda item: (-item[1], item[0]))[:10]
+        assert [pid for pid, _ in index.search(query, limit=10)] == [pid for pid, _ in expected]
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests de la recherche sémantique (plongements LSA, index IVF)
+"""
+import asyncio
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import server
+from catalog import CatalogDocuments
+from model_store import file_lock
+from models import Product
+from semantic_index import SemanticIndex, build_index
+from tool_registry import ToolError
+
+WINTER = ["laine", "hiver", "chaud", "neige", "polaire"]
+SUMMER = ["lin", "ete", "plage", "soleil", "leger"]
+
+
+def catalog(size=400, seed=3):
+    rng = random.Random(seed)
+    documents = []
+    for pid in range(1, size + 1):
+        words = WINTER if pid % 2 else SUMMER
+        noise = [f"mot{rng.randint(0, 300)}" for _ in range(3)]
+        documents.append((pid, {"fr_FR": (f"Article {' '.join(rng.sample(words, 2))}",
+                                          " ".join(rng.sample(words, 3) + noise))}))
+    return documents
+
+
+def test_semantic_search_finds_related_products(tmp_path):
+    path = str(tmp_path / "semantic")
+    build_index(catalog(), path)
+    index = SemanticIndex(path, nprobe=4)
+    assert index.load()
+    assert isinstance(index.arrays["vectors"], np.memmap)
+
+    # "neige" seul : les produits d'hiver sans ce mot sont aussi trouvés
+    results = index.search("neige", limit=20, exact=True)
+    assert all(pid % 2 == 1 for pid, _ in results)
+    assert index.search("", limit=5) == []
+    assert index.stats()["products"] == 400
+
+
+def test_ivf_matches_exact_search_when_probing_every_list(tmp_path):
+    path = str(tmp_path / "semantic")
+    meta = build_index(catalog(), path)
+    index = SemanticIndex(path)
+    index.load()
+
+    for query in ("laine chaude", "plage soleil", "mot12"):
+        exact = index.search(query, limit=10, exact=True)
+        probed = index.search(query, limit=10, nprobe=meta["lists"])
+        assert [pid for pid, _ in probed] == [pid for pid, _ in exact]
+        assert [score for _, score in probed] == pytest.approx([score for _, score in exact], abs=1e-5)
+
+
+def test_index_is_built_from_the_catalog_and_outdated_by_changes(db, tmp_path, monkeypatch):
+    index = SemanticIndex(str(tmp_path / "semantic"))
+    monkeypatch.setattr(server, "semantic_index", index)
+    # Jamais construit à la requête : erreur explicite tant que la tâche de fond n'a pas fini
+    with pytest.raises(ToolError) as error:
+        asyncio.run(server.semantic_search("chemise"))
+    assert error.value.code == -32000
+
+    documents = CatalogDocuments(max_staleness=60)
+    documents.load_full(db)
+    assert index.is_outdated(documents.product_watermark)
+    server.build_semantic_index(documents)
+    assert index.load() and not index.is_outdated(documents.product_watermark)
+    assert index.stats()["products"] == 30
+
+    db.query(Product).filter_by(id=3).update({"updated_at": datetime.utcnow() + timedelta(minutes=1)})
+    db.commit()
+    documents.refresh(db)
+    assert index.is_outdated(documents.product_watermark)
+
+
+def test_concurrent_writers_swap_whole_indexes(db, tmp_path, monkeypatch):
+    path = str(tmp_path / "semantic")
+    # Plusieurs workers écrivent le même index : chacun dans son propre répertoire temporaire
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda size: build_index(catalog(size), path), [40, 60, 80, 100]))
+    index = SemanticIndex(path)
+    assert index.load() and index.stats()["products"] in (40, 60, 80, 100)
+    assert sorted(os.listdir(tmp_path)) == ["semantic", "semantic.lock"]
+
+    # Un seul worker construit à la fois : les autres reprennent son index
+    index = SemanticIndex(path)
+    monkeypatch.setattr(server, "semantic_index", index)
+    documents = CatalogDocuments(max_staleness=60)
+    documents.load_full(db)
+    with file_lock(f"{path}.build.lock"):
+        assert server.build_semantic_index(documents) is False
+    assert server.build_semantic_index(documents) is True
+    assert server.build_semantic_index(documents) is False
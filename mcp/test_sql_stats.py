@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests de l'instrumentation SQL (comptage par appel, requêtes lentes, réglage à chaud)
+"""
+from contextlib import contextmanager
+
+import pytest
+from fastapi.testclient import TestClient
+
+import models
+import server
+from sql_stats import SqlInstrumentation, parameter_shape
+from server import get_sylius_products
+
+
+def test_statements_are_attributed_to_the_tracked_call(engine, db):
+    sql = SqlInstrumentation(enabled=True, slow_ms=0, sample_rate=1)
+    sql.attach(engine)
+    db.expunge_all()
+    with sql.track("get_sylius_products") as stats:
+        get_sylius_products(limit=5, db=db)
+    assert stats.queries == 3 and stats.seconds > 0
+    slow = sql.status()["slow_queries"]
+    assert len(slow) == 3 and slow[0]["tool"] == "get_sylius_products"
+    assert "Shirt" not in str(slow[0]["parameters"])
+
+    # Hors debug, les écouteurs sont retirés : plus rien n'est compté
+    sql.configure(enabled=False)
+    db.expunge_all()
+    with sql.track("get_sylius_products") as stats:
+        get_sylius_products(limit=5, db=db)
+    assert stats.queries == 0 and sql.status()["slow_total"] == 3
+
+
+def test_slow_query_log_runs_without_debug_mode(engine, db):
+    # SLOW_QUERY_MS défini en production : journal actif, sans détail par appel
+    sql = SqlInstrumentation(enabled=False, slow_ms=0, sample_rate=1, slow_log=True)
+    sql.attach(engine)
+    db.expunge_all()
+    with sql.track("get_sylius_products") as stats:
+        get_sylius_products(limit=5, db=db)
+    assert stats.queries == 0
+    status = sql.status()
+    assert status["slow_total"] == 3 and status["slow_log"] and not status["enabled"]
+    assert status["slow_queries"][0]["tool"] == "get_sylius_products"
+
+    sql.configure(slow_log=False)
+    get_sylius_products(limit=5, db=db)
+    assert sql.status()["slow_total"] == 3
+
+
+def test_parameter_shape_hides_values():
+    assert parameter_shape((1, 2, 3, "secret", None)) == ["int x3", "str", "null"]
+    assert parameter_shape({"code_1": "PRODUCT_1", "limit": 10}) == {"code_1": "str", "limit": "int"}
+    assert parameter_shape([(1, "a"), (2, "b")]) == {"rows": 2, "row": ["int", "str"]}
+    with pytest.raises(ValueError):
+        SqlInstrumentation().configure(sample_rate=2)
+
+
+@pytest.fixture
+def debug_client(engine, db, monkeypatch):
+    @contextmanager
+    def session_scope():
+        yield db
+
+    monkeypatch.setattr(server, "session_scope", session_scope)
+    monkeypatch.setattr(server.tool_cache, "enabled", False)
+    monkeypatch.setattr(server.sql_instrumentation, "engine", engine)
+    monkeypatch.setattr(server, "DEBUG_TOKEN", "secret")
+    # Les traductions sont chargées depuis SQLite au démarrage : pas d'index sémantique écrit hors du test
+    monkeypatch.setattr(server, "SEMANTIC_REBUILD_INTERVAL", 0)
+    with TestClient(server.app, headers={"X-Debug-Token": "secret"}) as client:
+        yield client
+    server.sql_instrumentation.configure(enabled=False)
+    server.sql_instrumentation.engine = models.engine
+
+
+def test_debug_mode_reports_queries_on_both_transports(debug_client, db):
+    response = debug_client.post("/tools/get_sylius_products", json={"arguments": {"limit": 3}})
+    assert "X-DB-Queries" not in response.headers
+
+    assert debug_client.post("/debug/sql", json={"enabled": True, "slow_ms": 10000}).json()["enabled"] is True
+    db.expunge_all()
+    response = debug_client.post("/tools/get_sylius_products", json={"arguments": {"limit": 3}})
+    # Requêtes exécutées dans le thread de run_db, attribuées à l'appel
+    assert response.headers["X-DB-Queries"] == "3"
+    assert len(response.json()["result"]) == 3
+
+    result = debug_client.post("/mcp", json={"jsonrpc": "2.0", "id": 1, "method": "tools/call",
+                                             "params": {"name": "hello_world", "arguments": {}}}).json()["result"]
+    assert result["_meta"] == {"db": {"queries": 0, "time_ms": 0.0}}
+    assert debug_client.post("/debug/sql", json={"sample_rate": -1}).status_code == 400
+
+
+def test_debug_routes_need_the_token(debug_client, monkeypatch):
+    assert debug_client.get("/debug/sql").status_code == 200
+    assert debug_client.get("/debug/sql", headers={"X-Debug-Token": "wrong"}).status_code == 403
+    assert debug_client.post("/debug/sql", json={"enabled": True}, headers={"X-Debug-Token": ""}).status_code == 403
+    assert server.sql_instrumentation.enabled is False
+    # Vider le cache des outils demande le même jeton
+    assert debug_client.post("/cache/invalidate", json={}, headers={"X-Debug-Token": "wrong"}).status_code == 403
+    assert debug_client.post("/cache/invalidate", json={}).json() == {"invalidated": "all"}
+    monkeypatch.setattr(server, "DEBUG_TOKEN", None)
+    assert debug_client.get("/debug/sql").status_code == 404
+    assert debug_client.post("/cache/invalidate", json={"ids": [1]}).status_code == 404
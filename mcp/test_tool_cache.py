@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests du cache des résultats d'outils
+"""
+import sys
+from datetime import datetime, timedelta
+
+from catalog import CatalogDocuments
+from models import Product
+from tool_cache import ToolResultCache, CATALOG_TAG, code_tag, parse_ttls, product_tags
+
+
+def test_key_ignores_argument_order():
+    key = ToolResultCache.key("search_sylius_products", {"query": "sac", "limit": 5}, "mcp")
+    assert key == ToolResultCache.key("search_sylius_products", {"limit": 5, "query": "sac"}, "mcp")
+    assert key != ToolResultCache.key("search_sylius_products", {"limit": 5, "query": "sac"}, "tools")
+
+
+def test_hits_misses_and_ttl():
+    cache = ToolResultCache({"get_sylius_product_by_code": 60, "hello_world": 0})
+    key = cache.key("get_sylius_product_by_code", {"code": "SAC"}, "mcp")
+
+    assert cache.get(key) is None
+    cache.put(key, '{"content":[]}')
+    assert cache.get(key) == '{"content":[]}'
+    assert not cache.is_cacheable("hello_world")
+
+    cache._entries[key].expires_at = 0
+    assert cache.get(key) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_lru_eviction_is_bounded_by_bytes():
+    payload = "x" * 100
+    cache = ToolResultCache({"search_sylius_products": 60}, max_bytes=3 * sys.getsizeof(payload))
+    keys = [cache.key("search_sylius_products", {"query": str(i)}, "mcp") for i in range(4)]
+    for key in keys[:3]:
+        cache.put(key, payload)
+    cache.get(keys[0])
+    cache.put(keys[3], payload)
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == payload
+    assert cache.evictions == 1
+    assert cache.bytes <= cache.max_bytes
+
+
+def test_invalidation_by_product():
+    cache = ToolResultCache({"get_sylius_product_by_code": 60, "search_sylius_products": 60})
+    by_code = cache.key("get_sylius_product_by_code", {"code": "SAC"}, "mcp")
+    other = cache.key("get_sylius_product_by_code", {"code": "CHAPEAU"}, "mcp")
+    search = cache.key("search_sylius_products", {"query": "sac"}, "mcp")
+    cache.put(by_code, "sac", product_tags({"id": 4, "code": "SAC"}))
+    cache.put(other, "chapeau", product_tags({"id": 5, "code": "CHAPEAU"}) | {code_tag("CHAPEAU")})
+    cache.put(search, "[]", {CATALOG_TAG})
+
+    assert cache.invalidate_products(ids=[4], catalog_changed=False) == 1
+    assert cache.get(by_code) is None
+    assert cache.get(search) == "[]"
+    assert cache.invalidate_products(codes=["CHAPEAU"]) == 2
+    assert cache.get(other) is None and cache.get(search) is None
+
+
+def test_parse_ttls():
+    assert parse_ttls("search_sylius_products=5, get_sylius_products=0") == {
+        "search_sylius_products": 5.0, "get_sylius_products": 0.0
+    }
+
+
+def test_translations_without_the_snapshot_invalidate_the_cache(db):
+    documents = CatalogDocuments()
+    cache = ToolResultCache({"get_sylius_product_by_code": 60, "search_sylius_products": 60})
+    cache.attach(documents)
+    documents.load_full(db)
+    by_code = cache.key("get_sylius_product_by_code", {"code": "PRODUCT_3"}, "mcp")
+    other = cache.key("get_sylius_product_by_code", {"code": "PRODUCT_5"}, "mcp")
+    missing = cache.key("get_sylius_product_by_code", {"code": "NEW"}, "mcp")
+    cache.put(by_code, "shirt 3", product_tags({"id": 4, "code": "PRODUCT_3"}))
+    cache.put(other, "shirt 5", product_tags({"id": 6, "code": "PRODUCT_5"}))
+    cache.put(missing, "not found", {code_tag("NEW"), CATALOG_TAG})
+
+    product = db.get(Product, 4)
+    product.translations[0].name = "Renamed"
+    product.updated_at = datetime.utcnow() + timedelta(minutes=1)
+    db.commit()
+    assert documents.refresh(db) == ({4}, set())
+
+    assert cache.get(by_code) is None and cache.get(missing) is None
+    assert cache.get(other) == "shirt 5"
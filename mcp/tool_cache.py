@@ -0,0 +1,200 @@
+"""
+Cache des résultats d'outils MCP
+
+Les réponses déjà sérialisées (octets JSON prêts à être renvoyés) sont gardées
+par clé ``(outil, transport, arguments normalisés)`` : un succès du cache évite
+à la fois MySQL et ``json.dumps``. Chaque outil a sa durée de vie, la taille
+totale est bornée (éviction LRU) et chaque entrée est étiquetée avec les ids
+et codes produits qu'elle contient pour pouvoir l'invalider quand le
+catalogue change.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+TOOL_CACHE = os.getenv("TOOL_CACHE", "1") != "0"
+TOOL_CACHE_MAX_BYTES = int(os.getenv("TOOL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Étiquette des résultats de liste/recherche : tout changement du catalogue
+# peut y ajouter un produit, ils sont donc invalidés à chaque changement
+CATALOG_TAG = "catalog"
+
+Key = Tuple[str, str, str]
+
+
+def parse_ttls(spec: str) -> Dict[str, float]:
+    """Lit une spécification "outil=ttl,outil=ttl" """
+    ttls = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, ttl = item.split("=", 1)
+            ttls[name.strip()] = float(ttl)
+    return ttls
+
+
+class _Entry:
+    __slots__ = ("payload", "size", "expires_at", "tags")
+
+    def __init__(self, payload: bytes, expires_at: float, tags: Set[str]):
+        self.payload = payload
+        self.size = sys.getsizeof(payload)
+        self.expires_at = expires_at
+        self.tags = tags
+
+
+class ToolResultCache:
+    """Cache LRU borné en octets, avec TTL par outil et invalidation par étiquette"""
+
+    def __init__(self, ttls: Dict[str, float], max_bytes: int = TOOL_CACHE_MAX_BYTES, enabled: bool = True):
+        self.ttls = dict(ttls)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._entries: "OrderedDict[Key, _Entry]" = OrderedDict()
+        self._tags: Dict[str, Set[Key]] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def set_default_ttl(self, tool_name: str, ttl: float) -> None:
+        """Durée de vie déclarée par l'outil, sauf si surchargée par l'environnement"""
+        self.ttls.setdefault(tool_name, ttl)
+
+    def is_cacheable(self, tool_name: str) -> bool:
+        return self.enabled and self.ttls.get(tool_name, 0) > 0
+
+    @staticmethod
+    def key(tool_name: str, arguments: Dict[str, Any], transport: str) -> Key:
+        """Clé indépendante de l'ordre des arguments"""
+        normalized = {k: v for k, v in arguments.items() if v is not None}
+        return tool_name, transport, json.dumps(normalized, sort_keys=True, separators=(",", ":"), default=str)
+
+    def get(self, key: Key) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.payload
+
+    def put(self, key: Key, payload: bytes, tags: Iterable[str] = ()) -> None:
+        ttl = self.ttls.get(key[0], 0)
+        if not self.enabled or ttl <= 0:
+            return
+        entry = _Entry(payload, time.monotonic() + ttl, set(tags))
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self.bytes += entry.size
+            for tag in entry.tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, key: Key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """Supprime toutes les entrées portant une des étiquettes"""
+        dropped = 0
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._drop(key)
+                    dropped += 1
+            self.invalidations += dropped
+        return dropped
+
+    def invalidate_products(self, ids: Iterable[int] = (), codes: Iterable[str] = (), catalog_changed: bool = True) -> int:
+        """Invalide les entrées qui contiennent ces produits (et les listes si demandé)"""
+        tags = [product_tag(pid) for pid in ids] + [code_tag(code) for code in codes]
+        if catalog_changed:
+            tags.append(CATALOG_TAG)
+        return self.invalidate_tags(tags)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "ttls": self.ttls,
+            }
+
+    def attach(self, source) -> None:
+        """Invalide les entrées touchées à chaque changement d'une source du catalogue (snapshot ou traductions)
+
+        Seul le snapshot connaît les codes : les résultats « introuvable » portent
+        donc aussi CATALOG_TAG, invalidée à chaque changement.
+        """
+        def on_change(changed: Set[int], removed: Set[int]) -> None:
+            products = getattr(source, "products", None) or {}
+            codes = [products[pid]["code"] for pid in changed if pid in products]
+            self.invalidate_products(ids=changed | removed, codes=codes)
+
+        source.add_listener(on_change)
+
+
+def product_tag(product_id: int) -> str:
+    return f"product:{product_id}"
+
+
+def code_tag(code: str) -> str:
+    return f"code:{code}"
+
+
+def product_tags(products: Any) -> Set[str]:
+    """Étiquettes d'un résultat d'outil (produit, liste de produits ou rien)"""
+    if isinstance(products, dict):
+        products = [products]
+    tags = set()
+    for product in products or ():
+        if isinstance(product, dict):
+            if "id" in product:
+                tags.add(product_tag(product["id"]))
+            if "code" in product:
+                tags.add(code_tag(product["code"]))
+    return tags
+
+
+# Durées de vie déclarées par les outils, surchargées par TOOL_CACHE_TTLS="outil=ttl,..."
+tool_cache = ToolResultCache(parse_ttls(os.getenv("TOOL_CACHE_TTLS", "")), enabled=TOOL_CACHE)
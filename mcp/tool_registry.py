@@ -0,0 +1,112 @@
+"""
+Registre des outils MCP
+
+Chaque outil est déclaré une seule fois (nom, description, schéma d'entrée,
+handler, durée de cache) ; la résolution est une simple recherche dans un
+dictionnaire. Les listes d'outils servies par ``tools/list`` et ``GET /tools``
+sont sérialisées une fois pour toutes, avec un ETag.
+"""
+import hashlib
+import inspect
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Set
+
+from encoding import dumps
+
+
+class ToolError(Exception):
+    """Erreur renvoyée à l'appelant (code JSON-RPC, -32602 : paramètres invalides)"""
+
+    def __init__(self, message: str, code: int = -32602):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+@dataclass
+class ToolResult:
+    """Résultat d'un outil, indépendant du transport"""
+    data: Any
+    # Texte du contenu MCP ; par défaut la sérialisation JSON de `data`
+    text: Optional[str] = None
+    # Ligne placée avant le JSON dans le texte MCP
+    summary: Optional[str] = None
+    # Champs ajoutés au résultat des deux transports (ex. next_cursor)
+    extra: Dict[str, Any] = field(default_factory=dict)
+    # Étiquettes d'invalidation du cache
+    tags: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class Tool:
+    name: str
+    description: str
+    input_schema: Dict[str, Any]
+    handler: Callable[[Dict[str, Any]], Any]
+    is_async: bool
+    cache_ttl: float = 0.0
+
+    def validate(self, arguments: Dict[str, Any]) -> None:
+        """Vérifie les paramètres obligatoires du schéma (0, False ou "" sont des valeurs)"""
+        for name in self.input_schema.get("required", ()):
+            if arguments.get(name) is None:
+                raise ToolError(f"Parameter '{name}' is required")
+
+    async def call(self, arguments: Dict[str, Any]) -> ToolResult:
+        self.validate(arguments)
+        result = await self.handler(arguments) if self.is_async else self.handler(arguments)
+        return result if isinstance(result, ToolResult) else ToolResult(data=result)
+
+
+@dataclass
+class ToolListing:
+    """Listes d'outils pré-sérialisées"""
+    mcp_result: bytes
+    http_body: bytes
+    etag: str
+
+
+class ToolRegistry:
+    def __init__(self):
+        self.tools: Dict[str, Tool] = {}
+        self._listing: Optional[ToolListing] = None
+
+    def tool(self, name: str, description: str, input_schema: Optional[Dict[str, Any]] = None,
+             cache_ttl: float = 0.0):
+        """Décorateur : enregistre le handler `handler(arguments)` sous `name`"""
+        def decorator(handler):
+            self.register(Tool(
+                name=name,
+                description=description,
+                input_schema=input_schema or {"type": "object", "properties": {}},
+                handler=handler,
+                is_async=inspect.iscoroutinefunction(handler),
+                cache_ttl=cache_ttl,
+            ))
+            return handler
+        return decorator
+
+    def register(self, tool: Tool) -> None:
+        self.tools[tool.name] = tool
+        self._listing = None
+
+    def get(self, name: Optional[str]) -> Optional[Tool]:
+        return self.tools.get(name) if name else None
+
+    def listing(self) -> ToolListing:
+        """Listes d'outils sérialisées au premier appel puis réutilisées"""
+        if self._listing is None:
+            mcp_result = dumps({"tools": [
+                {"name": t.name, "description": t.description, "inputSchema": t.input_schema}
+                for t in self.tools.values()
+            ]})
+            http_body = dumps({"tools": [
+                {"name": t.name, "description": t.description, "parameters": t.input_schema}
+                for t in self.tools.values()
+            ]})
+            etag = '"%s"' % hashlib.sha1(mcp_result + http_body).hexdigest()
+            self._listing = ToolListing(mcp_result=mcp_result, http_body=http_body, etag=etag)
+        return self._listing
+
+
+registry = ToolRegistry()